@@ -1,6 +1,146 @@
 """
 薬局 年間処方箋枚数 多面的予測ツール v4.4
 ==========================================
+v4.5（開発中）主な変更点: 外部API呼び出しの削減・高速化
+
+  1. ジオコーディング永続キャッシュ (GeocodeCache)
+     _clean() 正規化済み住所をキーに SQLite へ座標・採用バリアントを保存。
+     成功 180日 / 失敗（ネガティブ）7日 の TTL。通信エラーが絡む失敗はキャッシュしない。
+     保存先: ~/.cache/pharmacy_rx_predictor（環境変数 PHARMACY_RX_CACHE_DIR で変更可）
+
+  2. GSI バリアント並列解決 (GeocoderService(parallel_variants=True))
+     _build_variants() の各バリアントを最大3並列で GSI に発行し、
+     優先順位が最も高い成功バリアントを採用して残りをキャンセル。
+     全バリアント失敗時のみ Nominatim（逐次）へフォールバック。
+
+  3. オフライン住所ジオコーダー (AddressPointIndex)
+     国土交通省 位置参照情報（街区 / 大字・町丁目レベル）CSV を SQLite に取り込み、
+     「都道府県+市区町村+町丁目+番地」をローカルで解決（通信なし・1ms未満）。
+     未登録の住所のみ GSI / Nominatim へ問い合わせる。番地付きの住所で街区が未登録
+     （町丁目の代表点にしか当たらない）場合は GSI を先に使い、GSI が住所全体で
+     解決できなかった時だけ代表点で代替する。
+     取り込み: python app_v4_4.py ingest-address-points <CSV または ZIP>...
+
+  4. 一括ジオコーディング (GeocoderService.geocode_many)
+     正規化後に同一となる住所を重複排除し、ローカル解決・キャッシュヒット分を先に返した上で
+     残りを最大3並列で解決して完了順にストリーム返却（ジェネレータ）。
+     MHLW補填・両校正エンジンで使用。
+
+  5. 構造化住所パーサー (parse_address → ParsedAddress)
+     都道府県・既知の市区名をトライで先頭一致させ、郡・市区町村・政令市の区・町丁目・
+     番地を1パスで分解（lru_cache でメモ化）。人口密度ルックアップ・エリアキーワード・
+     都道府県コード判定 (pref_code_from_address) が共通で使用。
+     「東大阪市」→大阪市平均、「東京都八王子市」→東京都平均 などの部分一致誤判定を解消。
+
+  6. MHLW補填の町丁目プリフィルタ (_prefilter_candidates_by_town)
+     候補住所の町丁目の代表点（位置参照情報 / ジオコード結果から学習した重心）が
+     半径 + 町丁目の広がり + TOWN_PREFILTER_MARGIN_M より遠い候補はジオコーディングせずに除外。
+     薬局と同じ町（逆ジオコーダーで1回だけ取得）の候補・広がり不明の候補は常に対象
+     （大きな大字でも補填される施設は変えない）。補填結果は MHLW の検索順のまま。
+
+  7. ホスト別レート制限 (HostRateLimiter / RATE_LIMITS)
+     GSI・Nominatim・Overpass・MHLW ごとのトークンバケットを flock 付きの状態ファイルで
+     共有し、スレッド・Streamlit プロセスを跨いで各サービスの許容レートを守る。
+     各所の固定 time.sleep（0.12〜1.1秒）を廃止し、トークンがある間は待たずに発行。
+
+  8. Overpass 応答キャッシュ (OverpassCache)
+     取得中心を 0.002° タイルにスナップし、半径を 500m 単位で切り上げた円で取得・保存。
+     要求円が既存の大きな円に内包されればローカルの距離フィルタだけで応答（14日 TTL）。
+     削除: python app_v4_4.py purge-cache [--all]
+
+  9. ローカルOSM抽出 (LocalOSMStore)
+     地域の OSM 抽出（XML は2パス iterparse）/ Overpass JSON から、Overpass クエリと
+     同じ抽出条件 (OVERPASS_TAG_FILTERS) の医療機関・薬局のみを SQLite R*Tree に取り込み、
+     取り込み範囲内の search_nearby を数ミリ秒で処理。範囲外のみ Overpass API へ。
+     取り込み: python app_v4_4.py import-osm <ファイル>... [--replace]
+
+  10. 校正バッチの OSM 一括取得 (OverpassSearcher.prefetch / search_many)
+     校正セット全地点の取得円を一辺10km以内の矩形にまとめ、矩形ごとに bbox クエリを1回発行。
+     応答を格子バケットで地点ごとに切り分けて OverpassCache に保存し、各地点の予測は
+     キャッシュから処理（ローカル校正 15薬局で 15回 → 1〜2回）。
+
+  11. Overpass スケジューラー (OverpassScheduler / CircuitBreaker)
+     発行前に /api/status で空きスロットを確認し、空くまで待てる範囲なら待機・無理なら次のミラーへ。
+     エンドポイントは OVERPASS_ENDPOINTS（環境変数 PHARMACY_RX_OVERPASS_URLS で自前インスタンス等に変更可）。
+     連続失敗（429・5xx・タイムアウト）したエンドポイントは2分間遮断し、待たずに次へ回す。
+     取得失敗は結果画面に警告表示（従来は「施設0件」として黙って全国中央値相当を返していた）。
+
+  12. Overpass 応答のストリーム解析・列指向テーブル (FacilityTable)
+     応答を受信しながら要素を1件ずつ解析し、座標・種別・診療科コード・病床数・医師数・
+     院内薬局フラグを array 列に格納。NearbyFacility.osm_tags はモデルが読むタグ
+     (OSM_MODEL_TAGS) のみとし、全タグは NearbyFacility.osm_ref から必要な時だけ
+     ローカルOSM・Overpass キャッシュ（なければ Overpass API）で引く（OverpassSearcher.full_tags）。
+     広い商圏（SM業態 〜4.5km）での解析時間とセッションあたりのメモリを削減。
+
+  13. MHLW ページ解析の lxml 高速パス (LxmlPageParser)
+     候補一覧の div.item・詳細ページの tr / dl だけを XPath で取り出し、ページ全体の
+     BeautifulSoup ツリーを作らない。ページ全文の正規表現フォールバックも必要な場合のみ生成。
+     lxml 未導入時は従来の Bs4PageParser。比較: python app_v4_4.py bench-parsers <HTML>...
+
+  14. MHLW ページのスナップショット保存 (MHLWSnapshotStore)
+     取得した候補一覧・詳細ページを本文 SHA-256 で重複排除・zlib 圧縮して URL・取得時刻と共に保存。
+     30日 (MHLW_SNAPSHOT_MAX_AGE_S) 以内に取得済みのページは通信せずに再利用。
+     解析器の改良後は保存済み全ページを通信なしで再解析: python app_v4_4.py reparse-snapshots
+     ベンチマークの固定データにも利用: python app_v4_4.py bench-parsers --snapshots
+
+  15. MHLW 検索結果ページの並列取得 (MHLWScraper._search_candidates)
+     1ページ目で総件数が分かった後、残りのページを最大3並列で取得（レートは共有トークンバケット）し、
+     ページ順に連結・kikan_cd で重複除去。エリア補填・ローカル校正の候補収集が短縮。
+
+  16. MHLW 薬局レジストリ (PharmacyRegistry / RegistryCrawler)
+     都道府県内の全薬局の一覧・詳細（年間処方箋枚数）をレート制限内で取得して SQLite 台帳に保存。
+     一覧はページごと・詳細は1件ごとにチェックポイントを残し、中断しても続きから再開。
+     クロール完了済みの都道府県では、両校正エンジンの校正セットを台帳から抽出（通信なし）。
+     実行: python app_v4_4.py crawl-registry --pref 13 [--all] / 校正タブからバックグラウンド実行
+
+  17. 競合薬局の処方箋枚数を台帳照合で付与 (enrich_competitor_rx)
+     レジストリに住所の座標を付与（クロールの最終段階）し、OSM の競合薬局を
+     「近傍セル（空間ブロッキング）× 300m 以内 × 名称類似度」で台帳の薬局に1対1で対応付け。
+     上位10件に限らず全競合薬局に即時に付与し、照合できなかった薬局だけ従来の名称検索（最大10件）。
+
+  18. MHLW セッションプール (MHLWSessionPool)
+     初期化済みセッションをプロセス共通で貸し出し・再利用（Streamlit セッション間でも共有・keep-alive）。
+     1回の分析で複数のスクレイパーを作っても、初期化の通信は期限切れ（最終通信から20分）のときだけ。
+     セッション切れの応答は自動で初期化し直して再送。Cookie は JSON に保存し再起動後も再利用。
+
+  19. 外部呼び出しポリシー (CallPolicy / call_with_policy / CallStatus)
+     GSI・Nominatim・Overpass・MHLW の全 HTTP 呼び出しに、呼び出し全体の期限・
+     429/5xx/タイムアウト時のジッター付き指数バックオフ再試行・ホスト単位のサーキットブレーカーを適用。
+     失敗は CallStatus（種類・試行回数・所要時間）として各サービスの last_status に残し
+     （MHLW は並列取得があるため呼び出しごとに返す）、
+     MHLW 遮断中は後続の MHLW 処理を省略・結果画面に取得できなかった外部データを警告表示。
+     Overpass の /api/status 確認は interpreter とは別のブレーカーで数える。
+     通信なしの回帰チェック: python app_v4_4.py self-check
+
+  20. MHLW 医療機関レジストリ (MedicalRegistry / MedicalRegistryCrawler)
+     薬局レジストリと同じ仕組みで県内の全医療機関を取得し、名称・住所・座標・診療科・
+     1日平均外来患者数（記載があれば）を R*Tree 空間索引つきの SQLite に保存。
+     クロール完了済みの都道府県では MHLW補填をエリア検索・ジオコーディングなしに台帳から行い、
+     OSM の医療機関にも外来患者数の実数を付与（実数を持つ施設は密集補正の対象外）。
+     実行: python app_v4_4.py crawl-registry --pref 13 --medical / 校正タブから「医療機関」を選んで実行
+
+  21. 方法①シェア計算の NumPy エンジン (Method1Predictor.calc_shares)
+     施設×競合薬局の距離行列を一度だけ作り、門前判定（≤50m）・Huff 按分（≤300m）・
+     距離帯別ベース・上限0.90 を配列演算で計算（従来のループと同じ結果。numpy 未導入時は従来処理）。
+     比較: python app_v4_4.py bench-m1 [--sizes 50 500 5000]
+     （50m・300m ちょうどの境界・競合なし・同一地点・外来0 の一致は self-check で確認）
+
+  22. 近傍検索の空間索引 (GridIndex)
+     メートル換算の正方セルに点を登録するグリッドハッシュ。方法①の50m/300m判定・
+     方法②の門前的競合（100m）・MHLW補填のOSM重複判定（80m）・台帳照合の総当たりを置き換え
+     （結果は総当たりと同じ）。門前判定（80m）は計算済みの距離で最寄り施設を線形に探すだけに。
+
+  23. 分析ごとの幾何コンテキスト (AreaGeometry)
+     地点距離（OSM 解析時の計算値を取り込み）・施設集合ごとの空間索引と近傍検索結果・
+     NumPy 用距離行列を1回の分析で保持し、方法①②・全シナリオ・校正の各地点で共有。
+     分析結果に持たせ、手動追加・MHLW補填の再実行による再計算では距離を計算し直さない。
+  24. 方法①の施設別寄与の差分更新（ContributionLedger）
+     既存薬局分析の施設別シェア・流入と門前的競合の参照数を台帳に持ち、手動追加・削除や
+     MHLW補填では増減した施設だけを計算し直す（合計流入は O(1) で更新）。
+  25. 競合薬局の開閉 what-if（toggle_competitor / add_hypothetical_competitor）
+     既存薬局分析で競合薬局の閉局・再開、地図クリック地点への仮想出店を再取得なしで試算。
+     方法①は増減した薬局から300m以内の施設のシェアだけ、方法②は有効競合数だけを計算し直す。
+
 v4.4 主な変更点: SM業態M2過大推計修正 + 密度帯ラベルバグ修正 + ローカルMHLW校正
 
   【v4.4 改善概要】
@@ -183,16 +323,40 @@ v3.2 Changelog（参照のみ）:
   4. MHLW医療機関エリア自動補填
 """
 
+import argparse
+import bz2
+import codecs
+import copy
 import csv
 import dataclasses
+import difflib
+import functools
+import gzip
+import hashlib
 import io
+import itertools
+import json
 import math
+import os
+import random
 import re
+import sqlite3
+import struct
+import sys
+import threading
 import time
+import unicodedata
 import urllib.parse
+import weakref
+import xml.etree.ElementTree as ET
+import zipfile
+import zlib
+from array import array
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 from dataclasses import dataclass, field
 from datetime import datetime
-from typing import Callable, Dict, List, Optional, Tuple
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
 import folium
 import requests
@@ -200,6 +364,21 @@ import streamlit as st
 from bs4 import BeautifulSoup
 from streamlit_folium import st_folium
 
+try:
+    import fcntl   # v4.5: HostRateLimiter のプロセス間排他（POSIX のみ）
+except ImportError:
+    fcntl = None
+
+try:
+    from lxml import etree as lxml_etree, html as lxml_html   # v4.5: MHLW ページ解析の高速パス
+except ImportError:
+    lxml_etree = lxml_html = None
+
+try:
+    import numpy as np   # v4.5: 方法①シェア計算のベクトル化エンジン
+except ImportError:
+    np = None
+
 # ---------------------------------------------------------------------------
 # 定数・統計データ
 # ---------------------------------------------------------------------------
@@ -232,6 +411,7 @@ PREFECTURE_CODES: Dict[str, str] = {
 # 概ね60〜80%を捕捉する。中央値として70%を採用。
 # 出典: 調剤薬局業界実態調査・門前薬局シェア分析（日本薬剤師会等）
 GATE_PHARMACY_CAPTURE_RATE: float = 0.70   # 既存門前薬局の推定処方箋捕捉率
+GATE_COMPETITOR_RADIUS_M: float = 100.0    # 方法②: 医療機関からこの距離以内の競合薬局を「門前的競合」とする
 
 # 全国統計（厚生労働省「調剤医療費の動向」2022年度）
 NATIONAL_STATS = {
@@ -571,6 +751,182 @@ class NearbyFacility:
     mhlw_annual_outpatients: Optional[int] = None  # 処方箋枚数（薬局）or 年間外来数（医療機関）
     is_manual: bool = False   # v2.4: 手動追加施設フラグ（OSM未収録）
     source: str = "osm"       # v2.6: "osm" | "mhlw" | "manual"
+    osm_ref: str = ""         # v4.5: OSM 参照（例: "node/123"）。全タグは OverpassSearcher.full_tags() で取得
+
+
+# ---------------------------------------------------------------------------
+# v4.5: 構造化住所パーサー（都道府県・市区町村・区・町丁目・番地を1パスで分解）
+# ---------------------------------------------------------------------------
+
+_KANJI_DIGITS: Dict[str, int] = {
+    "〇": 0, "一": 1, "二": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9,
+}
+_ADDRESS_DASH_RE = re.compile(r"[‐‑‒–—―−﹣]")
+
+
+def _kanji_numeral_to_int(s: str) -> int:
+    """漢数字（〜九十九）を整数に変換（例: "十二" → 12, "二十" → 20）"""
+    total, cur = 0, 0
+    for ch in s:
+        if ch == "十":
+            total += (cur or 1) * 10
+            cur = 0
+        else:
+            cur = cur * 10 + _KANJI_DIGITS[ch]
+    return total + cur
+
+
+# 政令指定都市（「市 + 行政区」の2段構成）
+DESIGNATED_CITIES = frozenset([
+    "札幌市", "仙台市", "さいたま市", "千葉市", "横浜市", "川崎市", "相模原市",
+    "新潟市", "静岡市", "浜松市", "名古屋市", "京都市", "大阪市", "堺市",
+    "神戸市", "岡山市", "広島市", "北九州市", "福岡市", "熊本市",
+])
+
+
+class _NameTrie:
+    """文字単位のトライ。start 位置から一致する最長の登録名を返す"""
+
+    _END = "\0"
+
+    def __init__(self, names):
+        self._root: Dict[str, Dict] = {}
+        for name in names:
+            node = self._root
+            for ch in name:
+                node = node.setdefault(ch, {})
+            node[self._END] = name
+
+    def longest_prefix(self, text: str, start: int = 0) -> Optional[str]:
+        node, best = self._root, None
+        for ch in text[start:]:
+            node = node.get(ch)
+            if node is None:
+                break
+            best = node.get(self._END, best)
+        return best
+
+
+# 名称の途中に「村」「郡」等を含み、正規表現では誤分割される市
+# （「郡」を含む市は郡＋町村と誤読される: 「蒲郡市港町」→ 蒲郡 + 市港町）
+_IRREGULAR_CITY_NAMES = [
+    "東村山市", "武蔵村山市",
+    "郡山市", "大和郡山市", "蒲郡市", "郡上市", "小郡市",
+]
+# 名称に「市」を含み、正規表現では市と誤読される郡（「余市郡余市町」→ 余市 + 郡余市町）
+_IRREGULAR_COUNTY_NAMES = ["余市郡", "高市郡"]
+
+_PREF_TRIE = _NameTrie(PREFECTURES)
+# 既知の市区名はトライで確定し、未登録の市区町村は正規表現で分解する
+_CITY_TRIE = _NameTrie(
+    list(CITY_DENSITY) + list(TOKYO_WARD_DENSITY) + list(DESIGNATED_CITIES) + _IRREGULAR_CITY_NAMES
+)
+_WARD_TRIE = _NameTrie(OSAKA_WARD_DENSITY)
+_COUNTY_TRIE = _NameTrie(_IRREGULAR_COUNTY_NAMES)
+
+_CITY_RE = re.compile(r"(?:[^\d市区町]+?郡)?(?P<city>[^\d]+?[市区町村])(?P<dup>[市町村])?")
+_WARD_RE = re.compile(r"[^\d]{1,5}?区")
+_CHOME_RE = re.compile(r"([〇一二三四五六七八九十]+)丁目")
+
+
+@dataclass(frozen=True)
+class ParsedAddress:
+    """parse_address() の結果。見つからない要素は空文字"""
+    pref: str = ""
+    pref_code: str = ""
+    county: str = ""     # 郡（「入間郡三芳町」の「入間郡」）
+    city: str = ""       # 市区町村（東京23区は区名、政令市は市名）
+    ward: str = ""       # 政令市の行政区
+    town: str = ""       # 大字・町丁目名（丁目を除く）
+    chome: str = ""      # 丁目（算用数字）
+    banchi: str = ""     # 番地・号（"12-3" 形式）
+
+    @property
+    def area(self) -> str:
+        """最小行政区画（政令市の区 → 市区町村）"""
+        return self.ward or self.city
+
+
+@functools.lru_cache(maxsize=8192)
+def parse_address(address: str) -> ParsedAddress:
+    """
+    住所を ParsedAddress に分解する（メモ化済み・同じ住所の再解析は辞書参照のみ）。
+
+    都道府県・既知の市区名はトライで先頭一致（最長一致）させるため、
+    「東大阪市」が「大阪市」に、大阪市の「北区」が東京都の「北区」に誤一致しない。
+    丁目の無い「成増1-12-3」形式は先頭の番号を丁目とみなす（3要素以上の場合）。
+    """
+    if not address:
+        return ParsedAddress()
+    a = unicodedata.normalize("NFKC", address)
+    a = re.sub(r"〒?\s*\d{3}-\d{4}", "", a)
+    a = re.sub(r"\s+", "", a)
+    a = _ADDRESS_DASH_RE.sub("-", a)
+
+    # ── 都道府県（先頭とは限らない: "日本、東京都…" 等）
+    pref, pos = "", 0
+    for i in range(len(a)):
+        hit = _PREF_TRIE.longest_prefix(a, i)
+        if hit:
+            pref, pos = hit, i + len(hit)
+            break
+
+    # ── 郡・市区町村
+    county = _COUNTY_TRIE.longest_prefix(a, pos) or ""
+    pos += len(county)
+    city = ""
+    known = _CITY_TRIE.longest_prefix(a, pos)
+    m = None if known else _CITY_RE.match(a, pos)
+    if known:
+        city, pos = known, pos + len(known)
+    elif m:
+        city = m.group("city") + (m.group("dup") or "")   # 「四日市市」「十日町市」
+        county = county or a[pos:m.start("city")]
+        pos = m.end()
+
+    # ── 政令市の行政区
+    ward = ""
+    if city in DESIGNATED_CITIES:
+        known_ward = _WARD_TRIE.longest_prefix(a, pos) if city == "大阪市" else None
+        wm = None if known_ward else _WARD_RE.match(a, pos)
+        ward = known_ward or (wm.group() if wm else "")
+        pos += len(ward)
+
+    # ── 町丁目・番地
+    rest = _CHOME_RE.sub(lambda c: f"{_kanji_numeral_to_int(c.group(1))}丁目", a[pos:])
+    rest = re.sub(r"(\d+)番地?", r"\1-", rest)
+    rest = re.sub(r"(\d+)号", r"\1", rest)
+    rest = re.sub(r"(?<=\d)[のノ](?=\d)", "-", rest)
+    town, chome, banchi = rest, "", ""
+    cm = re.search(r"(\d+)丁目", rest)
+    if cm:
+        town, chome = rest[:cm.start()], cm.group(1)
+        bm = re.match(r"-?(\d+(?:-\d+)*)", rest[cm.end():])
+        banchi = bm.group(1) if bm else ""
+    else:
+        nm = re.search(r"\d+(?:-\d+)*", rest)
+        if nm:
+            town = rest[:nm.start()]
+            nums = nm.group().split("-")
+            if len(nums) >= 3:
+                chome, nums = nums[0], nums[1:]
+            banchi = "-".join(nums)
+
+    return ParsedAddress(
+        pref=pref,
+        pref_code=PREFECTURE_CODES.get(pref, ""),
+        county=county,
+        city=city,
+        ward=ward,
+        town=town.rstrip("-"),
+        chome=chome,
+        banchi=banchi,
+    )
+
+
+def pref_code_from_address(address: str) -> str:
+    """住所から MHLW 検索用の都道府県コード（"13" 等）を返す。不明なら空文字"""
+    return parse_address(address).pref_code
 
 
 # ---------------------------------------------------------------------------
@@ -587,6 +943,149 @@ def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> fl
     return R * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
 
 
+def _haversine_array(lat1, lon1, lat2, lon2):
+    """v4.5: haversine_distance の NumPy 版（配列はブロードキャストされる）"""
+    R = 6_371_000
+    p1, p2 = np.radians(lat1), np.radians(lat2)
+    dp, dl = np.radians(lat2 - lat1), np.radians(lon2 - lon1)
+    a = np.sin(dp / 2) ** 2 + np.cos(p1) * np.cos(p2) * np.sin(dl / 2) ** 2
+    return R * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+class GridIndex:
+    """
+    v4.5: 点集合の半径検索用グリッドハッシュ（メートル換算の正方セル）
+
+    点を「緯度 × 基準緯度で縮めた経度」の平面セルに登録し、within() は
+    検索円を覆うセルの点だけを haversine_distance で判定する（結果は総当たりと同じ）。
+    分析ごとに施設リストから作り直す前提で、構築は O(n)。
+    """
+
+    _M_PER_DEG = 6_371_000 * math.pi / 180   # 経線方向 1度あたりの距離 [m]（haversine_distance と同じ球）
+
+    def __init__(self, points: Iterable[Tuple[float, float]], cell_m: float = 100.0):
+        self.points: List[Tuple[float, float]] = list(points)
+        self.cell_m = max(1.0, cell_m)
+        lat0 = sum(p[0] for p in self.points) / len(self.points) if self.points else 0.0
+        self._m_per_deg_lon = self._M_PER_DEG * max(0.1, math.cos(math.radians(lat0)))
+        self._cells: Dict[Tuple[int, int], List[int]] = {}
+        for i, (lat, lon) in enumerate(self.points):
+            self._cells.setdefault(self._cell(lat, lon), []).append(i)
+        self._memo: Dict[Tuple[float, float, float], List[Tuple[int, float]]] = {}
+
+    @classmethod
+    def of(cls, facilities: Iterable["NearbyFacility"], cell_m: float = 100.0) -> "GridIndex":
+        return cls(((f.lat, f.lon) for f in facilities), cell_m)
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return (int(math.floor(lat * self._M_PER_DEG / self.cell_m)),
+                int(math.floor(lon * self._m_per_deg_lon / self.cell_m)))
+
+    def within(self, lat: float, lon: float, radius_m: float) -> List[Tuple[int, float]]:
+        """
+        (lat, lon) から radius_m 以内の点の (登録順の添字, 距離[m])。添字の昇順（総当たりのループと同じ順序）。
+        同じ問い合わせの結果は保持して使い回す（AreaGeometry 経由の再計算向け。返り値は変更しないこと）。
+        """
+        if not self.points:
+            return []
+        key = (lat, lon, radius_m)
+        if key in self._memo:
+            return self._memo[key]
+        # 検索円の外接矩形（経度方向は検索点の緯度で換算し、1% + 1m の余裕を持たせる）
+        d_lat = (radius_m * 1.01 + 1.0) / self._M_PER_DEG
+        d_lon = d_lat / max(0.05, math.cos(math.radians(min(abs(lat) + d_lat, 89.0))))
+        y0, x0 = self._cell(lat - d_lat, lon - d_lon)
+        y1, x1 = self._cell(lat + d_lat, lon + d_lon)
+        if (y1 - y0 + 1) * (x1 - x0 + 1) >= len(self.points):
+            cand: Iterable[int] = range(len(self.points))
+        else:
+            cand = sorted(i for y in range(y0, y1 + 1) for x in range(x0, x1 + 1)
+                          for i in self._cells.get((y, x), ()))
+        hits: List[Tuple[int, float]] = []
+        for i in cand:
+            d = haversine_distance(lat, lon, self.points[i][0], self.points[i][1])
+            if d <= radius_m:
+                hits.append((i, d))
+        self._memo[key] = hits
+        return hits
+
+
+# v4.5: AreaGeometry が保持する空間索引・距離行列の上限数（古いものから破棄）
+AREA_GEOMETRY_CACHE_ENTRIES: int = 8
+
+
+class AreaGeometry:
+    """
+    v4.5: 1回の分析（1地点）の幾何コンテキスト
+
+      site_distance(lat, lon)          : 地点 → 座標の距離（座標ごとに保持）
+      index(facilities, cell_m)        : 施設集合の空間索引（GridIndex。近傍検索の結果も索引が保持）
+      distance_matrix(rows, cols)      : 施設×施設の距離行列（方法①の NumPy エンジン用）
+    分析結果（FullAnalysis / NewPharmacyResult）に持たせ、方法①②の計算と
+    UI 操作による再計算（手動追加・MHLW補填の再実行等）で使い回す。
+    キーは施設の座標の組なので、施設の追加・削除があっても古い値は使われない。
+    """
+
+    def __init__(self, site_lat: float, site_lon: float):
+        self.site_lat = site_lat
+        self.site_lon = site_lon
+        self._site_d: Dict[Tuple[float, float], float] = {}
+        self._indexes: Dict[Tuple, GridIndex] = {}
+        self._matrices: Dict[Tuple, object] = {}
+
+    @classmethod
+    def for_site(cls, geometry: Optional["AreaGeometry"], lat: float, lon: float) -> "AreaGeometry":
+        """geometry が同じ地点のものならそれを、そうでなければ新しいコンテキストを返す"""
+        if geometry is not None and (geometry.site_lat, geometry.site_lon) == (lat, lon):
+            return geometry
+        return cls(lat, lon)
+
+    @staticmethod
+    def _key(facilities: Iterable["NearbyFacility"]) -> Tuple:
+        return tuple((f.lat, f.lon) for f in facilities)
+
+    @staticmethod
+    def _put(cache: Dict, key, value) -> None:
+        cache[key] = value
+        while len(cache) > AREA_GEOMETRY_CACHE_ENTRIES:
+            cache.pop(next(iter(cache)))
+
+    def seed_site_distances(self, facilities: Iterable["NearbyFacility"]) -> None:
+        """
+        OSM 解析時に計算済みの地点距離（FacilityTable の distance_m）を取り込む。
+        同じ地点・同じ式で求めた値なので site_distance() と一致する。
+        距離が丸められている MHLW補填・ユーザー入力の施設は取り込まない。
+        """
+        for f in facilities:
+            if f.source == "osm" and not f.is_manual:
+                self._site_d.setdefault((f.lat, f.lon), float(f.distance_m))
+
+    def site_distance(self, lat: float, lon: float) -> float:
+        key = (lat, lon)
+        d = self._site_d.get(key)
+        if d is None:
+            d = self._site_d[key] = haversine_distance(lat, lon, self.site_lat, self.site_lon)
+        return d
+
+    def index(self, facilities: List["NearbyFacility"], cell_m: float) -> GridIndex:
+        key = (self._key(facilities), cell_m)
+        idx = self._indexes.get(key)
+        if idx is None:
+            idx = GridIndex(key[0], cell_m)
+            self._put(self._indexes, key, idx)
+        return idx
+
+    def distance_matrix(self, rows: List["NearbyFacility"], cols: List["NearbyFacility"]):
+        """rows×cols の距離行列（numpy.ndarray。numpy 未導入時は使わないこと）"""
+        key = (self._key(rows), self._key(cols))
+        mat = self._matrices.get(key)
+        if mat is None:
+            r, c = np.array(key[0], dtype=float).reshape(-1, 2), np.array(key[1], dtype=float).reshape(-1, 2)
+            mat = _haversine_array(r[:, 0][:, None], r[:, 1][:, None], c[:, 0][None, :], c[:, 1][None, :])
+            self._put(self._matrices, key, mat)
+        return mat
+
+
 # 施設名キーワード → 診療科マッピング（長いキーワードを先に評価）
 _SPECIALTY_KW_MAP: List[Tuple[List[str], str]] = [
     (["整形外科"],                    "整形外科"),
@@ -626,19 +1125,9 @@ def extract_area_keyword(address: str) -> str:
       "埼玉県さいたま市浦和区常盤"       → "浦和区"
       "福岡県久留米市通外町10-1"         → "久留米市"
     """
-    # 政令市の区: 「市○○区」→ 区名
-    m = re.search(r'市([^\d\s・]{1,6}?区)', address)
-    if m:
-        return m.group(1)
-    # 東京23区: 「都○○区」→ 区名
-    m = re.search(r'都([^\d\s・]{1,6}?区)', address)
-    if m:
-        return m.group(1)
-    # その他: 都道府県直後の市区町村
-    m = re.search(r'[都道府県]([^\d\s・]{2,8}?[市区町村])', address)
-    if m:
-        return m.group(1)
-    return address[:10]
+    # v4.5: parse_address() の結果（政令市の区 → 東京23区・市区町村）を使用
+    area = parse_address(address).area
+    return area or address[:10]
 
 
 @dataclass
@@ -675,6 +1164,14 @@ class FullAnalysis:
     is_gate_pharmacy: bool = False
     gate_pharmacy_reason: str = ""
     search_log: List[str] = field(default_factory=list)
+    osm_error: str = ""   # v4.5: 近隣施設（OSM）を取得できなかった理由（空なら取得成功）
+    service_errors: List[str] = field(default_factory=list)   # v4.5: 失敗した外部呼び出し（CallStatus.summary()）
+    # v4.5: 分析の幾何コンテキスト（UI 操作による再計算で距離・空間索引を使い回す）
+    geometry: Optional["AreaGeometry"] = field(default=None, repr=False, compare=False)
+    # v4.5: 施設別寄与の台帳（手動追加・MHLW補填の増減を差分で再計算）
+    ledger: Optional["ContributionLedger"] = field(default=None, repr=False, compare=False)
+    # v4.5: what-if で閉局扱いにした競合薬局（nearby_pharmacies から外したもの。仮想出店は is_manual=True で nearby_pharmacies 側）
+    closed_pharmacies: List[NearbyFacility] = field(default_factory=list)
 
 @dataclass
 class NewPharmacyConfig:
@@ -709,6 +1206,10 @@ class NewPharmacyResult:
     method1_area: Optional[PredictionResult]   # シナリオB/C: 方法①（既存近隣施設のみ）
     method2: Optional[PredictionResult]        # シナリオB/C: 方法②（商圏人口動態）
     search_log: List[str] = field(default_factory=list)
+    osm_error: str = ""   # v4.5: 近隣施設（OSM）を取得できなかった理由（空なら取得成功）
+    service_errors: List[str] = field(default_factory=list)   # v4.5: 失敗した外部呼び出し（CallStatus.summary()）
+    # v4.5: 分析の幾何コンテキスト（UI 操作による再計算で距離・空間索引を使い回す）
+    geometry: Optional["AreaGeometry"] = field(default=None, repr=False, compare=False)
 
 
 # ---------------------------------------------------------------------------
@@ -811,23 +1312,21 @@ class CalibrationStats:
 def get_population_density(address: str) -> Tuple[int, str]:
     if not address:
         return 3000, "住所不明（中高密度デフォルト値）"
-    addr = address.strip()
-    if "東京都" in addr:
-        for ward, density in TOKYO_WARD_DENSITY.items():
-            if ward in addr:
-                return density, f"{ward}（東京都） 2020年国勢調査"
-        return 6263, "東京都平均（区未特定） 2020年国勢調査"
-    if "大阪市" in addr:
-        for ward, density in OSAKA_WARD_DENSITY.items():
-            if ward in addr:
-                return density, f"大阪市{ward} 2020年国勢調査"
+    # v4.5: 部分文字列走査をやめ parse_address() の分解結果で引く
+    #       （「東大阪市」→大阪市平均、「東京都八王子市」→東京都平均 等の誤判定を解消）
+    pa = parse_address(address)
+    if pa.pref == "東京都" and pa.city in TOKYO_WARD_DENSITY:
+        return TOKYO_WARD_DENSITY[pa.city], f"{pa.city}（東京都） 2020年国勢調査"
+    if pa.city == "大阪市":
+        if pa.ward in OSAKA_WARD_DENSITY:
+            return OSAKA_WARD_DENSITY[pa.ward], f"大阪市{pa.ward} 2020年国勢調査"
         return 12110, "大阪市平均（区未特定） 2020年国勢調査"
-    for city, density in CITY_DENSITY.items():
-        if city in addr:
-            return density, f"{city} 平均人口密度 2020年国勢調査"
-    for pref, density in PREFECTURE_DENSITY.items():
-        if pref in addr:
-            return density, f"{pref} 平均人口密度 2020年国勢調査"
+    if pa.city in CITY_DENSITY:
+        return CITY_DENSITY[pa.city], f"{pa.city} 平均人口密度 2020年国勢調査"
+    if pa.pref == "東京都":
+        return 6263, "東京都平均（区未特定） 2020年国勢調査"
+    if pa.pref in PREFECTURE_DENSITY:
+        return PREFECTURE_DENSITY[pa.pref], f"{pa.pref} 平均人口密度 2020年国勢調査"
     return 1500, "住所解析不能（中密度デフォルト値 1,500人/km²）"
 
 
@@ -840,9 +1339,10 @@ def detect_gate_pharmacy(
         if kw in pharmacy_name:
             return True, f"薬局名に「{kw}」が含まれる"
     if nearby_medical:
-        for fac in sorted(nearby_medical, key=lambda f: f.distance_m):
-            if fac.distance_m <= 80:
-                return True, f"「{fac.name}」({fac.distance_m:.0f}m)に隣接"
+        # v4.5: 距離は検索時に計算済み（distance_m）なので、最も近い施設だけを線形に探す
+        nearest = min(nearby_medical, key=lambda f: f.distance_m)
+        if nearest.distance_m <= 80:
+            return True, f"「{nearest.name}」({nearest.distance_m:.0f}m)に隣接"
         for fac in nearby_medical[:5]:
             short = fac.name[:4]
             if len(short) >= 4 and short in pharmacy_name:
@@ -907,10 +1407,852 @@ def calc_commercial_radius(
     return r, f"{note}（密度: {density:,}人/km²）"
 
 
+# ---------------------------------------------------------------------------
+# 1-b. v4.5: ローカルキャッシュ（SQLite）
+# ---------------------------------------------------------------------------
+# キャッシュ・ローカルDBの保存先。Streamlit の再実行やプロセス再起動を跨いで再利用する。
+CACHE_DIR: str = os.environ.get(
+    "PHARMACY_RX_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "pharmacy_rx_predictor"),
+)
+
+
+def _open_sqlite(path: str) -> sqlite3.Connection:
+    """キャッシュ用 SQLite 接続を開く（親ディレクトリ自動作成・WAL モード）
+
+    接続はスレッド間で共有されるため、呼び出し側でロックを取って使用すること。
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+class GeocodeCache:
+    """
+    v4.5: ジオコーディング結果の永続キャッシュ
+
+    キー: GeocoderService._clean() で正規化した住所
+    値:   (lat, lon, status_message, geocoder_source) + 採用されたバリアント
+
+    - 座標が取れなかった住所も「ネガティブエントリ」(lat/lon = NULL) として保存し、
+      同じ住所で6バリアント × GSI/Nominatim を毎回試行し直すことを防ぐ。
+    - TTL: 成功 POSITIVE_TTL_S / 失敗 NEGATIVE_TTL_S（失敗は住所表記の修正等で
+      解消し得るため短め）
+    - hits / negative_hits / misses はプロセス内カウンタ（stats() で参照）
+    - town_point テーブル: 番地まで解決できた結果から町丁目ごとの座標平均と範囲を学習し、
+      位置参照情報が無い地域の町丁目の代表点・広がりとして使う（town_area()）
+    """
+
+    POSITIVE_TTL_S: float = 180 * 86_400
+    NEGATIVE_TTL_S: float = 7 * 86_400
+    TOWN_MIN_POINTS: int = 3   # 学習した町丁目の広がりを信用する最少点数
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        positive_ttl_s: Optional[float] = None,
+        negative_ttl_s: Optional[float] = None,
+    ):
+        self.path = path or os.path.join(CACHE_DIR, "geocode_cache.sqlite3")
+        self.positive_ttl_s = positive_ttl_s if positive_ttl_s is not None else self.POSITIVE_TTL_S
+        self.negative_ttl_s = negative_ttl_s if negative_ttl_s is not None else self.NEGATIVE_TTL_S
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = _open_sqlite(self.path)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS geocode ("
+                " key TEXT PRIMARY KEY, lat REAL, lon REAL, message TEXT,"
+                " source TEXT, variant TEXT, created_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS town_point ("
+                " key TEXT PRIMARY KEY, lat_sum REAL NOT NULL, lon_sum REAL NOT NULL,"
+                " n INTEGER NOT NULL, lat_min REAL, lat_max REAL, lon_min REAL, lon_max REAL) WITHOUT ROWID"
+            )
+            # 範囲列は v4.5 の途中で追加。それ以前の学習値は区・市の重心が混入し得るため破棄する
+            have = {row[1] for row in self._conn.execute("PRAGMA table_info(town_point)")}
+            if "lat_min" not in have:
+                self._conn.execute("DELETE FROM town_point")
+                for col in ("lat_min", "lat_max", "lon_min", "lon_max"):
+                    self._conn.execute(f"ALTER TABLE town_point ADD COLUMN {col} REAL")
+
+    def get(self, key: str) -> Optional[Tuple[Optional[float], Optional[float], str, str]]:
+        """キャッシュ済みの geocode() 戻り値を返す（未登録・期限切れは None）"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT lat, lon, message, source, created_at FROM geocode WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            lat, lon, message, source, created_at = row
+            ttl = self.positive_ttl_s if lat is not None else self.negative_ttl_s
+            if time.time() - created_at > ttl:
+                self.misses += 1
+                return None
+            if lat is None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+        return lat, lon, f"{message}（キャッシュ）", source
+
+    def put(
+        self, key: str, lat: float, lon: float, message: str, source: str, variant: str = "",
+    ) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO geocode VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, lat, lon, message, source, variant, time.time()),
+            )
+
+    def put_negative(self, key: str, message: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO geocode VALUES (?, NULL, NULL, ?, '', '', ?)",
+                (key, message, time.time()),
+            )
+
+    def add_town_point(self, town: str, lat: float, lon: float) -> None:
+        """町丁目キー（town_key()）に座標を1点加える"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO town_point VALUES (?, ?, ?, 1, ?, ?, ?, ?) ON CONFLICT(key) DO UPDATE SET"
+                " lat_sum = lat_sum + excluded.lat_sum, lon_sum = lon_sum + excluded.lon_sum,"
+                " n = n + 1,"
+                " lat_min = min(lat_min, excluded.lat_min), lat_max = max(lat_max, excluded.lat_max),"
+                " lon_min = min(lon_min, excluded.lon_min), lon_max = max(lon_max, excluded.lon_max)",
+                (town, lat, lon, lat, lat, lon, lon),
+            )
+
+    def town_area(self, town: str) -> Optional[Tuple[float, float, float]]:
+        """
+        学習済みの町丁目の (重心緯度, 重心経度, 広がり[m])。広がりは重心から学習範囲の最も遠い隅まで。
+        未学習・TOWN_MIN_POINTS 点未満（広がりを信用できない）は None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT lat_sum, lon_sum, n, lat_min, lat_max, lon_min, lon_max FROM town_point WHERE key = ?",
+                (town,),
+            ).fetchone()
+        if row is None or row[2] < self.TOWN_MIN_POINTS:
+            return None
+        lat, lon = row[0] / row[2], row[1] / row[2]
+        extent = max(haversine_distance(lat, lon, c_lat, c_lon)
+                     for c_lat in (row[3], row[4]) for c_lon in (row[5], row[6]))
+        return lat, lon, extent
+
+    def purge_expired(self) -> int:
+        """期限切れエントリを削除し、削除件数を返す"""
+        now = time.time()
+        with self._lock, self._conn:
+            cur = self._conn.execute(
+                "DELETE FROM geocode WHERE"
+                " (lat IS NOT NULL AND created_at < ?) OR (lat IS NULL AND created_at < ?)",
+                (now - self.positive_ttl_s, now - self.negative_ttl_s),
+            )
+            return cur.rowcount
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "negative_hits": self.negative_hits, "misses": self.misses}
+
+    def summary(self) -> str:
+        """検索ログ表示用のカウンタ要約（プロセス起動以降の累計）"""
+        total = self.hits + self.negative_hits + self.misses
+        rate = (self.hits + self.negative_hits) / total if total else 0.0
+        return (
+            f"ヒット{self.hits}件 / ネガティブヒット{self.negative_hits}件 / "
+            f"ミス{self.misses}件（ヒット率{rate:.0%}）"
+        )
+
+
+@st.cache_resource
+def get_geocode_cache() -> GeocodeCache:
+    """プロセス共通の GeocodeCache（Streamlit の再実行・セッションを跨いで共有）"""
+    return GeocodeCache()
+
+
+# ---------------------------------------------------------------------------
+# 1-c. v4.5: オフライン住所ジオコーダー（国土交通省 位置参照情報）
+# ---------------------------------------------------------------------------
+# 位置参照情報ダウンロードサービス https://nlftp.mlit.go.jp/isj/
+#   街区レベル:         都道府県名,市区町村名,大字・町丁目名,小字・通称名,街区符号・地番,…,緯度,経度,…
+#   大字・町丁目レベル: 都道府県コード,都道府県名,市区町村コード,市区町村名,大字町丁目コード,大字町丁目名,緯度,経度,…
+# `python app_v4_4.py ingest-address-points <CSV/ZIP>...` で取り込む（cp932）。
+
+def _normalize_address_key(address: str) -> str:
+    """
+    位置参照情報の照合キー用に住所を正規化する。
+
+    全角→半角・空白除去・漢数字→算用数字（"三丁目" → "3丁目"）・
+    「番地/番/号/の」→ "-"・「大字」「○○郡」の除去を行う。
+    取り込み側・検索側の双方に同じ正規化を掛けるため、表記揺れは両側で吸収される。
+    """
+    a = unicodedata.normalize("NFKC", address)
+    a = re.sub(r"\s+", "", a)
+    a = _ADDRESS_DASH_RE.sub("-", a)
+    a = re.sub(r"(?<=\d)ー(?=\d)", "-", a)
+    a = re.sub(r"[〇一二三四五六七八九十]+", lambda m: str(_kanji_numeral_to_int(m.group())), a)
+    a = re.sub(r"(\d+)番地?", r"\1-", a)
+    a = re.sub(r"(\d+)号", r"\1", a)
+    a = re.sub(r"(?<=\d)[のノ](?=\d)", "-", a)
+    a = re.sub(r"-+", "-", a).rstrip("-")
+    a = a.replace("大字", "")
+    pref = _PREF_TRIE.longest_prefix(a)
+    if pref:
+        rest = a[len(pref):]
+        county = _COUNTY_TRIE.longest_prefix(rest)
+        rest = rest[len(county):] if county else re.sub(r"^[^市区町村\d]+?郡", "", rest)
+        return pref + rest
+    return a
+
+
+def town_key(address: str) -> str:
+    """
+    住所の町丁目キー（都道府県+市区町村+区+町名+丁目 を _normalize_address_key で正規化）。
+    AddressPointIndex の town テーブルと同じ形式。町名が取れない住所は空文字。
+    """
+    pa = parse_address(address)
+    if not (pa.pref and pa.city and pa.town):
+        return ""
+    chome = f"{pa.chome}丁目" if pa.chome else ""
+    return _normalize_address_key(f"{pa.pref}{pa.city}{pa.ward}{pa.town}{chome}")
+
+
+class AddressPointIndex:
+    """
+    v4.5: 位置参照情報による住所 → 座標のローカル解決
+
+    town  テーブル: 正規化済み「都道府県+市区町村+大字・町丁目」→ 代表点
+    block テーブル: town キー + "#" + 街区符号 → 代表点
+    （いずれも主キー索引のみの WITHOUT ROWID テーブル）
+
+    lookup() は住所の数字の直前で区切った接頭辞を長い順に town と照合し
+    （「成増1-12-3」のような丁目省略表記は「成増1丁目」も試す）、
+    残りの先頭番号で block を引く。1件あたり十数回の主キー検索で済む。
+    """
+
+    LEVEL_BLOCK = "街区"
+    LEVEL_TOWN = "町丁目"
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.path.join(CACHE_DIR, "address_points.sqlite3")
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = _open_sqlite(self.path)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS town ("
+                " key TEXT PRIMARY KEY, lat REAL NOT NULL, lon REAL NOT NULL) WITHOUT ROWID"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS block ("
+                " key TEXT PRIMARY KEY, lat REAL NOT NULL, lon REAL NOT NULL) WITHOUT ROWID"
+            )
+
+    # ── 取り込み ───────────────────────────────────────────────
+    def ingest(self, path: str, encoding: str = "cp932") -> int:
+        """CSV または CSV を含む ZIP を取り込み、取り込んだ行数を返す"""
+        if path.lower().endswith(".zip"):
+            total = 0
+            with zipfile.ZipFile(path) as zf:
+                for name in zf.namelist():
+                    if name.lower().endswith(".csv"):
+                        with zf.open(name) as raw:
+                            total += self._ingest_stream(io.TextIOWrapper(raw, encoding=encoding))
+            return total
+        with open(path, encoding=encoding, newline="") as f:
+            return self._ingest_stream(f)
+
+    def _ingest_stream(self, f) -> int:
+        reader = csv.DictReader(f)
+        fields = reader.fieldnames or []
+        is_block = "街区符号・地番" in fields
+        town_col = "大字・町丁目名" if "大字・町丁目名" in fields else "大字町丁目名"
+        if town_col not in fields or "緯度" not in fields:
+            raise ValueError(f"位置参照情報の CSV ではありません（列: {fields[:6]}）")
+
+        n = 0
+        towns: List[Tuple[str, float, float]] = []
+        primary: List[Tuple[str, float, float]] = []    # 代表フラグ=1 は上書き
+        secondary: List[Tuple[str, float, float]] = []  # それ以外は未登録時のみ
+        for row in reader:
+            try:
+                lat, lon = float(row["緯度"]), float(row["経度"])
+            except (TypeError, ValueError):
+                continue
+            town = _normalize_address_key(
+                row["都道府県名"] + row["市区町村名"] + row[town_col]
+            )
+            n += 1
+            if not is_block:
+                towns.append((town, lat, lon))
+                continue
+            code = _normalize_address_key(row["街区符号・地番"])
+            dest = primary if row.get("代表フラグ") == "1" else secondary
+            dest.append((f"{town}#{code}", lat, lon))
+            koaza = _normalize_address_key(row.get("小字・通称名") or "")
+            if koaza:
+                dest.append((f"{town}{koaza}#{code}", lat, lon))
+
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO town VALUES (?, ?, ?)", towns)
+            self._conn.executemany("INSERT OR IGNORE INTO block VALUES (?, ?, ?)", secondary)
+            self._conn.executemany("INSERT OR REPLACE INTO block VALUES (?, ?, ?)", primary)
+            if is_block:
+                # 大字・町丁目レベル未取り込みの町は街区の重心で代用
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO town"
+                    " SELECT substr(key, 1, instr(key, '#') - 1), avg(lat), avg(lon)"
+                    " FROM block GROUP BY 1"
+                )
+        return n
+
+    # ── 検索 ───────────────────────────────────────────────────
+    def lookup(self, address: str) -> Optional[Tuple[float, float, str, str]]:
+        """住所を解決して (lat, lon, 照合した住所, 精度レベル) を返す（未登録は None）"""
+        norm = _normalize_address_key(address)
+        pref_len = len(_PREF_TRIE.longest_prefix(norm) or "")
+        # 接頭辞候補: 文字列全体 + 数字の直前で区切った位置（長い順）
+        cuts = [len(norm)] + [
+            m.start() for m in reversed(list(re.finditer(r"(?<!\d)\d", norm)))
+        ]
+        with self._lock:
+            for cut in cuts:
+                head = norm[:cut]
+                if cut <= pref_len or head.endswith("-"):
+                    continue
+                nums = re.match(r"\d+(?:-\d+)*", norm[cut:])
+                parts = nums.group().split("-") if nums else []
+                tries: List[Tuple[str, List[str]]] = []
+                if parts and not head.endswith("丁目"):
+                    tries.append((f"{head}{parts[0]}丁目", parts[1:]))
+                tries.append((head, parts))
+                for town, rest in tries:
+                    row = self._conn.execute(
+                        "SELECT lat, lon FROM town WHERE key = ?", (town,)
+                    ).fetchone()
+                    if row is None:
+                        continue
+                    if rest:
+                        blk = self._conn.execute(
+                            "SELECT lat, lon FROM block WHERE key = ?", (f"{town}#{rest[0]}",)
+                        ).fetchone()
+                        if blk is not None:
+                            self.hits += 1
+                            return blk[0], blk[1], f"{town}{rest[0]}", self.LEVEL_BLOCK
+                    self.hits += 1
+                    return row[0], row[1], town, self.LEVEL_TOWN
+            self.misses += 1
+        return None
+
+    def town_area(self, town: str) -> Optional[Tuple[float, float, float]]:
+        """
+        町丁目キー（town_key()）の (代表点緯度, 代表点経度, 広がり[m])。
+        広がりは代表点から最も遠い街区まで。未登録・街区が未取り込み（広がり不明）は None
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT lat, lon FROM town WHERE key = ?", (town,)).fetchone()
+            if row is None:
+                return None
+            # "#" の次の文字 "$" までの範囲 = この町の街区（WITHOUT ROWID の主キー範囲検索）
+            blocks = self._conn.execute(
+                "SELECT lat, lon FROM block WHERE key >= ? AND key < ?", (town + "#", town + "$"),
+            ).fetchall()
+        if not blocks:
+            return None
+        return row[0], row[1], max(haversine_distance(row[0], row[1], b_lat, b_lon) for b_lat, b_lon in blocks)
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "town": self._conn.execute("SELECT count(*) FROM town").fetchone()[0],
+                "block": self._conn.execute("SELECT count(*) FROM block").fetchone()[0],
+            }
+
+    def summary(self) -> str:
+        c = self.counts()
+        return (
+            f"町丁目{c['town']:,}件 / 街区{c['block']:,}件 "
+            f"（検索 ヒット{self.hits}件 / ミス{self.misses}件）"
+        )
+
+
+@st.cache_resource
+def get_address_point_index() -> Optional[AddressPointIndex]:
+    """
+    取り込み済みの AddressPointIndex（未取り込みなら None）。
+    プロセス内で共有するため、取り込み後はアプリを再起動すること。
+    """
+    path = os.path.join(CACHE_DIR, "address_points.sqlite3")
+    if not os.path.exists(path):
+        return None
+    return AddressPointIndex(path)
+
+
+# ---------------------------------------------------------------------------
+# 1-d. v4.5: ホスト別レート制限（トークンバケット・プロセス間共有）
+# ---------------------------------------------------------------------------
+# サービス名 → (補充レート[件/秒], バケット容量[件])
+#   gsi:       国土地理院 住所検索・逆ジオコーダー（従来の 0.15秒間隔相当）
+#   nominatim: OSM Nominatim 利用規約（1秒1件以下）
+#   overpass:  overpass-api.de（従来は各検索前に 0.5秒待機）
+#   mhlw:      医療情報ネット（従来は 0.3〜0.8秒間隔の sleep）
+RATE_LIMITS: Dict[str, Tuple[float, float]] = {
+    "gsi":       (6.0, 3.0),
+    "nominatim": (0.9, 1.0),
+    "overpass":  (0.5, 2.0),
+    "mhlw":      (2.0, 2.0),
+}
+
+
+class HostRateLimiter:
+    """
+    v4.5: サービス（ホスト）単位のトークンバケット
+
+    バケット状態（トークン数, 更新時刻）を CACHE_DIR/ratelimit/<サービス名>.bucket に置き、
+    fcntl.flock で排他して読み書きするため、同一プロセスのスレッド間だけでなく
+    複数の Streamlit プロセス間でも合計レートが RATE_LIMITS に収まる。
+    トークンが残っていれば待たずに返り、不足時は不足分の補充時間だけ待つ
+    （先に予約した呼び出しから順に発行される）。
+    fcntl の無い環境（Windows）ではプロセス内のスレッド間でのみ制御する。
+    """
+
+    def __init__(self, limits: Optional[Dict[str, Tuple[float, float]]] = None,
+                 state_dir: Optional[str] = None):
+        self.limits = dict(limits or RATE_LIMITS)
+        self.state_dir = state_dir or os.path.join(CACHE_DIR, "ratelimit")
+        os.makedirs(self.state_dir, exist_ok=True)
+        self._locks: Dict[str, threading.Lock] = {s: threading.Lock() for s in self.limits}
+        self._memory: Dict[str, Tuple[float, float]] = {}   # fcntl 非対応環境用
+
+    def acquire(self, service: str) -> float:
+        """1リクエスト分のトークンを取得する（必要なら待機）。待機秒数を返す"""
+        if service not in self.limits:
+            return 0.0
+        rate, burst = self.limits[service]
+        with self._locks[service]:
+            wait_s = self._reserve(service, rate, burst)
+        if wait_s > 0:
+            time.sleep(wait_s)
+        return wait_s
+
+    def _reserve(self, service: str, rate: float, burst: float) -> float:
+        if fcntl is None:
+            tokens, updated = self._memory.get(service, (burst, time.time()))
+            tokens, wait_s, now = self._take(tokens, updated, rate, burst)
+            self._memory[service] = (tokens, now)
+            return wait_s
+        fd = os.open(os.path.join(self.state_dir, f"{service}.bucket"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            raw = os.pread(fd, 16, 0)
+            tokens, updated = struct.unpack("dd", raw) if len(raw) == 16 else (burst, time.time())
+            tokens, wait_s, now = self._take(tokens, updated, rate, burst)
+            os.pwrite(fd, struct.pack("dd", tokens, now), 0)
+            return wait_s
+        finally:
+            os.close(fd)   # close で flock も解放される
+
+    @staticmethod
+    def _take(tokens: float, updated: float, rate: float, burst: float) -> Tuple[float, float, float]:
+        """補充 → 1トークン消費。不足分は負のトークン（予約）として残し待機秒数を返す"""
+        now = time.time()
+        tokens = min(burst, tokens + max(0.0, now - updated) * rate) - 1.0
+        return tokens, (-tokens / rate if tokens < 0 else 0.0), now
+
+
+@st.cache_resource
+def get_rate_limiter() -> HostRateLimiter:
+    """プロセス共通の HostRateLimiter"""
+    return HostRateLimiter()
+
+
+# ---------------------------------------------------------------------------
+# 1-e. v4.5: サーキットブレーカー（連続失敗したエンドポイントを一時的に遮断）
+# ---------------------------------------------------------------------------
+CIRCUIT_FAILURE_THRESHOLD: int = 3       # この回数連続で失敗したら遮断（open）
+CIRCUIT_RESET_TIMEOUT_S: float = 120.0   # 遮断後、試行を1件だけ許可する（half-open）までの秒数
+
+
+class CircuitBreaker:
+    """
+    v4.5: エンドポイント単位のサーキットブレーカー（スレッドセーフ）
+
+      closed    : 通常。連続失敗が failure_threshold 回に達したら open へ
+      open      : reset_timeout_s 秒間は allow() が False（呼び出し側は即座に諦める / 次へ回す）
+      half-open : 経過後は試行を1件だけ許可し、成功で closed・失敗で再び open
+    遮断中のセッションは 30秒のタイムアウトを待たずに失敗を返せる。
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+
+    def __init__(self, name: str, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 reset_timeout_s: float = CIRCUIT_RESET_TIMEOUT_S):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_s = reset_timeout_s
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self.last_error = ""
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and time.time() - self._opened_at >= self.reset_timeout_s:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        """呼び出してよいか。half-open では最初の1件だけ True を返す"""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if time.time() - self._opened_at < self.reset_timeout_s:
+                    return False
+                self._state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def retry_after(self) -> float:
+        """open 状態が解けるまでの残り秒数（closed / half-open なら 0）"""
+        with self._lock:
+            if self._state != self.OPEN:
+                return 0.0
+            return max(0.0, self.reset_timeout_s - (time.time() - self._opened_at))
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+            self.last_error = ""
+
+    def record_failure(self, error: str = "") -> None:
+        with self._lock:
+            self._failures += 1
+            self.last_error = error
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = time.time()
+                self._trial_in_flight = False
+
+
+@st.cache_resource
+def get_circuit_breaker(name: str) -> CircuitBreaker:
+    """名前（エンドポイントURL等）ごとにプロセス共通の CircuitBreaker"""
+    return CircuitBreaker(name)
+
+
+# ---------------------------------------------------------------------------
+# 1-f. v4.5: MHLW ページのスナップショット（内容アドレス型・zlib 圧縮）
+# ---------------------------------------------------------------------------
+# 取得から一定期間内のページは再取得せずスナップショットを使う
+MHLW_SNAPSHOT_MAX_AGE_S: float = 30 * 86_400
+
+
+class MHLWSnapshotStore:
+    """
+    v4.5: 取得した MHLW ページ（HTML）の保存庫
+
+      page     : 本文 SHA-256 → zlib 圧縮した本文（同じ内容は URL を跨いで1回だけ保存）
+      snapshot : (URL, 本文ハッシュ) → 初回・最終取得時刻
+    同じ URL の内容が変われば新しい行が増えるため、ページの変化も履歴として残る。
+    解析器の改良後は iter_latest() で全ページを通信なしに再解析できる（reparse-snapshots）。
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.path.join(CACHE_DIR, "mhlw_snapshots.sqlite3")
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = _open_sqlite(self.path)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS page ("
+                " hash TEXT PRIMARY KEY, size INTEGER NOT NULL, body BLOB NOT NULL) WITHOUT ROWID"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS snapshot ("
+                " url TEXT NOT NULL, hash TEXT NOT NULL,"
+                " first_fetched REAL NOT NULL, last_fetched REAL NOT NULL,"
+                " PRIMARY KEY (url, hash)) WITHOUT ROWID"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS snapshot_latest ON snapshot (url, last_fetched)"
+            )
+
+    @staticmethod
+    def page_url(url: str, params: Optional[Dict] = None) -> str:
+        """requests の params を付けた URL（スナップショットのキー）"""
+        if not params:
+            return url
+        return url + ("&" if "?" in url else "?") + urllib.parse.urlencode(params)
+
+    def put(self, url: str, html: str, fetched_at: Optional[float] = None) -> str:
+        """本文を保存して本文ハッシュを返す（同じ内容なら最終取得時刻だけ更新）"""
+        body = html.encode("utf-8")
+        digest = hashlib.sha256(body).hexdigest()
+        now = fetched_at if fetched_at is not None else time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO page VALUES (?, ?, ?)",
+                (digest, len(body), zlib.compress(body, 6)),
+            )
+            self._conn.execute(
+                "INSERT INTO snapshot VALUES (?, ?, ?, ?)"
+                " ON CONFLICT (url, hash) DO UPDATE SET last_fetched = excluded.last_fetched",
+                (url, digest, now, now),
+            )
+        return digest
+
+    def latest(self, url: str, max_age_s: Optional[float] = None) -> Optional[Tuple[str, float]]:
+        """URL の最新スナップショット (本文, 取得時刻)。max_age_s より古ければ None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT p.body, s.last_fetched FROM snapshot s JOIN page p ON p.hash = s.hash"
+                " WHERE s.url = ? ORDER BY s.last_fetched DESC LIMIT 1",
+                (url,),
+            ).fetchone()
+            if row is None or (max_age_s is not None and time.time() - row[1] > max_age_s):
+                self.misses += 1
+                return None
+            self.hits += 1
+        return zlib.decompress(row[0]).decode("utf-8"), row[1]
+
+    def iter_latest(self, url_like: str = "%") -> Iterator[Tuple[str, float, str]]:
+        """URL ごとの最新スナップショット (URL, 取得時刻, 本文)。url_like は SQL の LIKE パターン"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT url, hash, max(last_fetched) FROM snapshot WHERE url LIKE ?"
+                " GROUP BY url ORDER BY url",
+                (url_like,),
+            ).fetchall()
+        for url, digest, fetched in rows:
+            with self._lock:
+                blob = self._conn.execute("SELECT body FROM page WHERE hash = ?", (digest,)).fetchone()[0]
+            yield url, fetched, zlib.decompress(blob).decode("utf-8")
+
+    def history(self, url: str) -> List[Tuple[str, float, float]]:
+        """URL の内容履歴 [(本文ハッシュ, 初回取得, 最終取得)]（古い順）"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT hash, first_fetched, last_fetched FROM snapshot WHERE url = ?"
+                " ORDER BY first_fetched",
+                (url,),
+            ).fetchall()
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            n_url, n_snap = self._conn.execute(
+                "SELECT count(DISTINCT url), count(*) FROM snapshot"
+            ).fetchone()
+            n_page, raw = self._conn.execute(
+                "SELECT count(*), coalesce(sum(size), 0) FROM page"
+            ).fetchone()
+            packed = self._conn.execute(
+                "SELECT coalesce(sum(length(body)), 0) FROM page"
+            ).fetchone()[0]
+        return {"url": n_url, "snapshot": n_snap, "page": n_page, "raw_bytes": raw, "packed_bytes": packed}
+
+    def summary(self) -> str:
+        c = self.counts()
+        return (
+            f"URL {c['url']:,}件 / 内容 {c['page']:,}件 "
+            f"（{c['raw_bytes'] / 1e6:.1f}MB → 圧縮 {c['packed_bytes'] / 1e6:.1f}MB）"
+            f" 再利用{self.hits}件 / 取得{self.misses}件"
+        )
+
+
+@st.cache_resource
+def get_mhlw_snapshot_store() -> MHLWSnapshotStore:
+    """プロセス共通の MHLWSnapshotStore"""
+    return MHLWSnapshotStore()
+
+
+# ---------------------------------------------------------------------------
+# 1-g. v4.5: 外部呼び出しポリシー（期限・再試行・遮断）
+# ---------------------------------------------------------------------------
+# GSI / Nominatim / Overpass / MHLW への HTTP 呼び出しは call_with_policy() を通し、
+#   ・呼び出し全体の期限（deadline_s）— 各試行の読み取りタイムアウトも残り時間に切り詰める
+#   ・再試行は max_attempts 回まで。タイムアウト・接続エラー・retry_statuses の応答のみ、
+#     指数バックオフ（フルジッター、Retry-After があればそれ以上）を挟む
+#   ・ホスト単位の CircuitBreaker（遮断中は通信せずに即座に失敗）
+# 結果は CallStatus（成否・失敗の種類・試行回数・所要時間）で呼び出し側へ返す。
+
+RETRYABLE_HTTP_STATUSES: Tuple[int, ...] = (429, 500, 502, 503, 504)
+
+
+@dataclass(frozen=True)
+class CallPolicy:
+    """サービスごとの呼び出し方針"""
+    service: str                            # 表示名・RATE_LIMITS のキー
+    connect_timeout_s: float = 5.0
+    read_timeout_s: float = 15.0
+    deadline_s: float = 30.0                # 再試行・待機を含む呼び出し全体の上限
+    max_attempts: int = 3
+    backoff_base_s: float = 0.5             # 2回目の前の最大待機（以降倍々）
+    backoff_max_s: float = 4.0
+    retry_statuses: Tuple[int, ...] = RETRYABLE_HTTP_STATUSES
+    rate_limited: bool = True               # 試行ごとに HostRateLimiter のトークンを取る
+
+
+CALL_POLICIES: Dict[str, CallPolicy] = {
+    "gsi":       CallPolicy("gsi", read_timeout_s=8.0, deadline_s=15.0),
+    "nominatim": CallPolicy("nominatim", read_timeout_s=10.0, deadline_s=15.0, max_attempts=2),
+    "overpass":  CallPolicy("overpass", read_timeout_s=30.0, deadline_s=60.0, max_attempts=2,
+                            backoff_base_s=1.0),
+    "overpass_status": CallPolicy("overpass_status", read_timeout_s=5.0, deadline_s=5.0,
+                                  max_attempts=1, rate_limited=False),
+    "mhlw":      CallPolicy("mhlw", read_timeout_s=15.0, deadline_s=30.0),
+}
+
+
+@dataclass
+class CallStatus:
+    """
+    外部呼び出しの結果。kind は失敗の種類:
+      timeout / connection / http（再試行後も失敗の応答）/ circuit_open（遮断中）/ deadline（期限切れ）
+      / parse（応答の解析失敗。呼び出し側が設定）
+    """
+    service: str
+    ok: bool = True
+    kind: str = ""
+    error: str = ""
+    attempts: int = 0
+    http_status: int = 0
+    elapsed_s: float = 0.0
+
+    def fail(self, kind: str, error: str) -> "CallStatus":
+        self.ok, self.kind, self.error = False, kind, error
+        return self
+
+    def summary(self) -> str:
+        if self.ok:
+            return f"{self.service}: OK（{self.attempts}回・{self.elapsed_s:.1f}秒）"
+        return f"{self.service}: {self.error}（{self.attempts}回試行・{self.elapsed_s:.1f}秒）"
+
+
+class ExternalCallError(requests.RequestException):
+    """call_with_policy が応答を得られなかった（status に理由）"""
+
+    def __init__(self, status: CallStatus):
+        super().__init__(status.summary())
+        self.status = status
+
+
+def _host_of(url: str) -> str:
+    return urllib.parse.urlsplit(url).netloc or url
+
+
+def _retry_after_s(r: requests.Response) -> float:
+    value = r.headers.get("Retry-After", "") if getattr(r, "headers", None) else ""
+    return float(value) if value.strip().isdigit() else 0.0
+
+
+def call_with_policy(
+    policy: CallPolicy,
+    url: str,
+    send: Callable[[Tuple[float, float]], requests.Response],
+    deadline: Optional[float] = None,
+    breaker: Optional[CircuitBreaker] = None,
+    limiter: Optional[HostRateLimiter] = None,
+) -> Tuple[Optional[requests.Response], CallStatus]:
+    """
+    send(timeout) を policy に従って実行し (応答 or None, CallStatus) を返す。
+
+    url はホスト単位のブレーカー選択にだけ使う（breaker を渡せばそれを使う）。
+    deadline: 呼び出し側の期限（time.time() 基準）。policy.deadline_s と早い方で打ち切る。
+    retry_statuses 以外の応答（4xx を含む）はそのまま返す（status.ok は 400 未満のときだけ True）。
+    再試行しても retry_statuses のままなら最後の応答を返す。通信自体の失敗は None。
+    """
+    start = time.time()
+    end = start + policy.deadline_s if deadline is None else min(deadline, start + policy.deadline_s)
+    breaker = breaker or get_circuit_breaker(_host_of(url))
+    limiter = limiter or (get_rate_limiter() if policy.rate_limited else None)
+    status = CallStatus(policy.service)
+    last: Optional[requests.Response] = None
+    for attempt in range(1, policy.max_attempts + 1):
+        remaining = end - time.time()
+        if remaining <= 0:
+            status.fail("deadline", "期限切れ")
+            break
+        if not breaker.allow():
+            status.fail("circuit_open", f"遮断中（{breaker.last_error}・残り{breaker.retry_after():.0f}秒）")
+            break
+        if limiter is not None:
+            limiter.acquire(policy.service)
+        status.attempts = attempt
+        timeout = (min(policy.connect_timeout_s, remaining), min(policy.read_timeout_s, remaining))
+        retry_after = 0.0
+        try:
+            r = send(timeout)
+        except requests.Timeout:
+            breaker.record_failure("タイムアウト")
+            status.fail("timeout", "タイムアウト")
+        except requests.RequestException as e:
+            breaker.record_failure("接続エラー")
+            status.fail("connection", f"接続エラー: {e}")
+        else:
+            status.http_status = r.status_code
+            if r.status_code not in policy.retry_statuses:
+                breaker.record_success()   # 4xx もサーバーは応答している（要求側の問題）
+                status.ok = r.status_code < 400
+                status.kind, status.error = ("", "") if status.ok else ("http", f"HTTP {r.status_code}")
+                status.elapsed_s = time.time() - start
+                return r, status
+            breaker.record_failure(f"HTTP {r.status_code}")
+            status.fail("http", f"HTTP {r.status_code}")
+            retry_after = _retry_after_s(r)
+            if last is not None:
+                last.close()
+            last = r
+        if attempt == policy.max_attempts:
+            break
+        backoff = max(retry_after, random.uniform(0, min(policy.backoff_max_s,
+                                                         policy.backoff_base_s * 2 ** (attempt - 1))))
+        if time.time() + backoff >= end:
+            status.fail("deadline", f"期限切れ（直前: {status.error}）")
+            break
+        time.sleep(backoff)
+    status.elapsed_s = time.time() - start
+    return last, status
+
+
+def service_available(url: str) -> bool:
+    """ホストのブレーカーが遮断中でないか（後続の同じホストへの処理を続けるかの判断用）"""
+    return get_circuit_breaker(_host_of(url)).state != CircuitBreaker.OPEN
+
+
+def failed_calls(*statuses: Optional[CallStatus]) -> List[str]:
+    """失敗した呼び出しの要約（分析結果の警告表示用）"""
+    return [st_.summary() for st_ in statuses if st_ is not None and not st_.ok]
+
+
 # ---------------------------------------------------------------------------
 # 2. ジオコーダー（国土地理院 GSI + Nominatim フォールバック）
 # ---------------------------------------------------------------------------
 
+# v4.5: GSI バリアント並列解決の同時実行数 / geocode_many() の住所単位の同時実行数
+# （発行レートは RATE_LIMITS["gsi"] / ["nominatim"] で制御）
+GEOCODE_PARALLEL_WORKERS: int = 3
+GEOCODE_BATCH_WORKERS: int = 3
+
+GeocodeResult = Tuple[Optional[float], Optional[float], str, str]
+
+
 class GeocoderService:
     """
     住所 → 緯度経度変換
@@ -919,13 +2261,45 @@ class GeocoderService:
       [1st] 国土地理院（GSI）ジオコーダー — 日本住所に特化・高精度・APIキー不要
             https://msearch.gsi.go.jp/address-search/AddressSearch
       [2nd] Nominatim (OpenStreetMap) — 国際的な地名・施設名に強い
+
+    v4.5 変更:
+      GeocodeCache（SQLite）で結果を永続化。同じ住所の再分析では通信しない。
+      use_cache=False でキャッシュを無効化（常にAPIへ問い合わせ）。
+      parallel_variants=True で GSI バリアントを並列に問い合わせる
+      （採用結果は逐次モードと同じ「最も優先順位の高い成功バリアント」）。
+      AddressPointIndex（位置参照情報）が取り込み済みなら最優先で参照する。
+      use_local=False で無効化。
     """
 
     GSI_URL = "https://msearch.gsi.go.jp/address-search/AddressSearch"
+    GSI_REVERSE_URL = "https://mreversegeocoder.gsi.go.jp/reverse-geocoder/LonLatToAddress"
     NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
     LAT_MIN, LAT_MAX = 24.0, 46.0
     LON_MIN, LON_MAX = 122.0, 154.0
 
+    def __init__(
+        self,
+        cache: Optional[GeocodeCache] = None,
+        use_cache: bool = True,
+        parallel_variants: bool = True,
+        address_index: Optional[AddressPointIndex] = None,
+        use_local: bool = True,
+    ):
+        if cache is None and use_cache:
+            cache = get_geocode_cache()
+        if address_index is None and use_local:
+            address_index = get_address_point_index()
+        self.cache = cache
+        self.parallel_variants = parallel_variants
+        self.address_index = address_index
+        # 発行レートはプロセス・セッションを跨いで共有（ワーカースレッドからも使うため先に取得）
+        self._limiter = get_rate_limiter()
+        self._breakers = {
+            url: get_circuit_breaker(_host_of(url))
+            for url in (self.GSI_URL, self.GSI_REVERSE_URL, self.NOMINATIM_URL)
+        }
+        self.last_status = CallStatus("gsi")   # v4.5: 直近の外部呼び出しの結果
+
     def _clean(self, address: str) -> str:
         a = re.sub(r"Googleマップ.*|Google Map.*", "", address).strip()
         trans = str.maketrans("０１２３４５６７８９－", "0123456789-")
@@ -936,10 +2310,26 @@ class GeocoderService:
     def _is_japan(self, lat: float, lon: float) -> bool:
         return self.LAT_MIN <= lat <= self.LAT_MAX and self.LON_MIN <= lon <= self.LON_MAX
 
+    @staticmethod
+    def _strip_building(address: str) -> str:
+        """建物名・号室の除去"""
+        return re.sub(r"\d+(?:階|F|棟|号室|号).*$", "", address).strip()
+
+    @classmethod
+    def _is_precise(cls, address: str, variant: str, title: str) -> bool:
+        """
+        v4.5: 町丁目重心の学習に使える結果か。住所全体か建物名除去のバリアントで解決し、
+        かつ応答の名称に住所の町名が含まれるもの（市区町村のみの短縮クエリ等は使わない）
+        """
+        if variant not in (address, cls._strip_building(address)):
+            return False
+        town = parse_address(address).town
+        return bool(town) and town in unicodedata.normalize("NFKC", title or "")
+
     def _build_variants(self, address: str) -> List[str]:
         variants: List[str] = [address]
         # 建物名・号室除去
-        short = re.sub(r"\d+(?:階|F|棟|号室|号).*$", "", address).strip()
+        short = self._strip_building(address)
         if short and short != address:
             variants.append(short)
         # スペース分割で短縮
@@ -957,161 +2347,1325 @@ class GeocoderService:
                 variants.append(v)
         return variants[:6]
 
-    def _try_gsi(self, query: str) -> Optional[Tuple[float, float, str]]:
+    def _try_gsi(
+        self, query: str, errors: Optional[List[str]] = None,
+    ) -> Optional[Tuple[float, float, str]]:
+        """errors: 通信エラー・HTTPエラーを記録するリスト（ネガティブキャッシュ可否の判定用）"""
         headers = {"User-Agent": "PharmacyRxPredictor"}
+        r, status = call_with_policy(
+            CALL_POLICIES["gsi"], self.GSI_URL,
+            breaker=self._breakers[self.GSI_URL], limiter=self._limiter,
+            send=lambda t: requests.get(self.GSI_URL, params={"q": query}, headers=headers, timeout=t),
+        )
+        self.last_status = status
+        if r is None or r.status_code != 200:
+            if errors is not None:
+                errors.append(f"GSI {status.error}")
+            return None
         try:
-            r = requests.get(self.GSI_URL, params={"q": query}, headers=headers, timeout=8)
-            if r.status_code == 200:
-                data = r.json()
-                if data:
-                    coords = data[0].get("geometry", {}).get("coordinates", [])
-                    if len(coords) == 2:
-                        lon, lat = float(coords[0]), float(coords[1])
-                        if self._is_japan(lat, lon):
-                            title = data[0].get("properties", {}).get("title", query)
-                            return lat, lon, title
-        except Exception:
-            pass
+            data = r.json()
+            if data:
+                coords = data[0].get("geometry", {}).get("coordinates", [])
+                if len(coords) == 2:
+                    lon, lat = float(coords[0]), float(coords[1])
+                    if self._is_japan(lat, lon):
+                        title = data[0].get("properties", {}).get("title", query)
+                        return lat, lon, title
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            if errors is not None:
+                errors.append(f"GSI 不正な応答: {e}")
         return None
 
-    def _try_nominatim(self, query: str) -> Optional[Tuple[float, float, str]]:
+    def _try_nominatim(
+        self, query: str, errors: Optional[List[str]] = None,
+    ) -> Optional[Tuple[float, float, str]]:
         headers = {"User-Agent": "PharmacyRxPredictor"}
-        try:
-            r = requests.get(
+        r, status = call_with_policy(
+            CALL_POLICIES["nominatim"], self.NOMINATIM_URL,
+            breaker=self._breakers[self.NOMINATIM_URL], limiter=self._limiter,
+            send=lambda t: requests.get(
                 self.NOMINATIM_URL,
                 params={"q": query + " 日本", "format": "json", "limit": 1},
-                headers=headers, timeout=10,
-            )
-            if r.status_code == 200:
-                data = r.json()
-                if data:
-                    lat, lon = float(data[0]["lat"]), float(data[0]["lon"])
-                    if self._is_japan(lat, lon):
-                        return lat, lon, data[0].get("display_name", query)
-        except Exception:
-            pass
+                headers=headers, timeout=t,
+            ),
+        )
+        self.last_status = status
+        if r is None or r.status_code != 200:
+            if errors is not None:
+                errors.append(f"Nominatim {status.error}")
+            return None
+        try:
+            data = r.json()
+            if data:
+                lat, lon = float(data[0]["lat"]), float(data[0]["lon"])
+                if self._is_japan(lat, lon):
+                    return lat, lon, data[0].get("display_name", query)
+        except (ValueError, KeyError, TypeError, IndexError) as e:
+            if errors is not None:
+                errors.append(f"Nominatim 不正な応答: {e}")
         return None
 
-    def geocode(self, address: str) -> Tuple[Optional[float], Optional[float], str, str]:
+    def geocode(self, address: str) -> GeocodeResult:
         """
         Returns: (lat, lon, status_message, geocoder_source_name)
         """
         if not address:
             return None, None, "住所が空です", ""
         clean = self._clean(address)
+        offline = self._lookup_offline(clean)
+        if offline is not None:
+            return offline
+        return self._geocode_online(clean)
+
+    def geocode_many(
+        self, addresses: List[str], max_workers: int = GEOCODE_BATCH_WORKERS,
+    ) -> Iterator[Tuple[int, GeocodeResult]]:
+        """
+        v4.5: 複数住所の一括ジオコーディング。
+
+        (入力リストでの位置, geocode() と同じ戻り値) を完了順に yield する。
+          1. _clean() 後に同一となる住所は1回だけ解決し、該当する全位置へ返す
+          2. 空住所・ローカル解決・キャッシュヒットは通信前に即座に返す
+          3. 残りを max_workers 並列で解決（GSI / Nominatim の発行間隔は共有ゲートで制御）
+        全件を受け取る前にループを抜けた場合、未着手の問い合わせはキャンセルされる。
+        """
+        groups: Dict[str, List[int]] = {}
+        for i, address in enumerate(addresses):
+            if not address:
+                yield i, (None, None, "住所が空です", "")
+                continue
+            groups.setdefault(self._clean(address), []).append(i)
+
+        misses: List[str] = []
+        for clean, idxs in groups.items():
+            offline = self._lookup_offline(clean)
+            if offline is None:
+                misses.append(clean)
+                continue
+            for i in idxs:
+                yield i, offline
+        if not misses:
+            return
+
+        executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(misses))))
+        try:
+            futures = {executor.submit(self._geocode_online, clean): clean for clean in misses}
+            for f in as_completed(futures):
+                clean = futures[f]
+                try:
+                    result = f.result()
+                except Exception as e:
+                    result = (None, None, f"座標取得エラー: {e}", "")
+                for i in groups[clean]:
+                    yield i, result
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _lookup_offline(self, clean: str) -> Optional[GeocodeResult]:
+        """
+        通信を伴わない解決（位置参照情報 → 永続キャッシュ）。未解決は None。
+        番地付きの住所で街区が引けず町丁目の代表点にしか当たらない場合は、それを返さずに
+        キャッシュ・GSI を先に使う（代表点は GSI でも番地まで解決できない時の代替）
+        """
+        # ── v4.5: 位置参照情報（ローカル）— ネガティブキャッシュより優先
+        local, town_only = self._lookup_local(clean)
+        if local is not None and not town_only:
+            return local
+
+        # ── v4.5: 永続キャッシュ（ネガティブエントリ含む）
+        cached = self.cache.get(clean) if self.cache is not None else None
+        if cached is not None and cached[0] is None and local is not None:
+            return local   # 以前 GSI・Nominatim とも失敗した住所は町丁目の代表点で代替
+        return cached
+
+    def _lookup_local(self, clean: str) -> Tuple[Optional[GeocodeResult], bool]:
+        """
+        位置参照情報での解決 → (結果 or None, 番地付きなのに町丁目の代表点にしか当たらなかったか)
+        """
+        if self.address_index is None:
+            return None, False
+        local = self.address_index.lookup(clean)
+        if local is None:
+            return None, False
+        lat, lon, matched, level = local
+        msg = f"緯度: {lat:.5f}, 経度: {lon:.5f} [{matched}]（{level}レベル）"
+        town_only = level == AddressPointIndex.LEVEL_TOWN and bool(parse_address(clean).banchi)
+        return (lat, lon, msg, "国土交通省 位置参照情報"), town_only
+
+    def _geocode_online(self, clean: str) -> GeocodeResult:
+        """GSI（バリアント並列）→ Nominatim の順に問い合わせ、結果をキャッシュする"""
         variants = self._build_variants(clean)
+        errors: List[str] = []
 
         # ── GSI Japan を優先
-        for i, v in enumerate(variants):
-            if i > 0:
-                time.sleep(0.15)
-            result = self._try_gsi(v)
-            if result:
-                lat, lon, title = result
-                note = f"（短縮クエリ: {v}）" if i > 0 else ""
-                return lat, lon, f"緯度: {lat:.5f}, 経度: {lon:.5f} [{title}]{note}", "国土地理院（GSI）"
+        if self.parallel_variants and len(variants) > 1:
+            hit = self._resolve_gsi_parallel(variants, errors)
+        else:
+            hit = None
+            for i, v in enumerate(variants):
+                result = self._try_gsi(v, errors)
+                if result:
+                    hit = (i, result)
+                    break
+        # 番地付きで位置参照情報が町丁目の代表点にしか当たらない住所は、GSI が住所全体
+        # （建物名除去まで）で解決できなければ、市区町村レベルの短縮クエリより代表点を使う
+        local, town_only = self._lookup_local(clean)
+        town_fallback = local if town_only else None
+        if hit and (town_fallback is None or variants[hit[0]] in (clean, self._strip_building(clean))):
+            i, (lat, lon, title) = hit
+            v = variants[i]
+            note = f"（短縮クエリ: {v}）" if i > 0 else ""
+            msg = f"緯度: {lat:.5f}, 経度: {lon:.5f} [{title}]{note}"
+            return self._store(
+                clean, v, lat, lon, msg, "国土地理院（GSI）", precise=self._is_precise(clean, v, title),
+            )
+        if town_fallback is not None:
+            lat, lon, msg, source = town_fallback
+            return self._store(clean, clean, lat, lon, msg, source)
 
         # ── Nominatim フォールバック
-        time.sleep(1.1)
         for i, v in enumerate(variants):
-            if i > 0:
-                time.sleep(1.1)
-            result = self._try_nominatim(v)
+            result = self._try_nominatim(v, errors)
             if result:
                 lat, lon, display = result
                 note = f"（短縮クエリ: {v}）" if i > 0 else ""
-                return lat, lon, f"緯度: {lat:.5f}, 経度: {lon:.5f}{note}", "Nominatim(OpenStreetMap)"
+                msg = f"緯度: {lat:.5f}, 経度: {lon:.5f}{note}"
+                return self._store(
+                    clean, v, lat, lon, msg, "Nominatim(OpenStreetMap)",
+                    precise=self._is_precise(clean, v, display),
+                )
+
+        msg = f"座標取得失敗（試行済: {len(variants)}バリアント）: {clean[:40]}"
+        # 通信エラーを含む失敗は一時的な可能性があるためネガティブキャッシュしない
+        if self.cache is not None and not errors:
+            self.cache.put_negative(clean, msg)
+        return None, None, msg, ""
+
+    def _resolve_gsi_parallel(
+        self, variants: List[str], errors: List[str],
+    ) -> Optional[Tuple[int, Tuple[float, float, str]]]:
+        """
+        v4.5: GSI バリアントを並列に問い合わせ、(優先順位, 結果) を返す。
+
+        バリアント i の成功が確定しても、それより優先順位の高いバリアント(<i)が
+        未完了の間は待つ（逐次モードと同じ結果を返すため）。採用が確定した時点で
+        未発行のバリアントはキャンセルし、発行済みのものは結果を捨てる。
+        """
+        n = len(variants)
+        cancelled = threading.Event()
+
+        def task(v: str) -> Optional[Tuple[float, float, str]]:
+            if cancelled.is_set():
+                return None
+            return self._try_gsi(v, errors)
+
+        executor = ThreadPoolExecutor(max_workers=min(GEOCODE_PARALLEL_WORKERS, n))
+        try:
+            futures = [executor.submit(task, v) for v in variants]
+            index = {f: i for i, f in enumerate(futures)}
+            results: List[Optional[Tuple[float, float, str]]] = [None] * n
+            finished = [False] * n
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for f in done:
+                    i = index[f]
+                    finished[i] = True
+                    results[i] = f.result()
+                # 先頭から見て、未完了に当たる前に成功があれば確定
+                for i in range(n):
+                    if not finished[i]:
+                        break
+                    if results[i]:
+                        return i, results[i]
+            return None
+        finally:
+            cancelled.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _store(
+        self, key: str, variant: str, lat: float, lon: float, msg: str, source: str,
+        precise: bool = False,
+    ) -> GeocodeResult:
+        """
+        成功結果をキャッシュに保存して geocode() の戻り値を返す。
+        precise: 住所全体（建物名除去まで）で町名まで解決できた結果（_is_precise）→ 町丁目重心の学習に使う
+        """
+        if self.cache is not None:
+            self.cache.put(key, lat, lon, msg, source, variant=variant)
+            town = town_key(key) if precise else ""
+            if town:
+                self.cache.add_town_point(town, lat, lon)
+        return lat, lon, msg, source
+
+    def town_area(self, address: str) -> Optional[Tuple[float, float, float]]:
+        """
+        v4.5: 住所の町丁目の (代表点緯度, 代表点経度, 広がり[m])（通信なし）。
+        位置参照情報（町丁目 + 街区）→ キャッシュで学習した重心・範囲 の順に参照し、不明なら None。
+        """
+        town = town_key(address)
+        if not town:
+            return None
+        if self.address_index is not None:
+            area = self.address_index.town_area(town)
+            if area is not None:
+                return area
+        if self.cache is not None:
+            return self.cache.town_area(town)
+        return None
 
-        return None, None, f"座標取得失敗（試行済: {len(variants)}バリアント）: {clean[:40]}", ""
+    def reverse_town(self, lat: float, lon: float) -> str:
+        """
+        v4.5: 国土地理院 逆ジオコーダーで座標の町丁目名（例: "成増一丁目"）を取得。
+        失敗時は空文字。
+        """
+        r, self.last_status = call_with_policy(
+            CALL_POLICIES["gsi"], self.GSI_REVERSE_URL,
+            breaker=self._breakers[self.GSI_REVERSE_URL], limiter=self._limiter,
+            send=lambda t: requests.get(
+                self.GSI_REVERSE_URL, params={"lat": lat, "lon": lon},
+                headers={"User-Agent": "PharmacyRxPredictor"}, timeout=t,
+            ),
+        )
+        if r is None or r.status_code != 200:
+            return ""
+        try:
+            name = (r.json().get("results") or {}).get("lv01Nm", "").strip()
+        except (ValueError, AttributeError):
+            return ""
+        return "" if name == "-" else name
 
 
 # ---------------------------------------------------------------------------
 # 3. 近隣施設検索（Overpass API）
 # ---------------------------------------------------------------------------
 
+# v4.5: Overpass キャッシュの量子化パラメータ
+OVERPASS_TILE_DEG: float = 0.002          # 取得中心のスナップ間隔（≒ 南北220m）
+OVERPASS_RADIUS_STEP_M: int = 500         # 取得半径の切り上げ単位
+OVERPASS_MAX_CACHED_RADIUS_M: int = 6_000  # これを超える半径はキャッシュしない
+OVERPASS_WAY_TOLERANCE_M: float = 100.0   # way は中心点で判定するため半径を少し広げる
+
+# v4.5: 医療機関・薬局の抽出条件（Overpass クエリ生成とローカルOSM取り込みで共用）
+#   (要素種別, タグキー, 演算子 "~"=正規表現 / "="=完全一致 / ""=キーの存在, 値)
+# v3.2: 日本語タグ・追加 healthcare タグを拡充、薬局タグを拡充
+# (shop=pharmacy / healthcare=pharmacy も追加し、日本OSMの表記ゆれに対応)
+OVERPASS_TAG_FILTERS: List[Tuple[Tuple[str, ...], str, str, str]] = [
+    (("node", "way"), "amenity", "~", "^(hospital|clinic|doctors|医院|診療所|クリニック)$"),
+    (("node", "way"), "healthcare", "~",
+     "^(hospital|clinic|doctor|centre|physiotherapist|rehabilitation|dialysis)$"),
+    (("node",), "medical", "", ""),
+    (("node", "way"), "amenity", "=", "pharmacy"),
+    (("node", "way"), "shop", "=", "pharmacy"),
+    (("node", "way"), "healthcare", "=", "pharmacy"),
+]
+_TAG_FILTER_PATTERNS = {v: re.compile(v) for _, _, op, v in OVERPASS_TAG_FILTERS if op == "~"}
+
+# ローカルOSM（取り込み済みの範囲外）で Overpass API へフォールバックするか
+OSM_LIVE_FALLBACK: bool = True
+
+
+# v4.5: 校正バッチの一括取得で1クエリにまとめる範囲の上限（矩形の一辺）
+OVERPASS_CLUSTER_MAX_SPAN_M: float = 10_000.0
+
+# v4.5: Overpass エンドポイント（先頭から順に試行）。
+# 環境変数 PHARMACY_RX_OVERPASS_URLS（カンマ区切り）で差し替え可能。
+# 自前の Overpass インスタンス（例: http://localhost:12345/api/interpreter）を先頭に置けば
+# 公開ミラーはその予備になる。
+OVERPASS_ENDPOINTS: List[str] = [
+    u.strip() for u in os.environ.get(
+        "PHARMACY_RX_OVERPASS_URLS",
+        "https://overpass-api.de/api/interpreter,"
+        "https://overpass.kumi.systems/api/interpreter,"
+        "https://overpass.private.coffee/api/interpreter",
+    ).split(",") if u.strip()
+]
+OVERPASS_MAX_QUEUE_WAIT_S: float = 20.0        # 空きスロット待ちの上限（超えるなら次のミラーへ）
+OVERPASS_DEFAULT_SLOTS: int = 2                # /api/status が取れない場合の同時実行数
+# 接続・応答タイムアウトと呼び出し全体の期限は CALL_POLICIES["overpass"] / ["overpass_status"]
+
+
+def _circle_bbox(lat: float, lon: float, radius: float) -> Tuple[float, float, float, float]:
+    """円の外接矩形 (south, west, north, east)"""
+    dlat = radius / 111_000
+    dlon = dlat / max(math.cos(math.radians(lat)), 0.1)
+    return lat - dlat, lon - dlon, lat + dlat, lon + dlon
+
+
+def _element_latlon(elem: Dict) -> Tuple[float, float]:
+    """Overpass element の代表点（node は座標、way は center）"""
+    if elem.get("type") == "node":
+        return elem.get("lat", 0), elem.get("lon", 0)
+    c = elem.get("center", {})
+    return c.get("lat", 0), c.get("lon", 0)
+
+
+def _matches_tag_filters(osm_type: str, tags: Dict[str, str]) -> bool:
+    """OVERPASS_TAG_FILTERS のいずれかに一致するか（Overpass クエリと同じ判定）"""
+    for types, key, op, value in OVERPASS_TAG_FILTERS:
+        if osm_type not in types or key not in tags:
+            continue
+        if not op:
+            return True
+        if op == "=" and tags[key] == value:
+            return True
+        if op == "~" and _TAG_FILTER_PATTERNS[value].search(tags[key]):
+            return True
+    return False
+
+
+_ELEMENTS_START_RE = re.compile(r'"elements"\s*:\s*\[')
+_REMARK_RE = re.compile(r'"remark"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+
+def _iter_overpass_elements(chunks: Iterable[bytes], meta: Dict[str, str]) -> Iterator[Dict]:
+    """
+    v4.5: Overpass JSON 応答（バイト列のチャンク）から elements を1件ずつ取り出す。
+
+    応答全体を読み込んでから json.loads するのではなく、届いた分から順に要素を返すため、
+    受信と解析が重なり、応答全体の dict を同時に保持しない。
+    要素配列の後ろにある remark（サーバー側タイムアウト等）は meta["remark"] に入れる。
+    途中で途切れた応答は ValueError。
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buf, pos = "", 0
+    started = closed = False
+    tail_from = 0
+    for chunk in itertools.chain(chunks, [None]):
+        eof = chunk is None
+        buf += utf8.decode(b"" if eof else chunk, final=eof)
+        if closed:
+            continue
+        if not started:
+            m = _ELEMENTS_START_RE.search(buf)
+            if not m:
+                if eof:
+                    raise ValueError("Overpass 応答に elements がありません")
+                continue
+            started, pos = True, m.end()
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos >= len(buf):
+                break
+            if buf[pos] == "]":
+                closed, tail_from = True, pos + 1
+                break
+            try:
+                elem, pos = decoder.raw_decode(buf, pos)
+            except ValueError:
+                break   # 要素の途中まで（次のチャンクを待つ）
+            yield elem
+        if closed:
+            continue
+        if eof:
+            raise ValueError("Overpass 応答が途中で途切れています")
+        buf, pos = buf[pos:], 0
+    m = _REMARK_RE.search(buf, tail_from)
+    meta["remark"] = json.loads(f'"{m.group(1)}"') if m else ""
+
+
+# v4.5: 予測モデルが参照する OSM タグ（NearbyFacility.osm_tags に残すのはこれだけ）
+OSM_MODEL_TAGS: Tuple[str, ...] = (
+    "name", "name:ja", "amenity", "shop", "healthcare", "beds",
+    "healthcare:speciality", "specialty", "pharmacy", "staff:count",
+)
+_OSM_TYPES: Tuple[str, ...] = ("node", "way", "relation")
+
+
+def _int_tag(tags: Dict[str, str], key: str) -> int:
+    """数値タグ（"20" 等）を整数に。欠損・"20-30" のような非数値は 0"""
+    try:
+        return int(tags.get(key, 0) or 0)
+    except ValueError:
+        return 0
+
+
+class FacilityTable:
+    """
+    v4.5: 近隣施設の列指向テーブル
+
+    Overpass 要素を1件ずつ add() し、座標・距離・種別・診療科コード・病床数・医師数・
+    院内薬局フラグ・推定外来数を array 列で保持する。タグはモデルが参照する
+    OSM_MODEL_TAGS だけを残す。
+    予測ロジック向けの NearbyFacility リストは to_facilities() で生成する。
+    """
+
+    KIND_CLINIC, KIND_HOSPITAL, KIND_PHARMACY = 0, 1, 2
+    _KIND_NAMES = ("clinic", "hospital", "pharmacy")
+
+    def __init__(self, lat: float, lon: float, radius: int):
+        self.center = (lat, lon)
+        self.radius = radius
+        self.osm_type = array("b")
+        self.osm_id = array("q")
+        self.names: List[str] = []
+        self.lat = array("d")
+        self.lon = array("d")
+        self.distance_m = array("d")
+        self.kind = array("b")
+        self.specialty = array("h")          # specialties へのインデックス
+        self.specialties: List[str] = []
+        self._specialty_codes: Dict[str, int] = {}
+        self.beds = array("i")
+        self.staff_count = array("i")
+        self.inhouse = array("b")
+        self.daily_outpatients = array("i")
+        self.tags: List[Dict[str, str]] = []   # OSM_MODEL_TAGS のみ
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @classmethod
+    def from_elements(cls, elements: Iterable[Dict], lat: float, lon: float, radius: int) -> "FacilityTable":
+        table = cls(lat, lon, radius)
+        for elem in elements:
+            table.add(elem)
+        return table
+
+    def add(self, elem: Dict) -> bool:
+        """要素を分類して追加（名称なし・座標なし・半径外は捨てて False）"""
+        tags = elem.get("tags") or {}
+        name = tags.get("name", tags.get("name:ja", ""))
+        if not name:
+            return False
+        e_lat, e_lon = _element_latlon(elem)
+        if not (e_lat and e_lon):
+            return False
+        dist = haversine_distance(self.center[0], self.center[1], e_lat, e_lon)
+        # 取得円は要求円より大きいため距離で絞り込む（way は中心点なので余裕を持たせる）
+        if dist > self.radius + (OVERPASS_WAY_TOLERANCE_M if elem.get("type") != "node" else 0.0):
+            return False
+        slim = {k: tags[k] for k in OSM_MODEL_TAGS if k in tags}
+        beds = _int_tag(tags, "beds")
+        # v3.2: amenity=pharmacy / shop=pharmacy / healthcare=pharmacy 全て薬局として扱う
+        if (tags.get("amenity") == "pharmacy" or tags.get("shop") == "pharmacy"
+                or tags.get("healthcare") == "pharmacy"):
+            kind, specialty, inhouse, daily_op = self.KIND_PHARMACY, "不明/その他", False, 0
+        else:
+            kind = self.KIND_HOSPITAL if (
+                tags.get("amenity") == "hospital" or tags.get("healthcare") == "hospital" or beds >= 20
+            ) else self.KIND_CLINIC
+            sp_raw = tags.get("healthcare:speciality", tags.get("specialty", ""))
+            specialty = OSM_SPECIALTY_MAP.get(sp_raw.lower(), "") if sp_raw else ""
+            # v4.2: OSMタグに speciality がない場合、施設名（日本語）から診療科を推定
+            if not specialty:
+                specialty = detect_specialty_from_name(name)
+            inhouse = tags.get("pharmacy", "") in ["yes", "dispensing"]
+            # v4.2: 診療科テーブルを使った外来患者数推定（specialty を渡す）
+            daily_op = OverpassSearcher._estimate_outpatients(
+                self._KIND_NAMES[kind], beds, slim, specialty,
+            )
+        code = self._specialty_codes.get(specialty)
+        if code is None:
+            code = self._specialty_codes[specialty] = len(self.specialties)
+            self.specialties.append(specialty)
+        osm_type = elem.get("type", "node")
+        self.osm_type.append(_OSM_TYPES.index(osm_type) if osm_type in _OSM_TYPES else 0)
+        self.osm_id.append(int(elem.get("id", 0)))
+        self.names.append(name)
+        self.lat.append(e_lat)
+        self.lon.append(e_lon)
+        self.distance_m.append(dist)
+        self.kind.append(kind)
+        self.specialty.append(code)
+        self.beds.append(beds)
+        self.staff_count.append(_int_tag(tags, "staff:count"))
+        self.inhouse.append(inhouse)
+        self.daily_outpatients.append(daily_op)
+        self.tags.append(slim)
+        return True
+
+    def osm_ref(self, i: int) -> str:
+        """i 行目の OSM 参照（例: "node/123"）"""
+        return f"{_OSM_TYPES[self.osm_type[i]]}/{self.osm_id[i]}"
+
+    def to_facilities(self) -> Tuple[List[NearbyFacility], List[NearbyFacility]]:
+        """(医療機関, 薬局) の NearbyFacility リスト（各々距離順）"""
+        medical, pharmacies = [], []
+        for i in sorted(range(len(self)), key=self.distance_m.__getitem__):
+            kind = self.kind[i]
+            fac = NearbyFacility(
+                name=self.names[i], facility_type=self._KIND_NAMES[kind],
+                lat=self.lat[i], lon=self.lon[i], distance_m=self.distance_m[i],
+                osm_tags=self.tags[i], osm_ref=self.osm_ref(i) if self.osm_id[i] else "",
+            )
+            if kind == self.KIND_PHARMACY:
+                pharmacies.append(fac)
+                continue
+            fac.specialty = self.specialties[self.specialty[i]]
+            fac.daily_outpatients = self.daily_outpatients[i]
+            fac.beds = self.beds[i]
+            fac.has_inhouse_pharmacy = bool(self.inhouse[i])
+            medical.append(fac)
+        return medical, pharmacies
+
+
+class OverpassCache:
+    """
+    v4.5: Overpass 応答（raw elements）の永続キャッシュ
+
+    キー: (取得中心を OVERPASS_TILE_DEG にスナップしたタイル番号, 取得半径)
+    取得半径は「要求半径 + スナップによるずれ」を OVERPASS_RADIUS_STEP_M 単位で切り上げるため、
+    近い地点・少し小さい半径の再検索は既存の大きな円の内側に収まり、通信せずに
+    ローカルで距離フィルタして返せる（find()）。
+    """
+
+    TTL_S: float = 14 * 86_400
+
+    def __init__(self, path: Optional[str] = None, ttl_s: Optional[float] = None):
+        self.path = path or os.path.join(CACHE_DIR, "overpass_cache.sqlite3")
+        self.ttl_s = ttl_s if ttl_s is not None else self.TTL_S
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = _open_sqlite(self.path)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS overpass ("
+                " tile_lat INTEGER NOT NULL, tile_lon INTEGER NOT NULL, radius INTEGER NOT NULL,"
+                " lat REAL NOT NULL, lon REAL NOT NULL, elements BLOB NOT NULL,"
+                " created_at REAL NOT NULL, PRIMARY KEY (tile_lat, tile_lon, radius))"
+            )
+
+    @staticmethod
+    def fetch_circle(lat: float, lon: float, radius: int) -> Tuple[float, float, int]:
+        """要求 (lat, lon, radius) を包含する量子化済みの取得円 (中心lat, 中心lon, 半径)"""
+        c_lat = round(round(lat / OVERPASS_TILE_DEG) * OVERPASS_TILE_DEG, 6)
+        c_lon = round(round(lon / OVERPASS_TILE_DEG) * OVERPASS_TILE_DEG, 6)
+        need = radius + haversine_distance(lat, lon, c_lat, c_lon)
+        step = OVERPASS_RADIUS_STEP_M
+        return c_lat, c_lon, int(math.ceil(need / step) * step)
+
+    def find(self, lat: float, lon: float, radius: int) -> Optional[List[Dict]]:
+        """要求円を内包する有効なキャッシュがあれば、最小のものの elements を返す"""
+        t_lat, t_lon = round(lat / OVERPASS_TILE_DEG), round(lon / OVERPASS_TILE_DEG)
+        span_lat = int(OVERPASS_MAX_CACHED_RADIUS_M / 111_000 / OVERPASS_TILE_DEG) + 1
+        span_lon = int(span_lat / max(math.cos(math.radians(lat)), 0.1)) + 1
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT tile_lat, tile_lon, radius, lat, lon FROM overpass"
+                " WHERE tile_lat BETWEEN ? AND ? AND tile_lon BETWEEN ? AND ?"
+                " AND radius >= ? AND created_at >= ? ORDER BY radius",
+                (t_lat - span_lat, t_lat + span_lat, t_lon - span_lon, t_lon + span_lon,
+                 radius, time.time() - self.ttl_s),
+            ).fetchall()
+            for tl, tn, r, c_lat, c_lon in rows:
+                if haversine_distance(lat, lon, c_lat, c_lon) + radius <= r:
+                    blob = self._conn.execute(
+                        "SELECT elements FROM overpass WHERE tile_lat = ? AND tile_lon = ? AND radius = ?",
+                        (tl, tn, r),
+                    ).fetchone()[0]
+                    self.hits += 1
+                    return json.loads(zlib.decompress(blob))
+            self.misses += 1
+        return None
+
+    def tags_of(self, lat: float, lon: float, osm_ref: str) -> Optional[Dict[str, str]]:
+        """(lat, lon) を含むキャッシュ済み応答から osm_ref（"node/123"）の全タグを探す（無ければ None）"""
+        osm_type, _, osm_id = osm_ref.partition("/")
+        elements = self.find(lat, lon, 1)
+        for elem in elements or []:
+            if elem.get("type") == osm_type and str(elem.get("id")) == osm_id:
+                return elem.get("tags") or {}
+        return None
+
+    def put(self, lat: float, lon: float, radius: int, elements: List[Dict]) -> None:
+        self.put_blob(lat, lon, radius, zlib.compress(json.dumps(elements, ensure_ascii=False).encode("utf-8")))
+
+    def put_blob(self, lat: float, lon: float, radius: int, blob: bytes) -> None:
+        """zlib 圧縮済みの elements JSON 配列をそのまま保存（ストリーム解析時に使用）"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO overpass VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (round(lat / OVERPASS_TILE_DEG), round(lon / OVERPASS_TILE_DEG), radius,
+                 lat, lon, blob, time.time()),
+            )
+
+    def purge_expired(self) -> int:
+        """期限切れエントリを削除し、削除件数を返す"""
+        with self._lock, self._conn:
+            cur = self._conn.execute(
+                "DELETE FROM overpass WHERE created_at < ?", (time.time() - self.ttl_s,)
+            )
+            return cur.rowcount
+
+    def clear(self) -> int:
+        """全エントリを削除（OSM側の更新を即時反映したい場合）"""
+        with self._lock, self._conn:
+            return self._conn.execute("DELETE FROM overpass").rowcount
+
+    def summary(self) -> str:
+        return f"ヒット{self.hits}件 / ミス{self.misses}件"
+
+
+@st.cache_resource
+def get_overpass_cache() -> OverpassCache:
+    """プロセス共通の OverpassCache"""
+    return OverpassCache()
+
+
+_STATUS_RATE_LIMIT_RE = re.compile(r"^Rate limit:\s*(\d+)", re.M)
+_STATUS_AVAILABLE_RE = re.compile(r"^(\d+) slots? available now", re.M)
+_STATUS_WAIT_RE = re.compile(r"in (-?\d+) seconds?\.", re.M)
+
+
+def _parse_overpass_status(text: str) -> Optional[Tuple[int, int, float]]:
+    """
+    /api/status の本文 → (同時実行上限 0=無制限, 空きスロット数, 次の空きまでの秒数)。
+    形式が違う（ステータス非対応のミラー）場合は None。
+    """
+    m_limit = _STATUS_RATE_LIMIT_RE.search(text)
+    if not m_limit:
+        return None
+    m_avail = _STATUS_AVAILABLE_RE.search(text)
+    waits = [max(0, int(s)) for s in _STATUS_WAIT_RE.findall(text)]
+    available = int(m_avail.group(1)) if m_avail else 0
+    wait_s = 0.0 if available > 0 or not waits else float(min(waits))
+    return int(m_limit.group(1)), available, wait_s
+
+
+class OverpassScheduler:
+    """
+    v4.5: Overpass クエリの発行スケジューラー（プロセス共通）
+
+      1. エンドポイントごとにスロット数（/api/status の Rate limit）分のセマフォを持ち、
+         プロセス内の同時発行はそこで待ち行列にする
+      2. 発行前に /api/status で空きスロットを確認し、空きまでの待ちが
+         残りの待ち時間（OVERPASS_MAX_QUEUE_WAIT_S）に収まれば待ってから発行、
+         収まらなければ次のミラーへ
+      3. 429 / 5xx / タイムアウト / 接続エラーは CircuitBreaker に失敗として記録し次のミラーへ。
+         遮断中（open）のエンドポイントは問い合わせずに飛ばすため、全滅時も即座に失敗を返す。
+         /api/status の確認は別のブレーカー（ホスト名 + "/status"）で数え、その成功で
+         interpreter の連続失敗がリセットされたり half-open の試行枠を使ったりしないようにする
+      4. 400（クエリ不正）はミラーを替えても同じなので、その場でエラーを返す
+      5. 全ミラーが失敗したら、ジッター付きの待機を挟んで CALL_POLICIES["overpass"].max_attempts 周まで
+         やり直す。各試行の読み取りタイムアウトは呼び出し全体の期限（deadline_s）の残りに切り詰める
+    """
+
+    def __init__(self, endpoints: Optional[List[str]] = None,
+                 max_queue_wait_s: float = OVERPASS_MAX_QUEUE_WAIT_S,
+                 session=None):
+        self.endpoints = list(endpoints or OVERPASS_ENDPOINTS)
+        self.max_queue_wait_s = max_queue_wait_s
+        self.http = session or requests   # get / post を持つもの（requests.Session 等。self-check では通信なしの応答）
+        self._lock = threading.Lock()
+        self._slots: Dict[str, threading.BoundedSemaphore] = {}
+        self._has_status: Dict[str, bool] = {}
+
+    @staticmethod
+    def _host(url: str) -> str:
+        return urllib.parse.urlsplit(url).netloc or url
+
+    def _status(self, url: str) -> Optional[Tuple[int, int, float]]:
+        """空きスロット状況（ステータス非対応・取得失敗なら None）"""
+        if self._has_status.get(url) is False:
+            return None
+        status_url = url.rsplit("/", 1)[0] + "/status"
+        r, _ = call_with_policy(
+            CALL_POLICIES["overpass_status"], status_url,
+            send=lambda t: self.http.get(status_url, timeout=t),
+            breaker=get_circuit_breaker(self._host(url) + "/status"),
+        )
+        if r is None:
+            return None
+        parsed = _parse_overpass_status(r.text) if r.status_code == 200 else None
+        if parsed is None and r.status_code in (200, 404):
+            self._has_status[url] = False
+        elif parsed is not None:
+            self._has_status[url] = True
+        return parsed
+
+    def _semaphore(self, url: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            sem = self._slots.get(url)
+        if sem is not None:
+            return sem
+        status = self._status(url)
+        n_slots = status[0] if status and status[0] > 0 else OVERPASS_DEFAULT_SLOTS
+        with self._lock:
+            return self._slots.setdefault(url, threading.BoundedSemaphore(n_slots))
+
+    def run(
+        self, query: str, parse: Optional[Callable[[requests.Response], Dict]] = None,
+    ) -> Tuple[Optional[Dict], CallStatus]:
+        """
+        クエリを発行し (応答JSON or None, CallStatus) を返す。
+        parse を渡すと応答をストリームで受け、parse(response) の戻り値を応答JSONの代わりに返す
+        （エンドポイントを替えて再試行する場合は再度呼ばれる）。
+        全エンドポイントで失敗した場合は status.error に各エンドポイントの理由をまとめる。
+        """
+        policy = CALL_POLICIES["overpass"]
+        start = time.time()
+        call_deadline = start + policy.deadline_s
+        queue_deadline = min(call_deadline, start + self.max_queue_wait_s)
+        status = CallStatus("overpass")
+        errors: List[str] = []
+        kind = "circuit_open"
+        for round_no in range(policy.max_attempts):
+            if round_no:
+                backoff = random.uniform(0, min(policy.backoff_max_s, policy.backoff_base_s * 2 ** (round_no - 1)))
+                if time.time() + backoff >= call_deadline:
+                    kind = "deadline"
+                    break
+                time.sleep(backoff)
+            tried = False
+            for url in self.endpoints:
+                host = self._host(url)
+                breaker = get_circuit_breaker(host)
+                if breaker.state == CircuitBreaker.OPEN:
+                    errors.append(f"{host}: 遮断中（{breaker.last_error}・残り{breaker.retry_after():.0f}秒）")
+                    continue
+                tried = True
+                status.attempts += 1
+                data, err = self._run_on(url, query, breaker, queue_deadline, call_deadline, parse)
+                if data is not None:
+                    status.elapsed_s = time.time() - start
+                    return data, status
+                errors.append(f"{host}: {err.error}")
+                kind = err.kind
+                if err.http_status == 400:   # クエリ不正はミラーを替えても同じ
+                    status.http_status = 400
+                    status.elapsed_s = time.time() - start
+                    return None, status.fail("http", "Overpass API クエリエラー (HTTP 400)")
+            if not tried:
+                break
+        status.elapsed_s = time.time() - start
+        return None, status.fail(kind, "Overpass API 取得失敗 — " + " / ".join(errors))
+
+    def _run_on(
+        self, url: str, query: str, breaker: CircuitBreaker, queue_deadline: float, call_deadline: float,
+        parse: Optional[Callable[[requests.Response], Dict]] = None,
+    ) -> Tuple[Optional[Dict], CallStatus]:
+        """1エンドポイントで1回発行。Returns: (応答JSON or None, このエンドポイントでの結果)"""
+        status = CallStatus("overpass")
+        sem = self._semaphore(url)
+        if not sem.acquire(timeout=max(0.0, queue_deadline - time.time())):
+            return None, status.fail("deadline", "同時実行枠の空き待ちがタイムアウト")
+        try:
+            slots = self._status(url)
+            if slots is not None and slots[0] > 0 and slots[1] == 0:
+                wait_s = slots[2]
+                if time.time() + wait_s > queue_deadline:
+                    return None, status.fail("deadline", f"空きスロットなし（{wait_s:.0f}秒後）")
+                time.sleep(wait_s)
+            r, status = call_with_policy(
+                dataclasses.replace(CALL_POLICIES["overpass"], max_attempts=1), url,
+                send=lambda t: self.http.post(url, data={"data": query}, timeout=t, stream=parse is not None),
+                deadline=call_deadline, breaker=breaker,
+            )
+            if r is None:
+                return None, status
+            try:
+                if r.status_code != 200:
+                    return None, status
+                data = parse(r) if parse is not None else r.json()
+            except ValueError:
+                breaker.record_failure("不正な応答")
+                return None, status.fail("parse", "JSON以外の応答")
+            except (requests.RequestException, OSError) as e:   # ストリーム受信中の切断・タイムアウト
+                breaker.record_failure("受信エラー")
+                return None, status.fail("connection", f"受信エラー: {e}")
+            finally:
+                r.close()
+            return data, status
+        finally:
+            sem.release()
+
+
+@st.cache_resource
+def get_overpass_scheduler() -> OverpassScheduler:
+    """プロセス共通の OverpassScheduler（エンドポイント別のスロット待ち行列を共有）"""
+    return OverpassScheduler()
+
+
+# ---------------------------------------------------------------------------
+# 3-b. v4.5: ローカルOSM抽出（SQLite R*Tree）
+# ---------------------------------------------------------------------------
+# 地域の OSM 抽出（Geofabrik 等の .osm / .osm.bz2 / .osm.gz、または Overpass の JSON ダンプ）から
+# OVERPASS_TAG_FILTERS に一致する医療機関・薬局だけを取り込み、search_nearby を通信なしで処理する。
+# `python app_v4_4.py import-osm <ファイル>` で取り込む。
+
+def _open_text_maybe_compressed(path: str, mode: str = "rb"):
+    """拡張子 .bz2 / .gz なら展開しながら開く"""
+    if path.endswith(".bz2"):
+        return bz2.open(path, mode)
+    if path.endswith(".gz"):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+class LocalOSMStore:
+    """
+    v4.5: OSM 医療機関・薬局フィーチャのローカルストア
+
+    osm_feature: (osm_type, osm_id, lat, lon, tags JSON)   ※ way は bbox 中心（Overpass の out center 相当）
+    osm_rtree:   R*Tree 空間索引（点なので min = max）
+    osm_meta:    取り込み範囲（bbox）・取り込み元・取り込み日時
+
+    elements_within() は Overpass 応答と同じ形の element dict を返すため、
+    OverpassSearcher._parse_elements() をそのまま使える。範囲外は None。
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.path.join(CACHE_DIR, "osm_local.sqlite3")
+        self._lock = threading.Lock()
+        self._conn = _open_sqlite(self.path)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS osm_feature ("
+                " id INTEGER PRIMARY KEY, osm_type TEXT NOT NULL, osm_id INTEGER NOT NULL,"
+                " lat REAL NOT NULL, lon REAL NOT NULL, tags TEXT NOT NULL,"
+                " UNIQUE (osm_type, osm_id))"
+            )
+            self._conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS osm_rtree"
+                " USING rtree(id, min_lat, max_lat, min_lon, max_lon)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS osm_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+            )
+        self.bounds = self._load_bounds()
+
+    def _load_bounds(self) -> Optional[Tuple[float, float, float, float]]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM osm_meta WHERE key = 'bounds'").fetchone()
+        return tuple(json.loads(row[0])) if row else None
+
+    def covers(self, lat: float, lon: float, radius: float) -> bool:
+        """要求円が取り込み範囲（bbox）に収まるか"""
+        if self.bounds is None:
+            return False
+        s, w, n, e = _circle_bbox(lat, lon, radius)
+        min_lat, min_lon, max_lat, max_lon = self.bounds
+        return min_lat <= s and n <= max_lat and min_lon <= w and e <= max_lon
+
+    def elements_within(self, lat: float, lon: float, radius: float) -> Optional[List[Dict]]:
+        """要求円の外接矩形内の element を返す（取り込み範囲外なら None）"""
+        if not self.covers(lat, lon, radius):
+            return None
+        s, w, n, e = _circle_bbox(lat, lon, radius + OVERPASS_WAY_TOLERANCE_M)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT f.osm_type, f.osm_id, f.lat, f.lon, f.tags FROM osm_rtree r"
+                " JOIN osm_feature f ON f.id = r.id"
+                " WHERE r.min_lat >= ? AND r.max_lat <= ? AND r.min_lon >= ? AND r.max_lon <= ?",
+                (s, n, w, e),
+            ).fetchall()
+        elements: List[Dict] = []
+        for osm_type, osm_id, f_lat, f_lon, tags in rows:
+            if osm_type == "node":
+                elements.append({"type": "node", "id": osm_id, "lat": f_lat, "lon": f_lon,
+                                 "tags": json.loads(tags)})
+            else:
+                elements.append({"type": osm_type, "id": osm_id, "center": {"lat": f_lat, "lon": f_lon},
+                                 "tags": json.loads(tags)})
+        return elements
+
+    def tags_of(self, osm_ref: str) -> Optional[Dict[str, str]]:
+        """osm_ref（"node/123"）の全タグ（取り込まれていなければ None）"""
+        osm_type, _, osm_id = osm_ref.partition("/")
+        if not osm_id.isdigit():
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT tags FROM osm_feature WHERE osm_type = ? AND osm_id = ?", (osm_type, int(osm_id)),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    # ── 取り込み ───────────────────────────────────────────────
+    def import_file(self, path: str, replace: bool = False) -> int:
+        """OSM XML（.osm/.bz2/.gz）または Overpass JSON を取り込み、フィーチャ数を返す"""
+        if path.endswith(".json") or path.endswith(".json.gz") or path.endswith(".json.bz2"):
+            features, bounds = self._read_overpass_json(path)
+        else:
+            features, bounds = self._read_osm_xml(path)
+        with self._lock, self._conn:
+            if replace:
+                self._conn.execute("DELETE FROM osm_feature")
+                self._conn.execute("DELETE FROM osm_rtree")
+                self._conn.execute("DELETE FROM osm_meta")
+                old = None
+            else:
+                row = self._conn.execute("SELECT value FROM osm_meta WHERE key = 'bounds'").fetchone()
+                old = json.loads(row[0]) if row else None
+            for osm_type, osm_id, f_lat, f_lon, tags in features:
+                cur = self._conn.execute(
+                    "INSERT OR REPLACE INTO osm_feature (osm_type, osm_id, lat, lon, tags)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (osm_type, osm_id, f_lat, f_lon, json.dumps(tags, ensure_ascii=False)),
+                )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO osm_rtree VALUES (?, ?, ?, ?, ?)",
+                    (cur.lastrowid, f_lat, f_lat, f_lon, f_lon),
+                )
+            # INSERT OR REPLACE で置き換えられた行の索引を掃除
+            self._conn.execute("DELETE FROM osm_rtree WHERE id NOT IN (SELECT id FROM osm_feature)")
+            if bounds is not None:
+                if old is not None:
+                    # 複数ファイル取り込み時は外接矩形で近似（離れた地域の間は「範囲内」扱いになる）
+                    bounds = (min(old[0], bounds[0]), min(old[1], bounds[1]),
+                              max(old[2], bounds[2]), max(old[3], bounds[3]))
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO osm_meta VALUES ('bounds', ?)", (json.dumps(bounds),)
+                )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO osm_meta VALUES ('imported_at', ?)",
+                (datetime.now().isoformat(timespec="seconds"),),
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO osm_meta VALUES ('source', ?)", (os.path.basename(path),)
+            )
+        self.bounds = self._load_bounds()
+        return len(features)
+
+    @staticmethod
+    def _bbox_center(points: List[Tuple[float, float]]) -> Optional[Tuple[float, float]]:
+        if not points:
+            return None
+        lats = [p[0] for p in points]
+        lons = [p[1] for p in points]
+        return (min(lats) + max(lats)) / 2, (min(lons) + max(lons)) / 2
+
+    @staticmethod
+    def _feature_bounds(features) -> Optional[Tuple[float, float, float, float]]:
+        if not features:
+            return None
+        lats = [f[2] for f in features]
+        lons = [f[3] for f in features]
+        return min(lats), min(lons), max(lats), max(lons)
+
+    def _read_osm_xml(self, path: str):
+        """
+        OSM XML を2パスで読む（全ノード座標をメモリに載せないため）。
+          1パス目: 条件に合う node を確定し、条件に合う way とその構成ノードIDを記録
+          2パス目: 記録したノードIDの座標だけを集めて way の bbox 中心を求める
+        """
+        features: List[Tuple[str, int, float, float, Dict]] = []
+        ways: List[Tuple[int, Dict, List[int]]] = []
+        needed: set = set()
+        bounds: Optional[Tuple[float, float, float, float]] = None
+
+        with _open_text_maybe_compressed(path) as f:
+            context = ET.iterparse(f, events=("start", "end"))
+            _, root = next(context)
+            for event, elem in context:
+                if event != "end":
+                    continue
+                if elem.tag == "bounds":
+                    bounds = (float(elem.get("minlat")), float(elem.get("minlon")),
+                              float(elem.get("maxlat")), float(elem.get("maxlon")))
+                elif elem.tag in ("node", "way"):
+                    tags = {t.get("k"): t.get("v") for t in elem.iter("tag")}
+                    if tags and _matches_tag_filters(elem.tag, tags):
+                        if elem.tag == "node":
+                            features.append(("node", int(elem.get("id")),
+                                             float(elem.get("lat")), float(elem.get("lon")), tags))
+                        else:
+                            refs = [int(nd.get("ref")) for nd in elem.iter("nd")]
+                            ways.append((int(elem.get("id")), tags, refs))
+                            needed.update(refs)
+                    root.clear()
+                elif elem.tag == "relation":
+                    root.clear()
+
+        if ways:
+            coords: Dict[int, Tuple[float, float]] = {}
+            with _open_text_maybe_compressed(path) as f:
+                context = ET.iterparse(f, events=("start", "end"))
+                _, root = next(context)
+                for event, elem in context:
+                    if event == "start":
+                        if elem.tag in ("way", "relation"):
+                            break   # OSM XML は node → way → relation の順
+                        continue
+                    if elem.tag == "node":
+                        nid = int(elem.get("id"))
+                        if nid in needed:
+                            coords[nid] = (float(elem.get("lat")), float(elem.get("lon")))
+                        root.clear()
+            for way_id, tags, refs in ways:
+                center = self._bbox_center([coords[r] for r in refs if r in coords])
+                if center:
+                    features.append(("way", way_id, center[0], center[1], tags))
+        return features, bounds or self._feature_bounds(features)
+
+    def _read_overpass_json(self, path: str):
+        """Overpass の JSON ダンプ（out center / out geom / out body + ノード）を読む"""
+        with _open_text_maybe_compressed(path, "rt") as f:
+            data = json.load(f)
+        elements = data.get("elements", [])
+        node_coords = {
+            e["id"]: (e["lat"], e["lon"]) for e in elements if e.get("type") == "node" and "lat" in e
+        }
+        features: List[Tuple[str, int, float, float, Dict]] = []
+        for e in elements:
+            tags = e.get("tags") or {}
+            if not tags or not _matches_tag_filters(e.get("type", ""), tags):
+                continue
+            if e["type"] == "node":
+                features.append(("node", e["id"], e["lat"], e["lon"], tags))
+                continue
+            if "center" in e:
+                center = (e["center"]["lat"], e["center"]["lon"])
+            elif "geometry" in e:
+                center = self._bbox_center([(g["lat"], g["lon"]) for g in e["geometry"] if g])
+            else:
+                center = self._bbox_center([node_coords[n] for n in e.get("nodes", []) if n in node_coords])
+            if center:
+                features.append((e["type"], e["id"], center[0], center[1], tags))
+        b = data.get("bounds")
+        bounds = (b["minlat"], b["minlon"], b["maxlat"], b["maxlon"]) if b else None
+        return features, bounds or self._feature_bounds(features)
+
+    def summary(self) -> str:
+        with self._lock:
+            n = self._conn.execute("SELECT count(*) FROM osm_feature").fetchone()[0]
+            meta = dict(self._conn.execute("SELECT key, value FROM osm_meta").fetchall())
+        return f"{n:,}件（{meta.get('source', '?')} / 取り込み {meta.get('imported_at', '?')}）"
+
+
+@st.cache_resource
+def get_local_osm_store() -> Optional[LocalOSMStore]:
+    """
+    取り込み済みの LocalOSMStore（未取り込みなら None）。
+    プロセス内で共有するため、取り込み後はアプリを再起動すること。
+    """
+    path = os.path.join(CACHE_DIR, "osm_local.sqlite3")
+    if not os.path.exists(path):
+        return None
+    return LocalOSMStore(path)
+
+
 class OverpassSearcher:
-    URL = "https://overpass-api.de/api/interpreter"
+    """
+    v4.5 変更:
+      OverpassCache で応答を再利用（同じ地点の再分析・業態切替・シナリオ変更では通信しない）。
+      取得は量子化した一回り大きい円で行い、要求半径へはローカルで距離フィルタする。
+      use_cache=False で常に API へ問い合わせる。
+      LocalOSMStore（import-osm で取り込み済み）の範囲内ならローカルで処理し、
+      範囲外のみ API へ（OSM_LIVE_FALLBACK=False なら API を使わない）。
+      API 呼び出しは OverpassScheduler 経由（空きスロット確認・ミラー切替・遮断）。
+      取得できなかった場合は last_error に理由を残す（空リストを「施設なし」と区別するため）。
+      API 応答はストリームで1要素ずつ FacilityTable に詰め、
+      NearbyFacility.osm_tags にはモデルが使うタグ（OSM_MODEL_TAGS）だけを残し、
+      全タグは full_tags() で osm_ref から必要な時だけ引く。
+    """
+
+    def __init__(
+        self,
+        cache: Optional[OverpassCache] = None,
+        use_cache: bool = True,
+        local_store: Optional[LocalOSMStore] = None,
+        use_local: bool = True,
+        live_fallback: Optional[bool] = None,
+        scheduler: Optional[OverpassScheduler] = None,
+    ):
+        if cache is None and use_cache:
+            cache = get_overpass_cache()
+        if local_store is None and use_local:
+            local_store = get_local_osm_store()
+        self.cache = cache
+        self.local_store = local_store
+        self.live_fallback = OSM_LIVE_FALLBACK if live_fallback is None else live_fallback
+        self.scheduler = scheduler or get_overpass_scheduler()
+        self.last_error = ""
+        self.last_status = CallStatus("overpass")   # 直近の Overpass API 呼び出しの結果
 
     def search_nearby(
         self, lat: float, lon: float, radius: int = 800
     ) -> Tuple[List[NearbyFacility], List[NearbyFacility], str]:
-        # v3.2: 日本語タグ・追加 healthcare タグを拡充、薬局タグを拡充
-        # (shop=pharmacy / healthcare=pharmacy も追加し、日本OSMの表記ゆれに対応)
-        query = f"""
+        note = ""
+        elements = None
+        self.last_error = ""
+        if self.local_store is not None:
+            elements = self.local_store.elements_within(lat, lon, radius)
+            if elements is not None:
+                note = "（ローカルOSM）"
+            elif not self.live_fallback:
+                self.last_error = "ローカルOSMの取り込み範囲外です（Overpass API フォールバック無効）"
+                return [], [], self.last_error
+        if elements is None and self.cache is not None:
+            elements = self.cache.find(lat, lon, radius)
+            if elements is not None:
+                note = "（キャッシュ）"
+        if elements is not None:
+            table = FacilityTable.from_elements(elements, lat, lon, radius)
+        else:
+            table, err = self._fetch_table(lat, lon, radius)
+            if table is None:
+                self.last_error = err
+                return [], [], err
+        medical, pharmacies = table.to_facilities()
+        return medical, pharmacies, f"医療機関{len(medical)}件・薬局{len(pharmacies)}件{note}"
+
+    def _fetch_table(self, lat: float, lon: float, radius: int) -> Tuple[Optional[FacilityTable], str]:
+        """
+        Overpass API から取得し、応答をストリームで解析して FacilityTable を作る。
+        キャッシュ対象なら同じストリームから取得円全体の elements を圧縮して保存する
+        （remark 付きの不完全な応答は保存しない）。
+        """
+        cacheable = self.cache is not None and radius <= OVERPASS_MAX_CACHED_RADIUS_M
+        f_lat, f_lon, f_radius = (
+            OverpassCache.fetch_circle(lat, lon, radius) if cacheable else (lat, lon, radius)
+        )
+
+        def parse(r: requests.Response) -> Dict:
+            table = FacilityTable(lat, lon, radius)
+            packer = zlib.compressobj() if cacheable else None
+            parts: List[bytes] = []
+            meta: Dict[str, str] = {}
+            sep = b"["
+            for elem in _iter_overpass_elements(r.iter_content(chunk_size=65_536), meta):
+                table.add(elem)
+                if packer is not None:
+                    parts.append(packer.compress(sep + json.dumps(elem, ensure_ascii=False).encode("utf-8")))
+                    sep = b","
+            if packer is not None:
+                parts.append(packer.compress(b"]" if sep == b"," else b"[]") + packer.flush())
+            return {"table": table, "blob": b"".join(parts), "remark": meta.get("remark", "")}
+
+        data, self.last_status = self.scheduler.run(self._build_query(f_lat, f_lon, f_radius), parse=parse)
+        if data is None:
+            return None, self.last_status.error
+        if cacheable and not data["remark"]:
+            self.cache.put_blob(f_lat, f_lon, f_radius, data["blob"])
+        return data["table"], ""
+
+    def full_tags(self, fac: NearbyFacility) -> Tuple[Optional[Dict[str, str]], str]:
+        """
+        v4.5: 施設の全 OSM タグを osm_ref から引く → (タグ or None, 取得元 / 失敗理由)。
+        ローカルOSM → Overpass キャッシュ → Overpass API（live_fallback 時のみ）の順。
+        """
+        if not fac.osm_ref:
+            return None, "OSM 由来の施設ではありません"
+        if self.local_store is not None:
+            tags = self.local_store.tags_of(fac.osm_ref)
+            if tags is not None:
+                return tags, "ローカルOSM"
+        if self.cache is not None:
+            tags = self.cache.tags_of(fac.lat, fac.lon, fac.osm_ref)
+            if tags is not None:
+                return tags, "キャッシュ"
+        if not self.live_fallback:
+            return None, "ローカルOSM・キャッシュに見つかりません（Overpass API フォールバック無効）"
+        osm_type, _, osm_id = fac.osm_ref.partition("/")
+        elements, _, err = self._post_query(f"[out:json][timeout:25];\n{osm_type}({osm_id});\nout tags;")
+        if elements is None:
+            return None, err
+        if not elements:
+            return None, f"{fac.osm_ref} は OSM から削除されています"
+        return elements[0].get("tags") or {}, "Overpass API"
+
+    @staticmethod
+    def _build_query(lat: float, lon: float, radius: int) -> str:
+        """OVERPASS_TAG_FILTERS から around 検索クエリを組み立てる"""
+        return OverpassSearcher._build_query_for(f"around:{radius},{lat},{lon}")
+
+    @staticmethod
+    def _build_query_for(area: str) -> str:
+        """area: "around:半径,緯度,経度" または "南,西,北,東"（bbox）"""
+        lines: List[str] = []
+        for types, key, op, value in OVERPASS_TAG_FILTERS:
+            selector = f'["{key}"{op}"{value}"]' if op else f'["{key}"]'
+            for t in types:
+                lines.append(f"  {t}{selector}({area});")
+        body = "\n".join(lines)
+        return f"""
 [out:json][timeout:40];
 (
-  node["amenity"~"^(hospital|clinic|doctors|医院|診療所|クリニック)$"](around:{radius},{lat},{lon});
-  way["amenity"~"^(hospital|clinic|doctors|医院|診療所|クリニック)$"](around:{radius},{lat},{lon});
-  node["healthcare"~"^(hospital|clinic|doctor|centre|physiotherapist|rehabilitation|dialysis)$"](around:{radius},{lat},{lon});
-  way["healthcare"~"^(hospital|clinic|doctor|centre|physiotherapist|rehabilitation|dialysis)$"](around:{radius},{lat},{lon});
-  node["medical"](around:{radius},{lat},{lon});
-  node["amenity"="pharmacy"](around:{radius},{lat},{lon});
-  way["amenity"="pharmacy"](around:{radius},{lat},{lon});
-  node["shop"="pharmacy"](around:{radius},{lat},{lon});
-  way["shop"="pharmacy"](around:{radius},{lat},{lon});
-  node["healthcare"="pharmacy"](around:{radius},{lat},{lon});
-  way["healthcare"="pharmacy"](around:{radius},{lat},{lon});
+{body}
 );
 out center tags;
 """
-        try:
-            r = requests.post(self.URL, data={"data": query}, timeout=30)
-            r.raise_for_status()
-            data = r.json()
-        except requests.Timeout:
-            return [], [], "Overpass APIタイムアウト"
-        except Exception as e:
-            return [], [], f"Overpass APIエラー: {e}"
 
-        medical, pharmacies = [], []
-        for elem in data.get("elements", []):
-            tags = elem.get("tags", {})
-            name = tags.get("name", tags.get("name:ja", ""))
-            if not name:
+    def _post_query(self, query: str) -> Tuple[Optional[List[Dict]], bool, str]:
+        data, self.last_status = self.scheduler.run(query)
+        if data is None:
+            return None, False, self.last_status.error
+        # remark 付き応答はサーバー側タイムアウト等で途中打ち切りの可能性があるためキャッシュしない
+        return data.get("elements", []), not data.get("remark"), ""
+
+    def prefetch(self, points: List[Tuple[float, float, int]]) -> int:
+        """
+        v4.5: 複数地点 (lat, lon, radius) の検索結果を OverpassCache に先読みする。
+
+        各地点の取得円（OverpassCache.fetch_circle）の外接矩形を、一辺が
+        OVERPASS_CLUSTER_MAX_SPAN_M 以内になるよう貪欲にまとめ、まとまりごとに
+        bbox クエリを1回だけ発行する。応答は格子バケットで地点ごとの取得円に切り分けて
+        キャッシュに保存するため、以降の search_nearby() は通信せずに済む。
+        ローカルOSMの範囲内・キャッシュ済みの地点は対象外。発行したクエリ数を返す。
+        """
+        if self.cache is None:
+            return 0
+        circles: List[Tuple[float, float, int]] = []
+        for lat, lon, radius in points:
+            if radius > OVERPASS_MAX_CACHED_RADIUS_M:
                 continue
-            if elem["type"] == "node":
-                e_lat, e_lon = elem.get("lat", 0), elem.get("lon", 0)
-            else:
-                c = elem.get("center", {})
-                e_lat, e_lon = c.get("lat", 0), c.get("lon", 0)
-            if not (e_lat and e_lon):
+            if self.local_store is not None and self.local_store.covers(lat, lon, radius):
                 continue
-            dist = self._haversine(lat, lon, e_lat, e_lon)
-            # v3.2: amenity=pharmacy / shop=pharmacy / healthcare=pharmacy 全て薬局として扱う
-            is_pharmacy_tag = (
-                tags.get("amenity") == "pharmacy"
-                or tags.get("shop") == "pharmacy"
-                or tags.get("healthcare") == "pharmacy"
-            )
-            if is_pharmacy_tag:
-                pharmacies.append(NearbyFacility(
-                    name=name, facility_type="pharmacy",
-                    lat=e_lat, lon=e_lon, distance_m=dist, osm_tags=tags,
-                ))
+            if self.cache.find(lat, lon, radius) is not None:
                 continue
-            ftype = "hospital" if (
-                tags.get("amenity") == "hospital" or
-                tags.get("healthcare") == "hospital" or
-                int(tags.get("beds", 0) or 0) >= 20
-            ) else "clinic"
-            sp_raw = tags.get("healthcare:speciality", tags.get("specialty", ""))
-            specialty = OSM_SPECIALTY_MAP.get(sp_raw.lower(), "") if sp_raw else ""
-            # v4.2: OSMタグに speciality がない場合、施設名（日本語）から診療科を推定
-            if not specialty:
-                specialty = detect_specialty_from_name(name)
-            has_inhouse = tags.get("pharmacy", "") in ["yes", "dispensing"]
-            beds = int(tags.get("beds", 0) or 0)
-            # v4.2: 診療科テーブルを使った外来患者数推定（specialty を渡す）
-            daily_op = self._estimate_outpatients(ftype, beds, tags, specialty)
-            medical.append(NearbyFacility(
-                name=name, facility_type=ftype,
-                lat=e_lat, lon=e_lon, distance_m=dist,
-                specialty=specialty, daily_outpatients=daily_op,
-                beds=beds, has_inhouse_pharmacy=has_inhouse, osm_tags=tags,
-            ))
-        medical.sort(key=lambda x: x.distance_m)
-        pharmacies.sort(key=lambda x: x.distance_m)
-        return medical, pharmacies, f"医療機関{len(medical)}件・薬局{len(pharmacies)}件"
+            circle = OverpassCache.fetch_circle(lat, lon, radius)
+            if circle not in circles:
+                circles.append(circle)
+
+        # ── 貪欲クラスタリング（南から順に、矩形が上限を超えない範囲で合併）
+        clusters: List[Tuple[List[float], List[Tuple[float, float, int]]]] = []
+        for circle in sorted(circles):
+            bbox = list(_circle_bbox(*circle))
+            for box, members in clusters:
+                merged = [min(box[0], bbox[0]), min(box[1], bbox[1]),
+                          max(box[2], bbox[2]), max(box[3], bbox[3])]
+                if (haversine_distance(merged[0], merged[1], merged[2], merged[1]) <= OVERPASS_CLUSTER_MAX_SPAN_M
+                        and haversine_distance(merged[0], merged[1], merged[0], merged[3])
+                        <= OVERPASS_CLUSTER_MAX_SPAN_M):
+                    box[:] = merged
+                    members.append(circle)
+                    break
+            else:
+                clusters.append((bbox, [circle]))
+
+        n_queries = 0
+        for box, members in clusters:
+            area = ",".join(f"{v:.6f}" for v in box)
+            elements, complete, _ = self._post_query(self._build_query_for(area))
+            n_queries += 1
+            if elements is None or not complete:
+                continue   # 失敗時は各地点の search_nearby が個別に取得する
+            # 格子バケット（0.01°）で取得円ごとに切り分ける
+            cell = 0.01
+            buckets: Dict[Tuple[int, int], List[Dict]] = {}
+            for elem in elements:
+                e_lat, e_lon = _element_latlon(elem)
+                if e_lat and e_lon:
+                    buckets.setdefault((int(e_lat // cell), int(e_lon // cell)), []).append(elem)
+            for c_lat, c_lon, c_r in members:
+                s, w, n, e = _circle_bbox(c_lat, c_lon, c_r + OVERPASS_WAY_TOLERANCE_M)
+                subset = []
+                for i in range(int(s // cell), int(n // cell) + 1):
+                    for j in range(int(w // cell), int(e // cell) + 1):
+                        for elem in buckets.get((i, j), ()):
+                            e_lat, e_lon = _element_latlon(elem)
+                            tol = OVERPASS_WAY_TOLERANCE_M if elem.get("type") != "node" else 0.0
+                            if haversine_distance(c_lat, c_lon, e_lat, e_lon) <= c_r + tol:
+                                subset.append(elem)
+                self.cache.put(c_lat, c_lon, c_r, subset)
+        return n_queries
+
+    def search_many(
+        self, points: List[Tuple[float, float, int]],
+    ) -> List[Tuple[List[NearbyFacility], List[NearbyFacility], str]]:
+        """v4.5: 複数地点の search_nearby()（prefetch() でまとめて取得してから切り分け）"""
+        self.prefetch(points)
+        return [self.search_nearby(lat, lon, radius) for lat, lon, radius in points]
+
+    def _parse_elements(
+        self, elements: List[Dict], lat: float, lon: float, radius: int,
+    ) -> Tuple[List[NearbyFacility], List[NearbyFacility]]:
+        """raw elements を (医療機関, 薬局) に分類し、中心から radius 以内に絞って距離順に返す"""
+        return FacilityTable.from_elements(elements, lat, lon, radius).to_facilities()
 
     @staticmethod
     def _haversine(lat1, lon1, lat2, lon2) -> float:
@@ -1155,30 +3709,306 @@ out center tags;
 # 4. 厚生労働省スクレイパー
 # ---------------------------------------------------------------------------
 
-class MHLWScraper:
-    DOMAIN = "https://www.iryou.teikyouseido.mhlw.go.jp"
-    BASE   = DOMAIN + "/znk-web"
+# v4.5: 検索結果一覧の1ページ件数 / 2ページ目以降の同時取得数（発行レートは RATE_LIMITS["mhlw"]）
+MHLW_PAGE_SIZE: int = 20
+MHLW_PAGE_WORKERS: int = 3
+
+# v4.5: MHLW セッションプール
+MHLW_SESSION_POOL_SIZE: int = 4              # 待機させておく初期化済みセッション数
+MHLW_SESSION_IDLE_TTL_S: float = 20 * 60     # 最終通信からこれ以上経ったセッションは初期化し直す
+MHLW_SESSION_CONNECTIONS: int = 4            # セッションごとの keep-alive 接続数
+
+
+def _mhlw_session_expired(r: requests.Response) -> bool:
+    """セッション切れの応答か（認可エラー・初期画面へのリダイレクト・タイムアウト画面）"""
+    if r.status_code in (401, 403, 440):
+        return True
+    if getattr(r, "history", None) and "/S2300/initialize" in getattr(r, "url", ""):
+        return True
+    if r.status_code == 200 and "セッション" in r.text:
+        head = r.text[:4000]
+        return "セッション" in head and ("タイムアウト" in head or "有効期限" in head)
+    return False
+
+
+class MHLWSession:
+    """v4.5: 初期化（S2300/initialize）済みかどうかを持つ requests.Session（MHLWSessionPool の要素）"""
+
+    USER_AGENT = (
+        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
+        "AppleWebKit/537.36 Chrome/121.0.0.0 Safari/537.36"
+    )
 
     def __init__(self):
-        self.session = requests.Session()
-        self.session.headers.update({
-            "User-Agent": (
-                "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
-                "AppleWebKit/537.36 Chrome/121.0.0.0 Safari/537.36"
-            ),
+        self.http = requests.Session()
+        self.http.headers.update({
+            "User-Agent": self.USER_AGENT,
             "Accept-Language": "ja-JP,ja;q=0.9",
         })
-        self._initialized = False
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=MHLW_SESSION_CONNECTIONS,
+        )
+        self.http.mount("https://", adapter)
+        self.initialized_at = 0.0
+        self.last_used = 0.0
+        self.generation = 0     # 初期化のたびに増える（並列スレッドの重複した再初期化を防ぐ）
 
-    def initialize_session(self) -> bool:
+    @property
+    def valid(self) -> bool:
+        return self.initialized_at > 0 and time.time() - self.last_used < MHLW_SESSION_IDLE_TTL_S
+
+    def touch(self) -> None:
+        self.last_used = time.time()
+
+    def mark_initialized(self) -> None:
+        self.initialized_at = self.last_used = time.time()
+        self.generation += 1
+
+    def expire(self) -> None:
+        """Cookie を捨てて未初期化に戻す（接続は keep-alive のまま再利用）"""
+        self.http.cookies.clear()
+        self.initialized_at = 0.0
+
+    def dump(self) -> Dict:
+        cookies = [
+            {"name": c.name, "value": c.value, "domain": c.domain, "path": c.path,
+             "expires": c.expires, "secure": c.secure}
+            for c in self.http.cookies if not c.is_expired()
+        ]
+        return {"initialized_at": self.initialized_at, "last_used": self.last_used, "cookies": cookies}
+
+    @classmethod
+    def restore(cls, state: Dict) -> "MHLWSession":
+        sess = cls()
+        for c in state.get("cookies", []):
+            sess.http.cookies.set(c["name"], c["value"], domain=c["domain"], path=c["path"],
+                                  expires=c["expires"], secure=c["secure"])
+        sess.initialized_at = float(state.get("initialized_at", 0.0))
+        sess.last_used = float(state.get("last_used", 0.0))
+        sess.generation = 1 if sess.initialized_at else 0
+        return sess
+
+
+class MHLWSessionPool:
+    """
+    v4.5: 初期化済み MHLW セッションのプロセス共通プール
+
+    MHLWScraper は最初の通信時にセッションを1つ借り、close()（または破棄時）に返す。
+    借りている間はそのスクレイパー専用（検索キーワードの登録状態がセッションに紐づくため）。
+    返却されたセッションは Cookie・keep-alive 接続ごと次の借り手が再利用し、
+    初期化（S2300/initialize）は MHLW_SESSION_IDLE_TTL_S を過ぎたものだけやり直す。
+    待機セッションが無ければ新規に作る（借り手を待たせない）。最大 max_idle 個まで待機させる。
+    Cookie は返却・初期化のたびに JSON へ保存し、再起動後も有効期間内なら初期化せずに使う。
+    """
+
+    def __init__(self, path: Optional[str] = None, max_idle: int = MHLW_SESSION_POOL_SIZE):
+        self.path = path or os.path.join(CACHE_DIR, "mhlw_sessions.json")
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle: List[MHLWSession] = []
+        self._leased: "weakref.WeakSet[MHLWSession]" = weakref.WeakSet()
+        self.stats = {"created": 0, "reused": 0, "restored": 0}
         try:
-            r = self.session.get(
-                f"{self.BASE}/juminkanja/S2300/initialize", timeout=15,
-            )
-            self._initialized = r.status_code == 200
-            return self._initialized
-        except Exception:
-            return False
+            with open(self.path, encoding="utf-8") as f:
+                saved = json.load(f).get("sessions", [])
+        except (OSError, ValueError):
+            saved = []
+        for state in saved[:max_idle]:
+            try:
+                sess = MHLWSession.restore(state)
+            except (KeyError, TypeError, ValueError):
+                continue
+            if sess.valid:
+                self._idle.append(sess)
+                self.stats["restored"] += 1
+
+    def acquire(self) -> MHLWSession:
+        """最後に使われたセッションから貸し出す（期限切れなら未初期化に戻して渡す）"""
+        with self._lock:
+            if self._idle:
+                sess = self._idle.pop()
+                self.stats["reused"] += 1
+            else:
+                sess = MHLWSession()
+                self.stats["created"] += 1
+            self._leased.add(sess)
+        if sess.initialized_at and not sess.valid:
+            sess.expire()
+        return sess
+
+    def release(self, sess: MHLWSession) -> None:
+        with self._lock:
+            self._leased.discard(sess)
+            if len(self._idle) < self.max_idle:
+                self._idle.append(sess)
+                sess = None
+        if sess is not None:
+            sess.http.close()
+        self.save()
+
+    def save(self) -> None:
+        """有効なセッションの Cookie を保存（一時ファイルに書いてから置き換え）"""
+        with self._lock:
+            sessions = [s for s in itertools.chain(self._idle, list(self._leased)) if s.valid]
+            states = [s.dump() for s in sorted(sessions, key=lambda s: -s.last_used)[:self.max_idle]]
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            try:
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump({"saved_at": time.time(), "sessions": states}, f)
+                os.replace(tmp, self.path)
+            except OSError:
+                pass
+
+    def summary(self) -> str:
+        with self._lock:
+            n_idle, n_leased = len(self._idle), len(self._leased)
+        return (f"MHLWセッション: 待機 {n_idle} / 使用中 {n_leased}（新規 {self.stats['created']}"
+                f"・再利用 {self.stats['reused']}・前回起動から復元 {self.stats['restored']}）")
+
+
+@st.cache_resource
+def get_mhlw_session_pool() -> MHLWSessionPool:
+    """プロセス共通の MHLWSessionPool（Streamlit セッション間でも共有）"""
+    return MHLWSessionPool()
+
+
+class MHLWScraper:
+    """
+    v4.5 変更:
+      候補一覧・詳細ページは MHLWSnapshotStore に保存し、snapshot_max_age_s 以内に取得済みの
+      ページは通信せずに再利用する（use_snapshots=False で常に取得・保存もしない）。
+      検索の事前リクエスト（キーワード登録）は一覧ページを実際に取得する場合だけ行う。
+      通信には MHLWSessionPool から借りた初期化済みセッションを使い、close() で返す
+      （with 文でも可。閉じ忘れても破棄時に返却される）。セッション切れの応答を受けたら
+      自動で初期化し直して1回だけ再送する。
+      通信の失敗は呼び出しごとの CallStatus で返す（fetch_pharmacy_detail / fetch_clinic_detail）。
+      捕捉するのは ExternalCallError（応答なし）と応答の解析失敗だけ。
+    """
+
+    DOMAIN = "https://www.iryou.teikyouseido.mhlw.go.jp"
+    BASE   = DOMAIN + "/znk-web"
+
+    def __init__(
+        self,
+        snapshots: Optional[MHLWSnapshotStore] = None,
+        use_snapshots: bool = True,
+        snapshot_max_age_s: float = MHLW_SNAPSHOT_MAX_AGE_S,
+        pool: Optional[MHLWSessionPool] = None,
+    ):
+        self.pool = pool or get_mhlw_session_pool()
+        self._pooled: Optional[MHLWSession] = None
+        self._release: Optional[weakref.finalize] = None
+        self._session_lock = threading.RLock()
+        self._limiter = get_rate_limiter()
+        self._breaker = get_circuit_breaker(_host_of(self.DOMAIN))
+        self.parser = get_mhlw_page_parser()   # v4.5: lxml 高速パス（未導入なら BeautifulSoup）
+        if snapshots is None and use_snapshots:
+            snapshots = get_mhlw_snapshot_store()
+        self.snapshots = snapshots
+        self.snapshot_max_age_s = snapshot_max_age_s
+        self._keyword_lock = threading.RLock()
+        self._keyword_errors: Dict[str, str] = {}   # 登録済みキーワード → 失敗理由（"" = 成功）
+
+    # ── v4.5: プールのセッション ───────────────────────────────────────────
+
+    def _lease(self) -> MHLWSession:
+        """プールからセッションを借りる（借りるのは最初の1回だけ）"""
+        with self._session_lock:
+            if self._pooled is None:
+                self._pooled = self.pool.acquire()
+                self._release = weakref.finalize(self, self.pool.release, self._pooled)
+                with self._keyword_lock:
+                    self._keyword_errors.clear()   # 前の借り手の登録状態は引き継がない
+            return self._pooled
+
+    @property
+    def session(self) -> requests.Session:
+        return self._lease().http
+
+    @property
+    def _initialized(self) -> bool:
+        return self._pooled is not None and self._pooled.valid
+
+    def close(self) -> None:
+        """借りているセッションをプールに返す（以降の通信では新たに借りる）"""
+        with self._session_lock:
+            if self._release is not None:
+                self._release()
+            self._pooled = self._release = None
+
+    def __enter__(self) -> "MHLWScraper":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _get(self, url: str, timeout: Optional[float] = None, **kwargs) -> Tuple[requests.Response, CallStatus]:
+        """
+        v4.5: CALL_POLICIES["mhlw"]（レート制限・期限・再試行・遮断）に従う session.get。
+        timeout は読み取りタイムアウトの上書き。応答が得られなければ ExternalCallError。
+        Returns: (応答, この呼び出しの CallStatus)
+        """
+        sess = self._lease()
+        policy = CALL_POLICIES["mhlw"]
+        if timeout is not None:
+            policy = dataclasses.replace(policy, read_timeout_s=timeout)
+        r, status = call_with_policy(
+            policy, url, send=lambda t: sess.http.get(url, timeout=t, **kwargs),
+            breaker=self._breaker, limiter=self._limiter,
+        )
+        if r is None:
+            raise ExternalCallError(status)
+        sess.touch()
+        return r, status
+
+    def _fetch_page(
+        self, url: str, params: Optional[Dict] = None, timeout: float = 15,
+        before_fetch: Optional[Callable[[], bool]] = None,
+    ) -> Tuple[int, str, CallStatus]:
+        """
+        v4.5: HTML ページを (HTTPステータス, 本文, この呼び出しの CallStatus) で返す（応答なしは 0, ""）。
+        新しいスナップショットがあれば通信しない。取得した 200 応答はスナップショットに保存する。
+        before_fetch: 通信が必要な場合だけ先に呼ぶ事前処理（False を返したら取得を中止）。
+        """
+        key = MHLWSnapshotStore.page_url(url, params)
+        if self.snapshots is not None:
+            cached = self.snapshots.latest(key, self.snapshot_max_age_s)
+            if cached is not None:
+                return 200, cached[0], CallStatus("mhlw")
+        if not self._initialized:
+            self.initialize_session()
+        if before_fetch is not None and not before_fetch():
+            return 0, "", CallStatus("mhlw").fail("http", "検索の事前リクエストに失敗")
+        try:
+            generation = self._lease().generation
+            r, status = self._get(url, params=params, timeout=timeout)
+            if _mhlw_session_expired(r):
+                if not self.reset_session(generation) or (before_fetch is not None and not before_fetch()):
+                    return 0, "", status.fail("http", "セッションの再初期化に失敗")
+                r, status = self._get(url, params=params, timeout=timeout)
+        except ExternalCallError as e:
+            return 0, "", e.status
+        if r.status_code == 200 and self.snapshots is not None:
+            self.snapshots.put(key, r.text)
+        return r.status_code, r.text, status
+
+    def initialize_session(self) -> bool:
+        """v4.5: 借りたセッションが有効ならそのまま使う（初期化の通信は期限切れ・新規のときだけ）"""
+        with self._session_lock:
+            sess = self._lease()
+            if sess.valid:
+                return True
+            try:
+                r, _ = self._get(
+                    f"{self.BASE}/juminkanja/S2300/initialize", timeout=15,
+                )
+            except ExternalCallError:
+                return False
+            if r.status_code != 200:
+                return False
+            sess.mark_initialized()
+        self.pool.save()
+        return True
 
     def search_pharmacy_candidates(
         self, keyword: str, pref_code: str = "", max_pages: int = 3
@@ -1188,82 +4018,106 @@ class MHLWScraper:
     def search_medical_candidates(self, keyword: str, pref_code: str = ""):
         return self._search_candidates(keyword, pref_code, max_pages=1, sjk="1")
 
-    def _search_candidates(self, keyword, pref_code, max_pages, sjk):
-        if not self._initialized:
-            self.initialize_session()
-        try:
-            r = self.session.get(
-                f"{self.BASE}/juminkanja/S2300/yakkyokuSearch",
-                params={"yakkyokuKeyword": keyword, "yakkyokuKeyword2": "", "searchJudgeKbn": "2"},
-                headers={"ajaxFlag": "true"}, timeout=12,
-            )
-            if r.status_code != 200 or r.json().get("code") != "0":
-                return [], 0, "検索失敗"
-        except Exception as e:
-            return [], 0, f"エラー: {e}"
-
-        all_cands, total = [], 0
-        encoded = urllib.parse.quote(keyword)
-        for page in range(max_pages):
-            params = {"sjk": sjk, "page": str(page), "size": "20", "sortNo": "1"}
-            if pref_code:
-                params["prefCd"] = pref_code
-            try:
-                r2 = self.session.get(
-                    f"{self.BASE}/juminkanja/S2400/initialize/{encoded}/",
-                    params=params, timeout=15,
-                )
-                if r2.status_code != 200:
-                    break
-                cands, t = self._parse_candidate_list(r2.text)
-                if page == 0:
-                    total = t
-                all_cands.extend(cands)
-                if not cands or len(all_cands) >= total:
+    def _register_keyword(self, keyword: str) -> bool:
+        """
+        v4.5: 検索キーワードをセッションに登録する（一覧ページ取得の前提となる事前検索）。
+        同じキーワードは1回だけ送り、結果（失敗理由）を _keyword_errors に残す。
+        """
+        with self._session_lock, self._keyword_lock:   # ロック順は常に session → keyword
+            if keyword not in self._keyword_errors:
+                for retry in (False, True):
+                    try:
+                        generation = self._lease().generation
+                        r, _ = self._get(
+                            f"{self.BASE}/juminkanja/S2300/yakkyokuSearch",
+                            params={"yakkyokuKeyword": keyword, "yakkyokuKeyword2": "", "searchJudgeKbn": "2"},
+                            headers={"ajaxFlag": "true"}, timeout=12,
+                        )
+                        if not retry and _mhlw_session_expired(r) and self.reset_session(generation):
+                            continue
+                        ok = r.status_code == 200 and r.json().get("code") == "0"
+                        self._keyword_errors[keyword] = "" if ok else "検索失敗"
+                    except ExternalCallError as e:
+                        self._keyword_errors[keyword] = f"エラー: {e.status.error}"
+                    except (ValueError, AttributeError):   # JSON 以外・想定外の形式の応答
+                        self._keyword_errors[keyword] = "検索失敗（不正な応答）"
                     break
-                time.sleep(0.3)
-            except Exception:
-                break
+            return not self._keyword_errors[keyword]
+
+    def reset_session(self, stale_generation: Optional[int] = None) -> bool:
+        """
+        v4.5: セッションを初期化し直す（セッション切れ・長時間のクロールなど）。
+        stale_generation: 切れていたセッションの世代。別スレッドが既に初期化し直していれば何もしない
+        """
+        with self._session_lock:
+            sess = self._lease()
+            if stale_generation is not None and sess.generation != stale_generation:
+                return sess.valid
+            with self._keyword_lock:
+                self._keyword_errors.clear()
+            sess.expire()
+            return self.initialize_session()
+
+    def fetch_candidate_page(
+        self, keyword: str, pref_code: str, page: int, sjk: str = "2",
+    ) -> Optional[Tuple[List[PharmacyCandidate], int]]:
+        """v4.5: 検索結果一覧の1ページ → (候補, 総件数)。取得失敗は None"""
+        params = {"sjk": sjk, "page": str(page), "size": str(MHLW_PAGE_SIZE), "sortNo": "1"}
+        if pref_code:
+            params["prefCd"] = pref_code
+        status, html, _ = self._fetch_page(
+            f"{self.BASE}/juminkanja/S2400/initialize/{urllib.parse.quote(keyword)}/",
+            params=params, timeout=15, before_fetch=lambda: self._register_keyword(keyword),
+        )
+        return self._parse_candidate_list(html) if status == 200 else None
+
+    def _search_candidates(self, keyword, pref_code, max_pages, sjk):
+        """
+        v4.5: 1ページ目で総件数が分かった後、残りのページ（最大 max_pages まで）を
+        MHLW_PAGE_WORKERS 並列で取得し（発行レートは RATE_LIMITS["mhlw"]）、ページ順に連結する。
+        取得に失敗した・空だったページ以降は従来どおり打ち切り、kikan_cd で重複を除く。
+        """
+        # 検索ごとにキーワードを登録し直す（実際に一覧ページを取得する場合のみ送信）
+        with self._keyword_lock:
+            self._keyword_errors.pop(keyword, None)
+
+        def fetch(page: int) -> Optional[Tuple[List[PharmacyCandidate], int]]:
+            return self.fetch_candidate_page(keyword, pref_code, page, sjk)
+
+        first = fetch(0)
+        if first is None:
+            if self._keyword_errors.get(keyword):
+                return [], 0, self._keyword_errors[keyword]
+            return [], 0, "0件取得（全0件）"
+        pages = [first[0]]
+        total = first[1]
+        n_pages = min(max_pages, -(-total // MHLW_PAGE_SIZE))
+        if first[0] and n_pages > 1:
+            with ThreadPoolExecutor(max_workers=min(MHLW_PAGE_WORKERS, n_pages - 1)) as executor:
+                for result in executor.map(fetch, range(1, n_pages)):
+                    if result is None or not result[0]:
+                        break
+                    pages.append(result[0])
+
+        all_cands: List[PharmacyCandidate] = []
+        seen = set()
+        for cands in pages:
+            for c in cands:
+                key = c.kikan_cd or c.href
+                if key not in seen:
+                    seen.add(key)
+                    all_cands.append(c)
         return all_cands, total, f"{len(all_cands)}件取得（全{total}件）"
 
     def _parse_candidate_list(self, html: str) -> Tuple[List[PharmacyCandidate], int]:
-        soup = BeautifulSoup(html, "html.parser")
-        cands, total = [], 0
-        m = re.search(r"(\d{1,6})\s*件", soup.get_text())
-        if m:
-            total = int(m.group(1))
-        for item in soup.find_all("div", class_="item"):
-            h3 = item.find("h3", class_="name")
-            if not h3:
-                continue
-            link = h3.find("a", href=True)
-            if not link:
-                continue
-            name = link.get_text(strip=True)
-            href = link.get("href", "")
-            if not href:
-                continue
+        cands = []
+        total, items = self.parser.candidate_list(html)
+        for name, href, raw in items:
             if href.startswith("/"):
                 href = self.DOMAIN + href
             qp = dict(urllib.parse.parse_qsl(urllib.parse.urlparse(href).query))
-            address = ""
-            for dl in item.find_all("dl"):
-                dt = dl.find("dt")
-                if not dt:
-                    continue
-                img = dt.find("img")
-                dt_text = dt.get_text(strip=True)
-                if (img and "住所" in img.get("alt", "")) or any(
-                    kw in dt_text for kw in ["住所", "所在地"]
-                ):
-                    dd = dl.find("dd")
-                    if dd:
-                        for a in dd.find_all("a"):
-                            a.decompose()
-                        raw = dd.get_text(strip=True)
-                        cleaned = re.sub(r"〒\s*\d{3}[-－]\d{4}\s*", "", raw)
-                        address = re.sub(r"\s+", " ", cleaned).strip()[:100]
-                    break
+            cleaned = re.sub(r"〒\s*\d{3}[-－]\d{4}\s*", "", raw)
+            address = re.sub(r"\s+", " ", cleaned).strip()[:100]
             if name:
                 cands.append(PharmacyCandidate(
                     name=name, address=address, href=href,
@@ -1272,37 +4126,31 @@ class MHLWScraper:
         return cands, max(total, len(cands))
 
     def get_pharmacy_detail(self, candidate: PharmacyCandidate) -> Tuple[Optional[Dict], str]:
-        if not self._initialized:
-            self.initialize_session()
+        detail, status = self.fetch_pharmacy_detail(candidate)
+        return detail, "OK" if detail is not None else status.error
+
+    def fetch_pharmacy_detail(self, candidate: PharmacyCandidate) -> Tuple[Optional[Dict], CallStatus]:
+        """v4.5: 薬局詳細ページ → (解析結果 or None, この呼び出しの CallStatus)"""
         if candidate.pref_cd and candidate.kikan_cd:
             url = (f"{self.BASE}/juminkanja/S2430/initialize"
                    f"?prefCd={candidate.pref_cd}&kikanCd={candidate.kikan_cd}&kikanKbn=5")
         else:
             url = candidate.href
-        try:
-            r = self.session.get(url, timeout=15)
-            if r.status_code != 200:
-                return None, f"HTTP {r.status_code}"
-            data = self._parse_detail(r.text)
-            data["source_url"] = url
-            return data, "OK"
-        except Exception as e:
-            return None, str(e)
+        http_status, html, status = self._fetch_page(url, timeout=15)
+        if http_status != 200:
+            if status.ok:
+                status.fail("http", f"HTTP {http_status}")
+            return None, status
+        data = self._parse_detail(html)
+        data["source_url"] = url
+        return data, status
 
     def _parse_detail(self, html: str) -> Dict:
-        soup = BeautifulSoup(html, "html.parser")
+        rows, pairs, page_text = self.parser.detail(html)
         fields: Dict[str, str] = {}
-        for row in soup.find_all("tr"):
-            cells = row.find_all(["th", "td"])
-            if len(cells) >= 2:
-                k = cells[0].get_text(strip=True)
-                if k:
-                    fields[k] = cells[1].get_text(strip=True)
-        for dl in soup.find_all("dl"):
-            for dt, dd in zip(dl.find_all("dt"), dl.find_all("dd")):
-                k = dt.get_text(strip=True)
-                if k:
-                    fields[k] = dd.get_text(strip=True)
+        for k, v in itertools.chain(rows, pairs):
+            if k:
+                fields[k] = v
         data: Dict = {"all_fields": fields}
         for k, v in fields.items():
             if "所在地" in k and "フリガナ" not in k and "英語" not in k:
@@ -1321,7 +4169,7 @@ class MHLWScraper:
                     except (ValueError, OverflowError):
                         pass
         if rx_annual is None:
-            full_text = soup.get_text(separator=" ")
+            full_text = page_text()
             for pat, mult in [
                 (r"総取扱処方箋数[^\d]*(\d{1,3}(?:,\d{3})*|\d{4,})\s*件", 1.0),
                 (r"週\s*平均[^\d]{0,15}(\d{1,4})\s*(?:回|枚)", 52.14),
@@ -1339,158 +4187,449 @@ class MHLWScraper:
         data["prescriptions_annual"] = rx_annual
         return data
 
-    def get_medical_outpatient_data(self, facility_name: str) -> Optional[int]:
-        if not self._initialized:
-            self.initialize_session()
-        cands, _, _ = self.search_medical_candidates(facility_name)
-        if not cands:
-            return None
-        best = cands[0]
-        for c in cands[:3]:
-            if facility_name[:4] in c.name:
-                best = c
-                break
+    def get_medical_outpatient_data(self, facility_name: str) -> Optional[int]:
+        cands, _, _ = self.search_medical_candidates(facility_name)
+        if not cands:
+            return None
+        best = cands[0]
+        for c in cands[:3]:
+            if facility_name[:4] in c.name:
+                best = c
+                break
+        status, html, _ = self._fetch_page(best.href, timeout=12)
+        if status != 200:
+            return None
+        for k, v in self.parser.table_rows(html):
+            if "外来" in k and ("患者" in k or "数" in k):
+                nums = [n for n in re.findall(r"[\d,]+", v) if n.strip(",")]
+                if nums:
+                    return int(nums[0].replace(",", ""))
+        return None
+
+    def get_rx_for_nearby_pharmacies(
+        self,
+        pharmacy_names: List[str],
+        limit: int = 5,
+    ) -> Dict[str, Optional[int]]:
+        """近隣薬局の処方箋枚数をMHLWから一括取得（新規開局モード用）"""
+        results: Dict[str, Optional[int]] = {}
+        for name in pharmacy_names[:limit]:
+            cands, _, _ = self.search_pharmacy_candidates(name, max_pages=1)
+            if cands:
+                best = cands[0]
+                for c in cands[:3]:
+                    if name[:4] in c.name or c.name[:4] in name:
+                        best = c
+                        break
+                detail, _ = self.fetch_pharmacy_detail(best)
+                results[name] = detail.get("prescriptions_annual") if detail else None
+            else:
+                results[name] = None
+        return results
+
+    # ── v2.4 新規: MHLW医療機関検索 ────────────────────────────────────────
+
+    def search_clinic_by_keyword(
+        self, keyword: str, pref_code: str = ""
+    ) -> List[PharmacyCandidate]:
+        """
+        MHLW医療機関データベースでクリニック名・住所キーワードを検索 (sjk=1: 医療機関)
+
+        OSMで検出されなかったクリニックを名称等で検索するための補助機能。
+        """
+        cands, _, _ = self._search_candidates(keyword, pref_code, max_pages=2, sjk="1")
+        return cands
+
+    def search_medical_by_area(
+        self, address: str, pref_code: str = "", max_pages: int = 5
+    ) -> Tuple[List[PharmacyCandidate], str]:
+        """
+        住所からエリアキーワードを自動抽出してMHLW医療機関を一括検索 (v2.6新機能)
+
+        OSMで未収録の医療機関を自動補填するためのエリアベース検索。
+        - 市区町村名をキーワードとして全施設を検索（sjk=1: 医療機関）
+        - 住所にキーワードが含まれる候補のみを返す（名称一致の誤ヒットを排除）
+        - 最大 max_pages × 20 件を取得（デフォルト: 100件）
+
+        Returns:
+            (candidates, log_message)
+        """
+        keyword = extract_area_keyword(address)
+        cands, total, msg = self._search_candidates(keyword, pref_code, max_pages, sjk="1")
+        # 住所にキーワードを含む候補のみに絞り込む（名前一致の誤ヒットを排除）
+        filtered = [c for c in cands if c.address and keyword in c.address]
+        return filtered, (
+            f"MHLWエリア検索: キーワード='{keyword}' → "
+            f"全{total}件中 住所一致{len(filtered)}件取得"
+        )
+
+    def get_clinic_daily_outpatients(
+        self, candidate: PharmacyCandidate
+    ) -> Tuple[Optional[int], str]:
+        """
+        MHLW医療機関詳細ページから外来患者数（1日平均）を取得する。
+
+        MHLW の報告形式は施設によって異なるため、複数のパターンを試みる。
+        - 「外来患者数」「1日平均外来」などのフィールドを探索
+        - 年間値が得られた場合は稼働日数(305)で割って日次換算
+        """
+        detail, msg = self.get_clinic_detail(candidate)
+        if detail is None:
+            return None, msg
+        return detail["daily_outpatients"], detail["outpatient_note"]
+
+    def get_clinic_detail(self, candidate: PharmacyCandidate) -> Tuple[Optional[Dict], str]:
+        """
+        v4.5: 医療機関詳細ページ → {daily_outpatients, outpatient_note, departments, is_hospital}。
+        departments: 診療科目欄の文字列 / is_hospital: 種別欄が「病院」か（欄が無ければ None）。
+        取得失敗は (None, 理由)。
+        """
+        detail, status = self.fetch_clinic_detail(candidate)
+        return detail, "OK" if detail is not None else f"取得エラー: {status.error}"
+
+    def fetch_clinic_detail(self, candidate: PharmacyCandidate) -> Tuple[Optional[Dict], CallStatus]:
+        """v4.5: get_clinic_detail の本体 → (解析結果 or None, この呼び出しの CallStatus)"""
+        if candidate.pref_cd and candidate.kikan_cd:
+            url = (f"{self.BASE}/juminkanja/S2430/initialize"
+                   f"?prefCd={candidate.pref_cd}&kikanCd={candidate.kikan_cd}&kikanKbn=1")
+        else:
+            url = candidate.href
+        http_status, html, status = self._fetch_page(url, timeout=12)
+        if http_status != 200:
+            if status.ok:
+                status.fail("http", f"HTTP {http_status}")
+            return None, status
+        rows, pairs, _ = self.parser.detail(html)
+        fields: Dict[str, str] = {}
+        for k, v in itertools.chain(pairs, rows):   # 表（tr）の項目を優先（従来は表のみ参照）
+            if k:
+                fields[k] = v
+        daily, note = self._parse_clinic_outpatients(fields)
+        departments = next((v for k, v in fields.items() if "診療科目" in k or k == "診療科"), "")
+        kind = next((v for k, v in fields.items() if "種別" in k or "種類" in k), None)
+        return {
+            "daily_outpatients": daily,
+            "outpatient_note": note,
+            "departments": departments[:300],
+            "is_hospital": ("病院" in kind) if kind is not None else None,
+        }, status
+
+    @staticmethod
+    def _parse_clinic_outpatients(fields: Dict[str, str]) -> Tuple[Optional[int], str]:
+        """詳細ページの項目 → (1日平均外来患者数 or None, 取得根拠)"""
+        # 1日平均外来患者数（直接記載）
+        for k, v in fields.items():
+            if ("1日平均" in k or "一日平均" in k) and "外来" in k:
+                nums = re.findall(r"[\d,]+", v)
+                if nums:
+                    try:
+                        n = int(nums[0].replace(",", ""))
+                        if 1 <= n <= 3000:
+                            return n, f"MHLW取得: {k}"
+                    except (ValueError, OverflowError):
+                        pass
+        # 年間外来患者数（305日で割って日次換算）
+        for k, v in fields.items():
+            if "外来" in k and ("患者" in k or "数" in k) and "年間" in k:
+                nums = re.findall(r"[\d,]+", v)
+                if nums:
+                    try:
+                        n = int(nums[0].replace(",", ""))
+                        if n > 300:
+                            daily = int(n / NATIONAL_STATS["working_days"])
+                            return daily, f"MHLW年間値から換算({n:,}→{daily}/日)"
+                    except (ValueError, OverflowError):
+                        pass
+        return None, "外来患者数の記載なし"
+
+
+# ---------------------------------------------------------------------------
+# 4-a. v4.5: MHLW ページ解析（lxml / XPath 高速パス）
+# ---------------------------------------------------------------------------
+# MHLWScraper が必要とするのは「候補一覧の div.item」「詳細ページの tr / dl」だけなので、
+# ページ全体の BeautifulSoup ツリーを作らず、lxml で解析して XPath で必要な節点だけを取り出す。
+# 文字列の取り出し方（get_text(strip=True) 相当・script/style/コメントを除く）は従来と同じ。
+
+CandidateItem = Tuple[str, str, str]   # (名称, href, 住所欄の生テキスト)
+DetailParts = Tuple[List[Tuple[str, str]], List[Tuple[str, str]], Callable[[], str]]
+
+
+class Bs4PageParser:
+    """従来の BeautifulSoup(html.parser) による解析（lxml 未導入時の既定・ベンチマークの基準）"""
+
+    name = "bs4"
+
+    def candidate_list(self, html: str) -> Tuple[int, List[CandidateItem]]:
+        """検索結果一覧 → (「N件」の N, 候補リスト)"""
+        soup = BeautifulSoup(html, "html.parser")
+        total = 0
+        m = re.search(r"(\d{1,6})\s*件", soup.get_text())
+        if m:
+            total = int(m.group(1))
+        items: List[CandidateItem] = []
+        for item in soup.find_all("div", class_="item"):
+            h3 = item.find("h3", class_="name")
+            if not h3:
+                continue
+            link = h3.find("a", href=True)
+            if not link:
+                continue
+            href = link.get("href", "")
+            if not href:
+                continue
+            address = ""
+            for dl in item.find_all("dl"):
+                dt = dl.find("dt")
+                if not dt:
+                    continue
+                img = dt.find("img")
+                dt_text = dt.get_text(strip=True)
+                if (img and "住所" in img.get("alt", "")) or any(
+                    kw in dt_text for kw in ["住所", "所在地"]
+                ):
+                    dd = dl.find("dd")
+                    if dd:
+                        for a in dd.find_all("a"):
+                            a.decompose()
+                        address = dd.get_text(strip=True)
+                    break
+            items.append((link.get_text(strip=True), href, address))
+        return total, items
+
+    def table_rows(self, html: str) -> List[Tuple[str, str]]:
+        """全 tr の (1列目, 2列目)（2列未満の行は除く）"""
+        return self._rows(BeautifulSoup(html, "html.parser"))
+
+    def detail(self, html: str) -> DetailParts:
+        """詳細ページ → (tr の行, dl の dt/dd 組, ページ全文を返す関数)"""
+        soup = BeautifulSoup(html, "html.parser")
+        pairs = [
+            (dt.get_text(strip=True), dd.get_text(strip=True))
+            for dl in soup.find_all("dl")
+            for dt, dd in zip(dl.find_all("dt"), dl.find_all("dd"))
+        ]
+        return self._rows(soup), pairs, lambda: soup.get_text(separator=" ")
+
+    @staticmethod
+    def _rows(soup) -> List[Tuple[str, str]]:
+        rows = []
+        for row in soup.find_all("tr"):
+            cells = row.find_all(["th", "td"])
+            if len(cells) >= 2:
+                rows.append((cells[0].get_text(strip=True), cells[1].get_text(strip=True)))
+        return rows
+
+
+def _class_xpath(tag: str, cls: str) -> str:
+    """class 属性にトークン cls を含む tag（BeautifulSoup の class_= と同じ判定）"""
+    return f"{tag}[contains(concat(' ', normalize-space(@class), ' '), ' {cls} ')]"
+
+
+class LxmlPageParser:
+    """v4.5: lxml + XPath による解析。解析できないページ（空・XML宣言付き等）は Bs4PageParser へ"""
+
+    name = "lxml"
+
+    def __init__(self):
+        X = lxml_etree.XPath
+        self._texts = X(".//text()[not(ancestor::script) and not(ancestor::style)]")
+        self._texts_outside_a = X(
+            ".//text()[not(ancestor::script) and not(ancestor::style) and count(ancestor::a) = $n]"
+        )
+        self._n_a = X("count(ancestor::a)")
+        self._items = X("//" + _class_xpath("div", "item"))
+        self._h3 = X(".//" + _class_xpath("h3", "name"))
+        self._link = X(".//a[@href]")
+        self._dl = X(".//dl")
+        self._dt = X(".//dt")
+        self._dd = X(".//dd")
+        self._img = X(".//img")
+        self._tr = X("//tr")
+        self._cells = X(".//th | .//td")
+        self._fallback = Bs4PageParser()
+
+    @staticmethod
+    def _doc(html: str):
         try:
-            r = self.session.get(best.href, timeout=12)
-            if r.status_code != 200:
-                return None
-            soup = BeautifulSoup(r.text, "html.parser")
-            for row in soup.find_all("tr"):
-                cells = row.find_all(["th", "td"])
-                if len(cells) >= 2:
-                    k = cells[0].get_text(strip=True)
-                    v = cells[1].get_text(strip=True)
-                    if "外来" in k and ("患者" in k or "数" in k):
-                        nums = re.findall(r"[\d,]+", v)
-                        if nums:
-                            return int(nums[0].replace(",", ""))
-        except Exception:
-            pass
-        return None
-
-    def get_rx_for_nearby_pharmacies(
-        self,
-        pharmacy_names: List[str],
-        limit: int = 5,
-    ) -> Dict[str, Optional[int]]:
-        """近隣薬局の処方箋枚数をMHLWから一括取得（新規開局モード用）"""
-        results: Dict[str, Optional[int]] = {}
-        for name in pharmacy_names[:limit]:
+            return lxml_html.document_fromstring(html)
+        except ValueError:   # XML 宣言付きの str はバイト列として解析
             try:
-                cands, _, _ = self.search_pharmacy_candidates(name, max_pages=1)
-                if cands:
-                    best = cands[0]
-                    for c in cands[:3]:
-                        if name[:4] in c.name or c.name[:4] in name:
-                            best = c
-                            break
-                    detail, _ = self.get_pharmacy_detail(best)
-                    results[name] = detail.get("prescriptions_annual") if detail else None
-                else:
-                    results[name] = None
+                return lxml_html.document_fromstring(html.encode("utf-8"))
             except Exception:
-                results[name] = None
-            time.sleep(0.6)
-        return results
+                return None
+        except Exception:   # 空文書など
+            return None
 
-    # ── v2.4 新規: MHLW医療機関検索 ────────────────────────────────────────
+    def _text(self, node) -> str:
+        """get_text(strip=True) 相当"""
+        return "".join(t.strip() for t in self._texts(node))
 
-    def search_clinic_by_keyword(
-        self, keyword: str, pref_code: str = ""
-    ) -> List[PharmacyCandidate]:
-        """
-        MHLW医療機関データベースでクリニック名・住所キーワードを検索 (sjk=1: 医療機関)
+    def candidate_list(self, html: str) -> Tuple[int, List[CandidateItem]]:
+        doc = self._doc(html)
+        if doc is None:
+            return self._fallback.candidate_list(html)
+        total = 0
+        m = re.search(r"(\d{1,6})\s*件", "".join(self._texts(doc)))
+        if m:
+            total = int(m.group(1))
+        items: List[CandidateItem] = []
+        for item in self._items(doc):
+            h3 = self._h3(item)
+            if not h3:
+                continue
+            link = self._link(h3[0])
+            if not link:
+                continue
+            href = link[0].get("href", "")
+            if not href:
+                continue
+            address = ""
+            for dl in self._dl(item):
+                dt = self._dt(dl)
+                if not dt:
+                    continue
+                img = self._img(dt[0])
+                dt_text = self._text(dt[0])
+                if (img and "住所" in img[0].get("alt", "")) or any(
+                    kw in dt_text for kw in ["住所", "所在地"]
+                ):
+                    dd = self._dd(dl)
+                    if dd:
+                        # dd 内の <a>（地図リンク等）の文字列を除く
+                        texts = self._texts_outside_a(dd[0], n=self._n_a(dd[0]))
+                        address = "".join(t.strip() for t in texts)
+                    break
+            items.append((self._text(link[0]), href, address))
+        return total, items
+
+    def table_rows(self, html: str) -> List[Tuple[str, str]]:
+        doc = self._doc(html)
+        if doc is None:
+            return self._fallback.table_rows(html)
+        return self._rows(doc)
+
+    def detail(self, html: str) -> DetailParts:
+        doc = self._doc(html)
+        if doc is None:
+            return self._fallback.detail(html)
+        pairs = [
+            (self._text(dt), self._text(dd))
+            for dl in self._dl(doc)
+            for dt, dd in zip(self._dt(dl), self._dd(dl))
+        ]
+        return self._rows(doc), pairs, lambda: " ".join(self._texts(doc))
 
-        OSMで検出されなかったクリニックを名称等で検索するための補助機能。
-        """
-        cands, _, _ = self._search_candidates(keyword, pref_code, max_pages=2, sjk="1")
-        return cands
+    def _rows(self, doc) -> List[Tuple[str, str]]:
+        rows = []
+        for row in self._tr(doc):
+            cells = self._cells(row)
+            if len(cells) >= 2:
+                rows.append((self._text(cells[0]), self._text(cells[1])))
+        return rows
 
-    def search_medical_by_area(
-        self, address: str, pref_code: str = "", max_pages: int = 5
-    ) -> Tuple[List[PharmacyCandidate], str]:
-        """
-        住所からエリアキーワードを自動抽出してMHLW医療機関を一括検索 (v2.6新機能)
 
-        OSMで未収録の医療機関を自動補填するためのエリアベース検索。
-        - 市区町村名をキーワードとして全施設を検索（sjk=1: 医療機関）
-        - 住所にキーワードが含まれる候補のみを返す（名称一致の誤ヒットを排除）
-        - 最大 max_pages × 20 件を取得（デフォルト: 100件）
+MHLW_PARSER_BACKENDS: Tuple[str, ...] = ("lxml", "bs4") if lxml_html is not None else ("bs4",)
 
-        Returns:
-            (candidates, log_message)
-        """
-        keyword = extract_area_keyword(address)
-        cands, total, msg = self._search_candidates(keyword, pref_code, max_pages, sjk="1")
-        # 住所にキーワードを含む候補のみに絞り込む（名前一致の誤ヒットを排除）
-        filtered = [c for c in cands if c.address and keyword in c.address]
-        return filtered, (
-            f"MHLWエリア検索: キーワード='{keyword}' → "
-            f"全{total}件中 住所一致{len(filtered)}件取得"
-        )
 
-    def get_clinic_daily_outpatients(
-        self, candidate: PharmacyCandidate
-    ) -> Tuple[Optional[int], str]:
-        """
-        MHLW医療機関詳細ページから外来患者数（1日平均）を取得する。
+@functools.lru_cache(maxsize=None)
+def get_mhlw_page_parser(backend: Optional[str] = None):
+    """MHLW ページ解析器（既定: lxml が導入済みなら LxmlPageParser、なければ Bs4PageParser）"""
+    backend = backend or MHLW_PARSER_BACKENDS[0]
+    if backend == "lxml" and lxml_html is not None:
+        return LxmlPageParser()
+    return Bs4PageParser()
 
-        MHLW の報告形式は施設によって異なるため、複数のパターンを試みる。
-        - 「外来患者数」「1日平均外来」などのフィールドを探索
-        - 年間値が得られた場合は稼働日数(305)で割って日次換算
-        """
-        if not self._initialized:
-            self.initialize_session()
-        if candidate.pref_cd and candidate.kikan_cd:
-            url = (f"{self.BASE}/juminkanja/S2430/initialize"
-                   f"?prefCd={candidate.pref_cd}&kikanCd={candidate.kikan_cd}&kikanKbn=1")
+
+def _iter_html_files(paths: List[str]) -> Iterator[str]:
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for fn in sorted(files):
+                    if fn.lower().endswith((".html", ".htm")):
+                        yield os.path.join(root, fn)
         else:
-            url = candidate.href
-        try:
-            r = self.session.get(url, timeout=12)
-            if r.status_code != 200:
-                return None, f"HTTP {r.status_code}"
-            soup = BeautifulSoup(r.text, "html.parser")
-            fields: Dict[str, str] = {}
-            for row in soup.find_all("tr"):
-                cells = row.find_all(["th", "td"])
-                if len(cells) >= 2:
-                    k = cells[0].get_text(strip=True)
-                    v = cells[1].get_text(strip=True)
-                    if k:
-                        fields[k] = v
-            # 1日平均外来患者数（直接記載）
-            for k, v in fields.items():
-                if ("1日平均" in k or "一日平均" in k) and "外来" in k:
-                    nums = re.findall(r"[\d,]+", v)
-                    if nums:
-                        try:
-                            n = int(nums[0].replace(",", ""))
-                            if 1 <= n <= 3000:
-                                return n, f"MHLW取得: {k}"
-                        except (ValueError, OverflowError):
-                            pass
-            # 年間外来患者数（305日で割って日次換算）
-            for k, v in fields.items():
-                if "外来" in k and ("患者" in k or "数" in k) and "年間" in k:
-                    nums = re.findall(r"[\d,]+", v)
-                    if nums:
-                        try:
-                            n = int(nums[0].replace(",", ""))
-                            if n > 300:
-                                daily = int(n / NATIONAL_STATS["working_days"])
-                                return daily, f"MHLW年間値から換算({n:,}→{daily}/日)"
-                        except (ValueError, OverflowError):
-                            pass
-            return None, "外来患者数の記載なし"
-        except Exception as e:
-            return None, f"取得エラー: {e}"
+            yield path
+
+
+def benchmark_mhlw_parsers(pages: List[Tuple[str, str]], repeat: int = 3) -> Dict[str, Dict]:
+    """
+    v4.5: 保存済み MHLW ページ [(名前, HTML)] で各解析器を計測する。
+
+    各ページを候補一覧・詳細ページの両方として解析し（_parse_candidate_list / _parse_detail）、
+    解析器ごとの合計時間とページあたり時間、基準（bs4）と結果が異なるページ名を返す。
+    """
+    scraper = MHLWScraper()
+    results: Dict[str, Dict] = {}
+    outputs: Dict[str, List] = {}
+    for backend in MHLW_PARSER_BACKENDS:
+        scraper.parser = get_mhlw_page_parser(backend)
+        t0 = time.perf_counter()
+        for _ in range(max(1, repeat)):
+            out = [(scraper._parse_candidate_list(html), scraper._parse_detail(html)) for _, html in pages]
+        elapsed = (time.perf_counter() - t0) / max(1, repeat)
+        outputs[backend] = out
+        results[backend] = {
+            "total_s": elapsed,
+            "ms_per_page": elapsed * 1000 / max(1, len(pages)),
+        }
+    base = outputs.get("bs4", [])
+    for backend, out in outputs.items():
+        results[backend]["mismatches"] = [
+            name for (name, _), a, b in zip(pages, out, base) if a != b
+        ]
+    return results
 
 
 # ---------------------------------------------------------------------------
 # 4-b. v4.1: 校正エンジン
 # ---------------------------------------------------------------------------
 
+def _geocode_calibration_set(
+    geocoder: "GeocoderService",
+    calibration_set: List[Tuple["PharmacyCandidate", int]],
+    progress_cb: Optional[Callable[[int, str], None]],
+    pct_from: int,
+    pct_to: int,
+) -> List[GeocodeResult]:
+    """v4.5: 校正セットの住所を geocode_many() で一括解決し、入力順のリストで返す"""
+    n = len(calibration_set)
+    geos: List[GeocodeResult] = [(None, None, "未処理", "")] * n
+    results = geocoder.geocode_many([cand.address for cand, _ in calibration_set])
+    for done, (i, geo) in enumerate(results, start=1):
+        geos[i] = geo
+        if progress_cb:
+            pct = int(pct_from + (pct_to - pct_from) * done / max(n, 1))
+            progress_cb(pct, f"ジオコーディング中 ({done}/{n}): {calibration_set[i][0].name[:20]}…")
+    return geos
+
+
+def _calibration_search_radius(cand: "PharmacyCandidate") -> Tuple[int, int, bool, int]:
+    """校正用の (人口密度, 商圏半径, 門前判定, OSM検索半径)。住所・名称のみから求める"""
+    density, _ = get_population_density(cand.address)
+    is_gate, gate_reason = detect_gate_pharmacy(cand.name, [])
+    radius, _ = calc_commercial_radius(density, is_gate, gate_reason)
+    return density, radius, is_gate, max(int(radius * 1.5), 600)
+
+
+def _prefetch_calibration_osm(
+    calibration_set: List[Tuple["PharmacyCandidate", int]],
+    geos: List[GeocodeResult],
+    progress_cb: Optional[Callable[[int, str], None]],
+    pct: int,
+) -> None:
+    """v4.5: 校正セット全地点の OSM 検索をまとめて先読み（OverpassSearcher.prefetch）"""
+    points = [
+        (geo[0], geo[1], _calibration_search_radius(cand)[3])
+        for (cand, _), geo in zip(calibration_set, geos)
+        if geo[0] and geo[1]
+    ]
+    if not points:
+        return
+    n_queries = OverpassSearcher().prefetch(points)
+    if progress_cb:
+        progress_cb(pct, f"OSM一括取得: {len(points)}地点 → Overpassクエリ{n_queries}回")
+
+
 class CalibrationEngine:
     """
     MHLWの実績処方箋データを使ってモデルを校正するエンジン（v4.1）
@@ -1525,9 +4664,17 @@ class CalibrationEngine:
     ) -> List[Tuple["PharmacyCandidate", int]]:
         """
         MHLWで都道府県・キーワードを検索し、処方箋枚数が取得できた薬局を返す。
+        v4.5: クロール済み（RegistryCrawler 完了）の都道府県は PharmacyRegistry から抽出する。
 
         Returns: List of (PharmacyCandidate, annual_rx)
         """
+        registry = get_pharmacy_registry()
+        if pref_code and registry.is_complete(pref_code):
+            result = registry.sample(pref_code, min_rx, max_pharmacies, keyword=keyword)
+            if progress_cb:
+                progress_cb(45, f"校正セット収集完了: {len(result)}件（薬局レジストリから抽出）")
+            return result
+
         if not self._scraper._initialized:
             self._scraper.initialize_session()
 
@@ -1551,7 +4698,6 @@ class CalibrationEngine:
                     result.append((cand, rx))
             except Exception:
                 pass
-            time.sleep(0.5)
             if progress_cb:
                 pct = int(5 + 40 * (i + 1) / max(len(candidates), 1))
                 progress_cb(pct, f"MHLW詳細取得中 ({i+1}/{len(candidates)}) … 有効: {len(result)}件")
@@ -1566,16 +4712,18 @@ class CalibrationEngine:
         self,
         cand: "PharmacyCandidate",
         actual_rx: int,
+        geo: Optional[GeocodeResult] = None,
     ) -> "CalibrationPoint":
         """
         1薬局について住所のみの情報で方法①・②予測を実行し CalibrationPoint を返す。
+        geo: geocode_many() で取得済みのジオコーディング結果（省略時はここで取得）
         """
         pt = CalibrationPoint(name=cand.name, address=cand.address, actual_rx=actual_rx)
         log: List[str] = []
 
         try:
             # 1. ジオコーディング
-            lat, lon, geo_msg, _ = self._geocoder.geocode(cand.address)
+            lat, lon, geo_msg, _ = geo or self._geocoder.geocode(cand.address)
             log.append(f"[Geo] {geo_msg}")
             if not (lat and lon):
                 log.append("⚠ ジオコーディング失敗 → スキップ")
@@ -1583,12 +4731,9 @@ class CalibrationEngine:
                 return pt
 
             # 2. 人口密度・商圏半径
-            density, _ = get_population_density(cand.address)
+            density, radius, is_gate, search_r = _calibration_search_radius(cand)
             pt.area_density = density
-            is_gate, gate_reason = detect_gate_pharmacy(cand.name, [])
             pt.is_gate = is_gate
-            radius, _ = calc_commercial_radius(density, is_gate, gate_reason)
-            search_r = max(int(radius * 1.5), 600)
 
             # 3. OSM検索
             ov = OverpassSearcher()
@@ -1597,12 +4742,9 @@ class CalibrationEngine:
             pt.n_medical = len(medical)
             pt.n_pharmacies = len(pharmacies)
 
-            # 4. MHLW医療機関補填（軽量版: キーワード検索のみ）
-            pref_code = ""
-            for pn, pc in PREFECTURE_CODES.items():
-                if pn in cand.address:
-                    pref_code = pc
-                    break
+            # 4. MHLW医療機関補填（軽量版: キーワード検索のみ / v4.5: 台帳があれば実数付与・台帳で補填）
+            enrich_medical_outpatients(medical, log)
+            pref_code = pref_code_from_address(cand.address)
             new_facs, sup_log = fetch_mhlw_medical_supplement(
                 pharmacy_lat=lat, pharmacy_lon=lon,
                 pharmacy_address=cand.address, pref_code=pref_code,
@@ -1616,14 +4758,16 @@ class CalibrationEngine:
             # 5. 医療機関密集補正
             medical = apply_clinic_congestion_factor(medical)
 
-            # 6. 方法①
-            m1_result = Method1Predictor().predict(lat, lon, medical, pharmacies)
+            # 6. 方法①（v4.5: 方法①②で距離・空間索引を共有）
+            geometry = AreaGeometry(lat, lon)
+            geometry.seed_site_distances(medical)
+            m1_result = Method1Predictor().predict(lat, lon, medical, pharmacies, geometry=geometry)
             pt.m1_rx = m1_result.annual_rx
 
             # 7. 方法②
             m2_result = Method2Predictor().predict(
                 lat, lon, pharmacies, density, radius,
-                nearby_medical=medical,
+                nearby_medical=medical, geometry=geometry,
             )
             pt.m2_rx = m2_result.annual_rx
 
@@ -1641,18 +4785,25 @@ class CalibrationEngine:
         self,
         calibration_set: List[Tuple["PharmacyCandidate", int]],
         progress_cb: Optional[Callable[[int, str], None]] = None,
-        delay: float = 0.8,
     ) -> List["CalibrationPoint"]:
-        """校正セット全件の予測を実行して CalibrationPoint リストを返す"""
+        """
+        校正セット全件の予測を実行して CalibrationPoint リストを返す
+        （v4.5: 各サービスへの発行間隔は HostRateLimiter が制御するため固定待機なし）
+        """
         points: List[CalibrationPoint] = []
         n = len(calibration_set)
+        # v4.5: 先に全件を一括ジオコーディング
+        geos = _geocode_calibration_set(
+            self._geocoder, calibration_set, progress_cb, pct_from=45, pct_to=55,
+        )
+        # v4.5: 近接する地点の OSM 検索を数回の bbox クエリにまとめる
+        _prefetch_calibration_osm(calibration_set, geos, progress_cb, pct=55)
         for i, (cand, actual_rx) in enumerate(calibration_set):
             if progress_cb:
-                pct = int(45 + 50 * i / max(n, 1))
+                pct = int(55 + 40 * i / max(n, 1))
                 progress_cb(pct, f"予測中 ({i+1}/{n}): {cand.name[:20]}…")
-            pt = self.predict_for_candidate(cand, actual_rx)
+            pt = self.predict_for_candidate(cand, actual_rx, geo=geos[i])
             points.append(pt)
-            time.sleep(delay)
 
         if progress_cb:
             valid = sum(1 for p in points if p.m1_rx is not None)
@@ -1847,13 +4998,22 @@ class LocalCalibrationEngine:
         """
         対象住所と同一エリア（市区町村）の既存MHLW薬局を収集して返す。
 
+        v4.5: クロール済みの都道府県は PharmacyRegistry から同一エリアの薬局を抽出する。
+
         Returns:
             (calibration_set, area_keyword)
         """
+        area_kw = extract_area_keyword(address)
+        reg_pref = pref_code or pref_code_from_address(address)
+        registry = get_pharmacy_registry()
+        if reg_pref and registry.is_complete(reg_pref):
+            result = registry.sample(reg_pref, min_rx, max_pharmacies, address_keyword=area_kw)
+            if progress_cb:
+                progress_cb(55, f"ローカル校正セット収集完了: {len(result)}件（エリア: {area_kw}・薬局レジストリ）")
+            return result, area_kw
+
         if not self._scraper._initialized:
             self._scraper.initialize_session()
-
-        area_kw = extract_area_keyword(address)
         if progress_cb:
             progress_cb(5, f"エリアキーワード: '{area_kw}' でMHLW薬局検索中…")
 
@@ -1879,7 +5039,6 @@ class LocalCalibrationEngine:
                     result.append((cand, rx))
             except Exception:
                 pass
-            time.sleep(0.5)
             if progress_cb:
                 pct = int(15 + 40 * (i + 1) / max(len(local_cands), 1))
                 progress_cb(pct, f"処方箋データ取得中 ({i+1}/{len(local_cands)}) … 有効: {len(result)}件")
@@ -1902,13 +5061,18 @@ class LocalCalibrationEngine:
         """
         points: List[CalibrationPoint] = []
         n = len(calibration_set)
+        # v4.5: 先に全件を一括ジオコーディング
+        geos = _geocode_calibration_set(
+            self._geocoder, calibration_set, progress_cb, pct_from=55, pct_to=65,
+        )
+        # v4.5: 同一エリアの地点の OSM 検索を1〜2回の bbox クエリにまとめる
+        _prefetch_calibration_osm(calibration_set, geos, progress_cb, pct=65)
         for i, (cand, actual_rx) in enumerate(calibration_set):
             if progress_cb:
-                pct = int(55 + 40 * i / max(n, 1))
+                pct = int(65 + 30 * i / max(n, 1))
                 progress_cb(pct, f"予測中 ({i+1}/{n}): {cand.name[:20]}…")
-            pt = self._predict_one(cand, actual_rx, pharmacy_type)
+            pt = self._predict_one(cand, actual_rx, pharmacy_type, geo=geos[i])
             points.append(pt)
-            time.sleep(0.8)
         if progress_cb:
             valid = sum(1 for p in points if p.m1_rx is not None)
             progress_cb(95, f"バッチ完了: {valid}/{n}件 予測成功")
@@ -1919,24 +5083,22 @@ class LocalCalibrationEngine:
         cand: "PharmacyCandidate",
         actual_rx: int,
         pharmacy_type: str = PHARMACY_TYPE_NORMAL,
+        geo: Optional[GeocodeResult] = None,
     ) -> "CalibrationPoint":
-        """1薬局を住所のみで予測して CalibrationPoint を返す"""
+        """1薬局を住所のみで予測して CalibrationPoint を返す（geo: 取得済みジオコーディング結果）"""
         pt = CalibrationPoint(name=cand.name, address=cand.address, actual_rx=actual_rx)
         log: List[str] = []
         try:
-            lat, lon, geo_msg, _ = self._geocoder.geocode(cand.address)
+            lat, lon, geo_msg, _ = geo or self._geocoder.geocode(cand.address)
             log.append(f"[Geo] {geo_msg}")
             if not (lat and lon):
                 log.append("⚠ ジオコーディング失敗 → スキップ")
                 pt.error_log = log
                 return pt
 
-            density, _ = get_population_density(cand.address)
+            density, radius, is_gate, search_r = _calibration_search_radius(cand)
             pt.area_density = density
-            is_gate, gate_reason = detect_gate_pharmacy(cand.name, [])
             pt.is_gate = is_gate
-            radius, _ = calc_commercial_radius(density, is_gate, gate_reason)
-            search_r = max(int(radius * 1.5), 600)
 
             ov = OverpassSearcher()
             medical, pharmacies, ov_msg = ov.search_nearby(lat, lon, search_r)
@@ -1944,11 +5106,14 @@ class LocalCalibrationEngine:
             pt.n_medical = len(medical)
             pt.n_pharmacies = len(pharmacies)
 
-            # 密集補正
+            # 密集補正（v4.5: 医療機関台帳に外来患者数の実数があれば先に付与）
+            enrich_medical_outpatients(medical, log)
             medical = apply_clinic_congestion_factor(medical)
 
-            # 方法①
-            m1 = Method1Predictor().predict(lat, lon, medical, pharmacies)
+            # 方法①（v4.5: 方法①②で距離・空間索引を共有）
+            geometry = AreaGeometry(lat, lon)
+            geometry.seed_site_distances(medical)
+            m1 = Method1Predictor().predict(lat, lon, medical, pharmacies, geometry=geometry)
             pt.m1_rx = m1.annual_rx
 
             # 方法② (pharmacy_type を渡して SM業態補正を適用)
@@ -1956,6 +5121,7 @@ class LocalCalibrationEngine:
                 lat, lon, pharmacies, density, radius,
                 nearby_medical=medical,
                 pharmacy_type=pharmacy_type,
+                geometry=geometry,
             )
             pt.m2_rx = m2.annual_rx
 
@@ -1965,32 +5131,921 @@ class LocalCalibrationEngine:
         pt.error_log = log
         return pt
 
-    # ── Step 3: ローカル統計 ─────────────────────────────────────────────
+    # ── Step 3: ローカル統計 ─────────────────────────────────────────────
+
+    @staticmethod
+    def calc_local_stats(
+        points: List["CalibrationPoint"],
+    ) -> Optional["CalibrationStats"]:
+        """
+        CalibrationPoint リストからローカル補正係数 α1, α2 と最適ブレンド w* を計算。
+        CalibrationEngine.calc_stats() と同一ロジック。
+        """
+        return CalibrationEngine.calc_stats(points)
+
+    # ── Step 4: ローカル校正の適用 ──────────────────────────────────────
+
+    @staticmethod
+    def apply_local_correction(
+        m1_rx: int,
+        m2_rx: int,
+        density: int,
+        stats: "CalibrationStats",
+    ) -> Tuple[int, str]:
+        """
+        ローカル補正係数を新規薬局の予測に適用する。
+        CalibrationEngine.apply_correction() と同一ロジック。
+        """
+        return CalibrationEngine.apply_correction(m1_rx, m2_rx, density, stats)
+
+
+# ---------------------------------------------------------------------------
+# 4-d. v4.5: MHLW 薬局レジストリ（都道府県単位の全件クロール・再開可能）
+# ---------------------------------------------------------------------------
+REGISTRY_DETAIL_WORKERS: int = 3             # 詳細ページの同時取得数（レートは RATE_LIMITS["mhlw"]）
+REGISTRY_REFRESH_S: float = 180 * 86_400     # これより古い詳細は再クロール時に取り直す
+REGISTRY_CELL_DEG: float = 0.01              # 座標の空間ブロッキング用セル（約1.1km × 0.9km）
+
+
+class _CrawlStateStore:
+    """v4.5: 都道府県単位クロールの進捗（crawl_state テーブル）を持つ台帳の共通部分"""
+
+    _conn: sqlite3.Connection
+    _lock: threading.Lock
+
+    def _create_state_table(self) -> None:
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS crawl_state ("
+            " pref_cd TEXT PRIMARY KEY, keyword TEXT NOT NULL, phase TEXT NOT NULL,"
+            " next_page INTEGER NOT NULL, total INTEGER NOT NULL,"
+            " started_at REAL NOT NULL, updated_at REAL NOT NULL, message TEXT NOT NULL DEFAULT '')"
+        )
+
+    def get_state(self, pref_cd: str) -> Optional[Dict]:
+        with self._lock:
+            cur = self._conn.execute("SELECT * FROM crawl_state WHERE pref_cd = ?", (pref_cd,))
+            row = cur.fetchone()
+            return dict(zip([d[0] for d in cur.description], row)) if row else None
+
+    def save_state(self, pref_cd: str, **fields) -> None:
+        state = self.get_state(pref_cd) or {
+            "pref_cd": pref_cd, "keyword": "", "phase": "list", "next_page": 0, "total": 0,
+            "started_at": time.time(), "message": "",
+        }
+        state.update(fields, updated_at=time.time())
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO crawl_state"
+                " (pref_cd, keyword, phase, next_page, total, started_at, updated_at, message)"
+                " VALUES (:pref_cd, :keyword, :phase, :next_page, :total, :started_at, :updated_at, :message)",
+                state,
+            )
+
+    def is_complete(self, pref_cd: str) -> bool:
+        state = self.get_state(pref_cd)
+        return bool(state and state["phase"] == "done")
+
+    def _phase_label(self, pref_cd: str) -> str:
+        state = self.get_state(pref_cd)
+        return {"list": "一覧取得中", "detail": "詳細取得中", "geo": "座標付与中", "done": "完了"}.get(
+            state["phase"] if state else "", "未クロール")
+
+
+class PharmacyRegistry(_CrawlStateStore):
+    """
+    v4.5: 都道府県内の全薬局（MHLW 医療情報ネット）のローカル台帳
+
+      pharmacy    : (pref_cd, kikan_cd) → 名称・住所・詳細URL・年間処方箋枚数・詳細の取得状態
+                    ・住所の座標（lat, lon と空間ブロッキング用の cell）
+      crawl_state : 都道府県ごとのクロール進捗（一覧の次ページ・段階）＝チェックポイント
+    校正セット収集は、クロールが完了した都道府県ではこの台帳から抽出する（sample()）。
+    競合薬局の処方箋枚数は、座標付きの薬局を範囲検索して照合する（within() / enrich_competitor_rx）。
+    """
+
+    _GEO_COLUMNS = (("lat", "REAL"), ("lon", "REAL"), ("cell", "INTEGER"), ("geocoded_at", "REAL"))
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.path.join(CACHE_DIR, "mhlw_registry.sqlite3")
+        self._lock = threading.Lock()
+        self._conn = _open_sqlite(self.path)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS pharmacy ("
+                " pref_cd TEXT NOT NULL, kikan_cd TEXT NOT NULL, name TEXT NOT NULL,"
+                " address TEXT NOT NULL, href TEXT NOT NULL, prescriptions_annual INTEGER,"
+                " detail_status TEXT NOT NULL DEFAULT 'pending', fetched_at REAL,"
+                " listed_at REAL NOT NULL, PRIMARY KEY (pref_cd, kikan_cd)) WITHOUT ROWID"
+            )
+            self._create_state_table()
+            # 座標列は v4.5 の途中で追加（既存の台帳にも列を足す）
+            have = {row[1] for row in self._conn.execute("PRAGMA table_info(pharmacy)")}
+            for col, typ in self._GEO_COLUMNS:
+                if col not in have:
+                    self._conn.execute(f"ALTER TABLE pharmacy ADD COLUMN {col} {typ}")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS pharmacy_cell ON pharmacy (cell)")
+
+    @staticmethod
+    def cell_of(lat: float, lon: float) -> int:
+        """座標 → 空間ブロッキング用のセル番号（REGISTRY_CELL_DEG 刻み）"""
+        return int(math.floor(lat / REGISTRY_CELL_DEG)) * 100_000 + int(math.floor(lon / REGISTRY_CELL_DEG))
+
+    # ── 台帳 ─────────────────────────────────────────────────────────────
+
+    def upsert_candidates(self, pref_cd: str, cands: List[PharmacyCandidate]) -> int:
+        """一覧で見つけた薬局を登録（既存は名称・住所・URLのみ更新、住所が変わったら座標を破棄）。新規件数を返す"""
+        now = time.time()
+        rows = [(c.pref_cd or pref_cd, c.kikan_cd, c.name, c.address, c.href, now)
+                for c in cands if c.kikan_cd]
+        with self._lock, self._conn:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO pharmacy (pref_cd, kikan_cd, name, address, href, listed_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)", rows,
+            )
+            added = self._conn.total_changes - before
+            self._conn.executemany(
+                "UPDATE pharmacy SET lat = CASE WHEN address = ? THEN lat END,"
+                " lon = CASE WHEN address = ? THEN lon END, cell = CASE WHEN address = ? THEN cell END,"
+                " geocoded_at = CASE WHEN address = ? THEN geocoded_at END,"
+                " name = ?, address = ?, href = ?, listed_at = ? WHERE pref_cd = ? AND kikan_cd = ?",
+                [(a, a, a, a, n, a, h, t, p, k) for p, k, n, a, h, t in rows],
+            )
+        return added
+
+    def pending_details(self, pref_cd: str, refresh_s: float = REGISTRY_REFRESH_S) -> List[PharmacyCandidate]:
+        """詳細が未取得・取得失敗・refresh_s より古い薬局"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT pref_cd, kikan_cd, name, address, href FROM pharmacy WHERE pref_cd = ?"
+                " AND (detail_status IN ('pending', 'error') OR fetched_at < ?) ORDER BY kikan_cd",
+                (pref_cd, time.time() - refresh_s),
+            ).fetchall()
+        return [PharmacyCandidate(name=n, address=a, href=h, pref_cd=p, kikan_cd=k)
+                for p, k, n, a, h in rows]
+
+    def record_detail(self, cand: PharmacyCandidate, rx: Optional[int], status: str) -> None:
+        """
+        詳細ページの取得結果。status: "ok" / "error"（通信・一時的なエラー。次回のクロールで再取得）/
+        "gone"（4xx で取得不能。refresh_s 経過まで再取得しない）
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE pharmacy SET prescriptions_annual = ?, detail_status = ?, fetched_at = ?"
+                " WHERE pref_cd = ? AND kikan_cd = ?",
+                (rx if status == "ok" else None, status, time.time(), cand.pref_cd, cand.kikan_cd),
+            )
+
+    def pending_geocodes(self, pref_cd: str, refresh_s: float = REGISTRY_REFRESH_S) -> List[PharmacyCandidate]:
+        """座標が未付与の薬局（座標が得られなかったものは refresh_s 経過後に再試行）"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT pref_cd, kikan_cd, name, address, href FROM pharmacy WHERE pref_cd = ?"
+                " AND address != '' AND (geocoded_at IS NULL OR (lat IS NULL AND geocoded_at < ?))"
+                " ORDER BY kikan_cd",
+                (pref_cd, time.time() - refresh_s),
+            ).fetchall()
+        return [PharmacyCandidate(name=n, address=a, href=h, pref_cd=p, kikan_cd=k)
+                for p, k, n, a, h in rows]
+
+    def record_coords(self, cand: PharmacyCandidate, lat: Optional[float], lon: Optional[float]) -> None:
+        """住所のジオコーディング結果（lat=None は座標なしとして記録）"""
+        cell = self.cell_of(lat, lon) if lat is not None and lon is not None else None
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE pharmacy SET lat = ?, lon = ?, cell = ?, geocoded_at = ?"
+                " WHERE pref_cd = ? AND kikan_cd = ?",
+                (lat if cell is not None else None, lon if cell is not None else None, cell,
+                 time.time(), cand.pref_cd, cand.kikan_cd),
+            )
+
+    def within(
+        self, lat_min: float, lat_max: float, lon_min: float, lon_max: float,
+    ) -> List[Tuple[PharmacyCandidate, Optional[int], float, float]]:
+        """
+        座標が範囲内で詳細取得済みの薬局（(候補, 年間処方箋枚数, lat, lon) のリスト）。
+        範囲にかかるセルだけを索引で引いてから座標で絞る（都道府県をまたいでもよい）。
+        """
+        c_lat = range(int(math.floor(lat_min / REGISTRY_CELL_DEG)), int(math.floor(lat_max / REGISTRY_CELL_DEG)) + 1)
+        c_lon = range(int(math.floor(lon_min / REGISTRY_CELL_DEG)), int(math.floor(lon_max / REGISTRY_CELL_DEG)) + 1)
+        sql = ("SELECT pref_cd, kikan_cd, name, address, href, prescriptions_annual, lat, lon FROM pharmacy"
+               " WHERE detail_status = 'ok' AND lat BETWEEN ? AND ? AND lon BETWEEN ? AND ?")
+        args: List = [lat_min, lat_max, lon_min, lon_max]
+        if len(c_lat) * len(c_lon) <= 400:
+            cells = [a * 100_000 + b for a in c_lat for b in c_lon]
+            sql += f" AND cell IN ({','.join('?' * len(cells))})"
+            args += cells
+        with self._lock:
+            rows = self._conn.execute(sql, args).fetchall()
+        return [(PharmacyCandidate(name=n, address=a, href=h, pref_cd=p, kikan_cd=k), rx, la, lo)
+                for p, k, n, a, h, rx, la, lo in rows]
+
+    def sample(
+        self, pref_cd: str, min_rx: int, limit: int, keyword: str = "", address_keyword: str = "",
+    ) -> List[Tuple[PharmacyCandidate, int]]:
+        """
+        処方箋枚数 min_rx 以上の薬局から最大 limit 件を抽出（(候補, 年間処方箋枚数) のリスト）。
+        keyword: 空白区切りの各語が名称か住所に含まれるもの / address_keyword: 住所に含むもの。
+        抽出は都道府県・条件ごとに固定の乱数列で行う（同じ条件なら同じ校正セット）。
+        """
+        sql = ("SELECT pref_cd, kikan_cd, name, address, href, prescriptions_annual FROM pharmacy"
+               " WHERE pref_cd = ? AND detail_status = 'ok' AND prescriptions_annual >= ?"
+               " AND address != ''")
+        args: List = [pref_cd, min_rx]
+        for word in keyword.split():
+            sql += " AND (instr(name, ?) > 0 OR instr(address, ?) > 0)"
+            args += [word, word]
+        if address_keyword:
+            sql += " AND instr(address, ?) > 0"
+            args.append(address_keyword)
+        with self._lock:
+            rows = self._conn.execute(sql + " ORDER BY kikan_cd", args).fetchall()
+        rng = random.Random(f"{pref_cd}|{keyword}|{address_keyword}|{min_rx}")
+        picked = rng.sample(rows, min(limit, len(rows)))
+        return [(PharmacyCandidate(name=n, address=a, href=h, pref_cd=p, kikan_cd=k), rx)
+                for p, k, n, a, h, rx in picked]
+
+    # ── クロール進捗 ──────────────────────────────────────────────────────
+
+    def counts(self, pref_cd: str) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT detail_status, count(*), count(prescriptions_annual), count(lat) FROM pharmacy"
+                " WHERE pref_cd = ? GROUP BY detail_status",
+                (pref_cd,),
+            ).fetchall()
+        c = {"total": 0, "ok": 0, "pending": 0, "error": 0, "gone": 0, "with_rx": 0, "with_coords": 0}
+        for status, n, n_rx, n_geo in rows:
+            c[status] = n
+            c["total"] += n
+            c["with_rx"] += n_rx
+            c["with_coords"] += n_geo
+        return c
+
+    def summary(self, pref_cd: str) -> str:
+        c = self.counts(pref_cd)
+        phase = self._phase_label(pref_cd)
+        return (f"{phase}: 薬局 {c['total']:,}件（詳細取得済 {c['ok']:,} / 未取得 {c['pending']:,}"
+                f" / 失敗 {c['error']:,} / 取得不能 {c['gone']:,}・処方箋数あり {c['with_rx']:,}件・座標あり {c['with_coords']:,}件）")
+
+
+@st.cache_resource
+def get_pharmacy_registry() -> PharmacyRegistry:
+    """プロセス共通の PharmacyRegistry"""
+    return PharmacyRegistry()
+
+
+def _registry_pref_name(pref_code: str) -> str:
+    for name, code in PREFECTURE_CODES.items():
+        if code == pref_code:
+            return name
+    return ""
+
+
+class RegistryCrawler:
+    """
+    v4.5: 都道府県内の全薬局を MHLW から取得して PharmacyRegistry に書き込むクローラー
+
+      1. 一覧: 都道府県名をキーワード・prefCd で絞った検索結果を1ページずつ取得し登録。
+               ページごとに crawl_state.next_page を保存するため、中断しても続きから再開する
+      2. 詳細: 詳細未取得（失敗・期限切れを含む）の薬局を REGISTRY_DETAIL_WORKERS 並列で取得し、
+               1件ごとに年間処方箋枚数を保存（再開時は残りだけを取得）。失敗が残っても件数を
+               message に記録して次の段階へ進む（4xx は "gone" として期限切れまで再取得しない）
+      3. 座標: 座標未付与の薬局の住所を GeocoderService.geocode_many で解決して1件ごとに保存
+               （位置参照情報・ジオコードキャッシュにあれば通信なし）
+    発行レートは RATE_LIMITS["mhlw"]、取得ページは MHLWSnapshotStore にも残る。
+    一覧の並び順は取得中に薬局が増減すると前後するため、ページ境界の取りこぼしは
+    次回の再クロール（restart=True）で補う。
+    医療機関は MedicalRegistryCrawler（検索種別 SJK と詳細の取得だけが異なる）。
+    """
+
+    SJK = "2"   # 検索種別（2: 薬局）
+
+    def __init__(
+        self,
+        registry: Optional[PharmacyRegistry] = None,
+        scraper: Optional[MHLWScraper] = None,
+        workers: int = REGISTRY_DETAIL_WORKERS,
+        geocoder: Optional[GeocoderService] = None,
+    ):
+        self.registry = registry or self._default_registry()
+        self.scraper = scraper or MHLWScraper()
+        self.workers = workers
+        self.geocoder = geocoder or GeocoderService()
+
+    def _default_registry(self) -> PharmacyRegistry:
+        return get_pharmacy_registry()
+
+    def _fetch_detail(self, cand: PharmacyCandidate) -> Tuple[Optional[int], str]:
+        """詳細ページ → (台帳に記録する値, detail_status)"""
+        detail, status = self.scraper.fetch_pharmacy_detail(cand)
+        return (detail.get("prescriptions_annual") if detail else None), self._detail_status(detail, status)
+
+    @staticmethod
+    def _detail_status(detail: Optional[Dict], status: CallStatus) -> str:
+        """
+        取得結果 → detail_status。4xx（429・408 を除く）は再試行しても変わらないため "gone" とし、
+        失敗が残っても詳細段階を終えられるようにする
+        """
+        if detail is not None:
+            return "ok"
+        if 400 <= status.http_status < 500 and status.http_status not in (408, 429):
+            return "gone"
+        return "error"
+
+    def crawl(
+        self,
+        pref_code: str,
+        progress_cb: Optional[Callable[[str], None]] = None,
+        stop_event: Optional[threading.Event] = None,
+        refresh_s: float = REGISTRY_REFRESH_S,
+        restart: bool = False,
+    ) -> bool:
+        """1都道府県をクロール。完了したら True（中断・エラー時は False、次回は続きから）"""
+        report = progress_cb or (lambda msg: None)
+        stopped = (lambda: stop_event.is_set()) if stop_event is not None else (lambda: False)
+        reg = self.registry
+        state = reg.get_state(pref_code)
+        if restart or state is None or state["phase"] == "done":
+            reg.save_state(pref_code, keyword=_registry_pref_name(pref_code), phase="list",
+                           next_page=0, total=0, started_at=time.time(), message="")
+            state = reg.get_state(pref_code)
+        keyword = state["keyword"]
+        phase = state["phase"]
+
+        # ── 1. 一覧 ──
+        if phase == "list":
+            page, total = state["next_page"], state["total"]
+            while total == 0 or page < -(-total // MHLW_PAGE_SIZE):
+                if stopped():
+                    reg.save_state(pref_code, message="中断")
+                    return False
+                result = self.scraper.fetch_candidate_page(keyword, pref_code, page, self.SJK)
+                if result is None and self.scraper.reset_session():
+                    result = self.scraper.fetch_candidate_page(keyword, pref_code, page, self.SJK)
+                if result is None:
+                    reg.save_state(pref_code, message=f"一覧 {page + 1}ページ目の取得に失敗")
+                    return False
+                cands, total = result
+                if not cands:
+                    break
+                added = reg.upsert_candidates(pref_code, cands)
+                page += 1
+                reg.save_state(pref_code, next_page=page, total=total, message="")
+                report(f"[{keyword}] 一覧 {page}/{-(-total // MHLW_PAGE_SIZE)}ページ（新規 {added}件）")
+            reg.save_state(pref_code, phase="detail")
+            phase = "detail"
+
+        # ── 2. 詳細 ──
+        if phase == "detail" and not self._crawl_details(pref_code, keyword, report, stopped, refresh_s):
+            return False
+
+        # ── 3. 座標 ──
+        pending = reg.pending_geocodes(pref_code, refresh_s)
+        n_done = n_geo = 0
+        for i, (g_lat, g_lon, _, _) in self.geocoder.geocode_many([c.address for c in pending]):
+            reg.record_coords(pending[i], g_lat, g_lon)
+            n_done += 1
+            n_geo += g_lat is not None
+            if n_done % 50 == 0 or n_done == len(pending):
+                report(f"[{keyword}] 座標 {n_done}/{len(pending)}件（取得 {n_geo}件）")
+            if stopped():
+                reg.save_state(pref_code, message="中断")
+                return False
+        reg.save_state(pref_code, phase="done", message=self._detail_failure_message(pref_code))
+        report(f"[{keyword}] 完了 — {reg.summary(pref_code)}")
+        return True
+
+    def _crawl_details(
+        self,
+        pref_code: str,
+        keyword: str,
+        report: Callable[[str], None],
+        stopped: Callable[[], bool],
+        refresh_s: float,
+    ) -> bool:
+        """
+        詳細の取得段階。全件を試したら段階を "geo" に進めて True（中断時のみ False）。
+        失敗した薬局は "error" / "gone" として記録し、件数を message に残して先へ進む
+        （"error" は次回のクロールで再取得）
+        """
+        reg = self.registry
+        pending = reg.pending_details(pref_code, refresh_s)
+        n_done = n_error = 0
+        executor = ThreadPoolExecutor(max_workers=max(1, self.workers))
+        try:
+            futures = {executor.submit(self._fetch_detail, c): c for c in pending}
+            for f in as_completed(futures):
+                cand = futures[f]
+                try:
+                    value, status = f.result()
+                except Exception:
+                    value, status = None, "error"
+                reg.record_detail(cand, value, status)
+                n_done += 1
+                n_error += status != "ok"
+                if n_done % 20 == 0 or n_done == len(pending):
+                    report(f"[{keyword}] 詳細 {n_done}/{len(pending)}件（失敗 {n_error}件）")
+                if stopped():
+                    reg.save_state(pref_code, message="中断")
+                    return False
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+        reg.save_state(pref_code, phase="geo", message=self._detail_failure_message(pref_code))
+        return True
+
+    def _detail_failure_message(self, pref_code: str) -> str:
+        c = self.registry.counts(pref_code)
+        parts = []
+        if c["error"]:
+            parts.append(f"詳細取得失敗 {c['error']}件（再実行で再取得）")
+        if c["gone"]:
+            parts.append(f"詳細取得不能 {c['gone']}件")
+        return " / ".join(parts)
+
+
+class RegistryCrawlJob:
+    """v4.5: RegistryCrawler をバックグラウンドスレッドで実行する（UI から開始・停止・進捗表示）"""
+
+    def __init__(self):
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.pref_codes: List[str] = []
+        self.medical = False   # True: 医療機関（MedicalRegistryCrawler）
+        self.last_message = ""
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, pref_codes: List[str], restart: bool = False, medical: bool = False) -> bool:
+        if self.running:
+            return False
+        self._stop.clear()
+        self.pref_codes = list(pref_codes)
+        self.medical = medical
+        self._thread = threading.Thread(
+            target=self._run, args=(self.pref_codes, restart), name="registry-crawl", daemon=True,
+        )
+        self._thread.start()
+        return True
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self, pref_codes: List[str], restart: bool) -> None:
+        crawler = MedicalRegistryCrawler() if self.medical else RegistryCrawler()
+        for code in pref_codes:
+            if self._stop.is_set():
+                break
+            try:
+                crawler.crawl(code, progress_cb=self._report, stop_event=self._stop, restart=restart)
+            except Exception as e:
+                self._report(f"[{code}] エラー: {e}")
+
+    def _report(self, msg: str) -> None:
+        self.last_message = msg
+
+
+@st.cache_resource
+def get_registry_crawl_job() -> RegistryCrawlJob:
+    """プロセス共通のバックグラウンドクロール（同時に1つだけ実行）"""
+    return RegistryCrawlJob()
+
+
+# 競合薬局（OSM）⇔ 台帳の照合条件
+REGISTRY_MATCH_RADIUS_M: float = 300.0       # 住所ジオコードと OSM 位置のずれを許容する距離
+REGISTRY_MATCH_MIN_SIMILARITY: float = 0.6   # 正規化した名称の類似度（SequenceMatcher.ratio）の下限
+COMPETITOR_LIVE_LOOKUP_LIMIT: int = 10       # 台帳で照合できなかった薬局の MHLW 名称検索の上限件数
+
+_FACILITY_NAME_NOISE = re.compile(
+    r"株式会社|有限会社|\((?:株|有)\)|(?:社会)?医療法人(?:社団|財団)?|[\s・･\-‐－―()\[\]「」『』]"
+)
+
+
+def _normalize_facility_name(name: str) -> str:
+    """名称照合用の正規化（NFKC・小文字化・法人格（医療法人を含む）と空白・記号の除去）"""
+    return _FACILITY_NAME_NOISE.sub("", unicodedata.normalize("NFKC", name).lower())
+
+
+def _facility_name_similarity(a: str, b: str) -> float:
+    """正規化済み名称の類似度（一方が他方を含む場合は 0.9 以上として扱う）"""
+    if not a or not b:
+        return 0.0
+    ratio = difflib.SequenceMatcher(None, a, b).ratio()
+    short, long_ = (a, b) if len(a) <= len(b) else (b, a)
+    if len(short) >= 4 and short in long_:
+        ratio = max(ratio, 0.9)
+    return ratio
+
+
+def match_registry_facilities(
+    facilities: List[NearbyFacility],
+    records: List[Tuple[PharmacyCandidate, object, float, float]],
+    radius_m: float = REGISTRY_MATCH_RADIUS_M,
+    min_similarity: float = REGISTRY_MATCH_MIN_SIMILARITY,
+) -> Dict[int, int]:
+    """
+    v4.5: OSM の施設と台帳の施設を1対1で対応付ける（{facilities の位置: records の位置}）。
+    records の各要素は (候補, 台帳の値, lat, lon)（値は照合に使わない）。
+
+    距離 radius_m 以内かつ名称類似度 min_similarity 以上の組を候補とし、
+    「類似度 − 距離ペナルティ（radius_m で 0.25）」の高い順に貪欲に確定する。
+    同じチェーンの別店舗は名称がほぼ同じなので、距離の近い方が優先される。
+    """
+    rec_names = [_normalize_facility_name(c.name) for c, _, _, _ in records]
+    index = GridIndex(((r_lat, r_lon) for _, _, r_lat, r_lon in records), cell_m=radius_m)
+    pairs: List[Tuple[float, int, int]] = []
+    for i, fac in enumerate(facilities):
+        name = _normalize_facility_name(fac.name)
+        for j, dist in index.within(fac.lat, fac.lon, radius_m):
+            sim = _facility_name_similarity(name, rec_names[j])
+            if sim >= min_similarity:
+                pairs.append((sim - 0.25 * dist / radius_m, i, j))
+    matched: Dict[int, int] = {}
+    used: set = set()
+    for _, i, j in sorted(pairs, reverse=True):
+        if i not in matched and j not in used:
+            matched[i] = j
+            used.add(j)
+    return matched
+
+
+def enrich_competitor_rx(
+    pharmacies: List[NearbyFacility],
+    log: List[str],
+    registry: Optional[PharmacyRegistry] = None,
+    live_limit: int = COMPETITOR_LIVE_LOOKUP_LIMIT,
+) -> int:
+    """
+    v4.5: 競合薬局に年間処方箋枚数（mhlw_annual_outpatients）を付与し、付与件数を返す。
+
+      1. 競合薬局の範囲（+ REGISTRY_MATCH_RADIUS_M）にある台帳の薬局をセル索引で取り出し、
+         match_registry_facilities で対応付け（全件・通信なし）。
+         照合できた薬局は、台帳で処方箋枚数が非公表でも MHLW への問い合わせはしない
+      2. 照合できなかった薬局だけ、近い順に最大 live_limit 件を従来の名称検索で補う
+    """
+    if not pharmacies:
+        return 0
+    registry = registry or get_pharmacy_registry()
+    pad_lat = REGISTRY_MATCH_RADIUS_M / 111_000
+    pad_lon = pad_lat / max(0.1, math.cos(math.radians(pharmacies[0].lat)))
+    records = registry.within(
+        min(p.lat for p in pharmacies) - pad_lat, max(p.lat for p in pharmacies) + pad_lat,
+        min(p.lon for p in pharmacies) - pad_lon, max(p.lon for p in pharmacies) + pad_lon,
+    )
+    matched = match_registry_facilities(pharmacies, records) if records else {}
+    filled = 0
+    for i, j in sorted(matched.items()):
+        cand, rx, _, _ = records[j]
+        if rx:
+            pharmacies[i].mhlw_annual_outpatients = rx
+            log.append(f"  [競合薬局台帳] {pharmacies[i].name} → {cand.name}: {rx:,}枚/年")
+            filled += 1
+
+    unmatched = [ph for i, ph in enumerate(pharmacies) if i not in matched]
+    live = sorted(unmatched, key=lambda p: p.distance_m)[:live_limit]
+    n_live = 0
+    if live:
+        with MHLWScraper() as scraper:
+            scraper.initialize_session()
+            rx_data = scraper.get_rx_for_nearby_pharmacies([p.name for p in live], limit=len(live))
+        for ph in live:
+            if rx_data.get(ph.name):
+                ph.mhlw_annual_outpatients = rx_data[ph.name]
+                log.append(f"  [競合薬局MHLW] {ph.name}: {rx_data[ph.name]:,}枚/年")
+                n_live += 1
+    log.append(
+        f"[競合薬局MHLW] 台帳照合 {len(matched)}/{len(pharmacies)}件（処方箋数あり {filled}件）"
+        f"・個別検索 {n_live}/{len(live)}件 → 計{filled + n_live}件で処方箋枚数取得"
+    )
+    return filled + n_live
+
+
+# ---------------------------------------------------------------------------
+# 4-e. v4.5: MHLW 医療機関レジストリ（外来患者数・座標・R*Tree 空間索引）
+# ---------------------------------------------------------------------------
+
+_HOSPITAL_NAME_KEYWORDS = ("病院", "医療センター", "医療機構", "医院")
+
+
+def _guess_facility_type(name: str) -> str:
+    """名称から施設種別を推定（"hospital" / "clinic"。MHLW補填の従来ルール）"""
+    return "hospital" if any(kw in name for kw in _HOSPITAL_NAME_KEYWORDS) else "clinic"
+
+
+def _default_supplement_outpatients(fac_type: str, specialty: str) -> int:
+    """
+    外来患者数が取れない MHLW 補填施設のデフォルト値（v4.2）。
+    OSM収録施設と同様に診療科別基礎値×0.85、病院は固定120人/日。
+    """
+    if fac_type == "hospital":
+        return 120
+    sp_key = specialty if specialty in SPECIALTY_OUTPATIENT_TABLE else "不明/その他"
+    return max(5, int(SPECIALTY_OUTPATIENT_TABLE[sp_key]["base"] * 0.85))
 
-    @staticmethod
-    def calc_local_stats(
-        points: List["CalibrationPoint"],
-    ) -> Optional["CalibrationStats"]:
+
+class MedicalRegistry(_CrawlStateStore):
+    """
+    v4.5: 都道府県内の全医療機関（MHLW 医療情報ネット）のローカル台帳
+
+      facility       : (pref_cd, kikan_cd) → 名称・住所・詳細URL・種別・診療科・診療科目欄
+                       ・1日平均外来患者数（記載があれば）・詳細の取得状態・住所の座標
+      facility_rtree : 座標の R*Tree 空間索引（点なので min = max）
+      crawl_state    : クロール進捗（PharmacyRegistry と同じ形式）
+    クロールが完了した都道府県では、MHLW補填をエリア検索・ジオコーディングなしに
+    この台帳の範囲検索で行い（fetch_mhlw_medical_supplement）、
+    OSM の医療機関にも外来患者数の実数を付与する（enrich_medical_outpatients）。
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.path.join(CACHE_DIR, "mhlw_medical.sqlite3")
+        self._lock = threading.Lock()
+        self._conn = _open_sqlite(self.path)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS facility ("
+                " id INTEGER PRIMARY KEY, pref_cd TEXT NOT NULL, kikan_cd TEXT NOT NULL,"
+                " name TEXT NOT NULL, address TEXT NOT NULL, href TEXT NOT NULL,"
+                " facility_type TEXT NOT NULL, specialty TEXT NOT NULL,"
+                " departments TEXT NOT NULL DEFAULT '', daily_outpatients INTEGER,"
+                " outpatient_note TEXT NOT NULL DEFAULT '',"
+                " detail_status TEXT NOT NULL DEFAULT 'pending', fetched_at REAL,"
+                " listed_at REAL NOT NULL, lat REAL, lon REAL, geocoded_at REAL,"
+                " UNIQUE (pref_cd, kikan_cd))"
+            )
+            self._conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS facility_rtree"
+                " USING rtree(id, min_lat, max_lat, min_lon, max_lon)"
+            )
+            self._create_state_table()
+
+    # ── 台帳 ─────────────────────────────────────────────────────────────
+
+    def upsert_candidates(self, pref_cd: str, cands: List[PharmacyCandidate]) -> int:
+        """一覧で見つけた医療機関を登録（既存は名称・住所・URLのみ更新、住所が変わったら座標を破棄）。新規件数を返す"""
+        now = time.time()
+        rows = [(c.pref_cd or pref_cd, c.kikan_cd, c.name, c.address, c.href, now)
+                for c in cands if c.kikan_cd]
+        with self._lock, self._conn:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO facility"
+                " (pref_cd, kikan_cd, name, address, href, facility_type, specialty, listed_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(p, k, n, a, h, _guess_facility_type(n), detect_specialty_from_name(n), t)
+                 for p, k, n, a, h, t in rows],
+            )
+            added = self._conn.total_changes - before
+            self._conn.executemany(
+                "DELETE FROM facility_rtree WHERE id IN"
+                " (SELECT id FROM facility WHERE pref_cd = ? AND kikan_cd = ? AND address != ?)",
+                [(p, k, a) for p, k, _, a, _, _ in rows],
+            )
+            self._conn.executemany(
+                "UPDATE facility SET lat = CASE WHEN address = ? THEN lat END,"
+                " lon = CASE WHEN address = ? THEN lon END,"
+                " geocoded_at = CASE WHEN address = ? THEN geocoded_at END,"
+                " name = ?, address = ?, href = ?, listed_at = ? WHERE pref_cd = ? AND kikan_cd = ?",
+                [(a, a, a, n, a, h, t, p, k) for p, k, n, a, h, t in rows],
+            )
+        return added
+
+    def pending_details(self, pref_cd: str, refresh_s: float = REGISTRY_REFRESH_S) -> List[PharmacyCandidate]:
+        """詳細が未取得・取得失敗・refresh_s より古い医療機関"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT pref_cd, kikan_cd, name, address, href FROM facility WHERE pref_cd = ?"
+                " AND (detail_status IN ('pending', 'error') OR fetched_at < ?) ORDER BY kikan_cd",
+                (pref_cd, time.time() - refresh_s),
+            ).fetchall()
+        return [PharmacyCandidate(name=n, address=a, href=h, pref_cd=p, kikan_cd=k)
+                for p, k, n, a, h in rows]
+
+    def record_detail(self, cand: PharmacyCandidate, detail: Optional[Dict], status: str) -> None:
         """
-        CalibrationPoint リストからローカル補正係数 α1, α2 と最適ブレンド w* を計算。
-        CalibrationEngine.calc_stats() と同一ロジック。
+        詳細ページの取得結果（MHLWScraper.fetch_clinic_detail の dict。status の意味は
+        PharmacyRegistry.record_detail と同じ）。
+        診療科は名称から判定し、判定できなければ診療科目欄の先頭の科を使う。
         """
-        return CalibrationEngine.calc_stats(points)
+        if status != "ok" or detail is None:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "UPDATE facility SET detail_status = ?, fetched_at = ?"
+                    " WHERE pref_cd = ? AND kikan_cd = ?",
+                    (status if status != "ok" else "error", time.time(), cand.pref_cd, cand.kikan_cd),
+                )
+            return
+        specialty = detect_specialty_from_name(cand.name)
+        if specialty == "不明/その他" and detail.get("departments"):
+            specialty = detect_specialty_from_name(detail["departments"])
+        is_hospital = detail.get("is_hospital")
+        fac_type = _guess_facility_type(cand.name) if is_hospital is None else (
+            "hospital" if is_hospital else "clinic")
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE facility SET facility_type = ?, specialty = ?, departments = ?,"
+                " daily_outpatients = ?, outpatient_note = ?, detail_status = 'ok', fetched_at = ?"
+                " WHERE pref_cd = ? AND kikan_cd = ?",
+                (fac_type, specialty, detail.get("departments") or "", detail.get("daily_outpatients"),
+                 detail.get("outpatient_note") or "", time.time(), cand.pref_cd, cand.kikan_cd),
+            )
 
-    # ── Step 4: ローカル校正の適用 ──────────────────────────────────────
+    def pending_geocodes(self, pref_cd: str, refresh_s: float = REGISTRY_REFRESH_S) -> List[PharmacyCandidate]:
+        """座標が未付与の医療機関（座標が得られなかったものは refresh_s 経過後に再試行）"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT pref_cd, kikan_cd, name, address, href FROM facility WHERE pref_cd = ?"
+                " AND address != '' AND (geocoded_at IS NULL OR (lat IS NULL AND geocoded_at < ?))"
+                " ORDER BY kikan_cd",
+                (pref_cd, time.time() - refresh_s),
+            ).fetchall()
+        return [PharmacyCandidate(name=n, address=a, href=h, pref_cd=p, kikan_cd=k)
+                for p, k, n, a, h in rows]
+
+    def record_coords(self, cand: PharmacyCandidate, lat: Optional[float], lon: Optional[float]) -> None:
+        """住所のジオコーディング結果（lat=None は座標なしとして記録）と空間索引の更新"""
+        has = lat is not None and lon is not None
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT id FROM facility WHERE pref_cd = ? AND kikan_cd = ?",
+                (cand.pref_cd, cand.kikan_cd),
+            ).fetchone()
+            if row is None:
+                return
+            self._conn.execute(
+                "UPDATE facility SET lat = ?, lon = ?, geocoded_at = ? WHERE id = ?",
+                (lat if has else None, lon if has else None, time.time(), row[0]),
+            )
+            if has:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO facility_rtree VALUES (?, ?, ?, ?, ?)",
+                    (row[0], lat, lat, lon, lon),
+                )
+            else:
+                self._conn.execute("DELETE FROM facility_rtree WHERE id = ?", (row[0],))
 
-    @staticmethod
-    def apply_local_correction(
-        m1_rx: int,
-        m2_rx: int,
-        density: int,
-        stats: "CalibrationStats",
-    ) -> Tuple[int, str]:
+    def within(
+        self, lat_min: float, lat_max: float, lon_min: float, lon_max: float,
+    ) -> List[Tuple[PharmacyCandidate, Dict, float, float]]:
         """
-        ローカル補正係数を新規薬局の予測に適用する。
-        CalibrationEngine.apply_correction() と同一ロジック。
+        座標が範囲内の医療機関（(候補, 台帳の項目, lat, lon) のリスト。都道府県をまたいでもよい）。
+        台帳の項目: facility_type / specialty / daily_outpatients（未記載・詳細未取得は None）/ outpatient_note
         """
-        return CalibrationEngine.apply_correction(m1_rx, m2_rx, density, stats)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT f.pref_cd, f.kikan_cd, f.name, f.address, f.href, f.facility_type, f.specialty,"
+                " f.daily_outpatients, f.outpatient_note, f.lat, f.lon FROM facility_rtree r"
+                " JOIN facility f ON f.id = r.id"
+                " WHERE r.min_lat >= ? AND r.max_lat <= ? AND r.min_lon >= ? AND r.max_lon <= ?",
+                (lat_min, lat_max, lon_min, lon_max),
+            ).fetchall()
+        return [(PharmacyCandidate(name=n, address=a, href=h, pref_cd=p, kikan_cd=k),
+                 {"facility_type": ft, "specialty": sp, "daily_outpatients": op, "outpatient_note": note},
+                 la, lo)
+                for p, k, n, a, h, ft, sp, op, note, la, lo in rows]
+
+    def within_radius(
+        self, lat: float, lon: float, radius_m: float,
+    ) -> List[Tuple[PharmacyCandidate, Dict, float, float]]:
+        """中心から radius_m 以内の医療機関（R*Tree で外接矩形を引いてから距離で絞る。近い順）"""
+        s, w, n, e = _circle_bbox(lat, lon, radius_m)
+        hits = [(haversine_distance(lat, lon, rec[2], rec[3]), rec) for rec in self.within(s, n, w, e)]
+        return [rec for dist, rec in sorted(hits, key=lambda h: h[0]) if dist <= radius_m]
+
+    # ── クロール進捗 ──────────────────────────────────────────────────────
+
+    def counts(self, pref_cd: str) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT detail_status, count(*), count(daily_outpatients), count(lat) FROM facility"
+                " WHERE pref_cd = ? GROUP BY detail_status",
+                (pref_cd,),
+            ).fetchall()
+        c = {"total": 0, "ok": 0, "pending": 0, "error": 0, "gone": 0, "with_outpatients": 0, "with_coords": 0}
+        for status, n, n_op, n_geo in rows:
+            c[status] = n
+            c["total"] += n
+            c["with_outpatients"] += n_op
+            c["with_coords"] += n_geo
+        return c
+
+    def summary(self, pref_cd: str) -> str:
+        c = self.counts(pref_cd)
+        phase = self._phase_label(pref_cd)
+        return (f"{phase}: 医療機関 {c['total']:,}件（詳細取得済 {c['ok']:,} / 未取得 {c['pending']:,}"
+                f" / 失敗 {c['error']:,} / 取得不能 {c['gone']:,}・外来患者数あり {c['with_outpatients']:,}件"
+                f"・座標あり {c['with_coords']:,}件）")
+
+
+@st.cache_resource
+def get_medical_registry() -> MedicalRegistry:
+    """プロセス共通の MedicalRegistry"""
+    return MedicalRegistry()
+
+
+class MedicalRegistryCrawler(RegistryCrawler):
+    """
+    v4.5: 都道府県内の全医療機関を MHLW から取得して MedicalRegistry に書き込むクローラー。
+    一覧・詳細・座標の3段階と再開の仕組みは RegistryCrawler と同じで、
+    検索種別（SJK=1: 医療機関）と詳細ページの解析（get_clinic_detail）だけが異なる。
+    """
+
+    SJK = "1"   # 検索種別（1: 医療機関）
+
+    def _default_registry(self) -> MedicalRegistry:
+        return get_medical_registry()
+
+    def _fetch_detail(self, cand: PharmacyCandidate) -> Tuple[Optional[Dict], str]:
+        detail, status = self.scraper.fetch_clinic_detail(cand)
+        return detail, self._detail_status(detail, status)
+
+
+def enrich_medical_outpatients(
+    facilities: List[NearbyFacility],
+    log: List[str],
+    registry: Optional[MedicalRegistry] = None,
+) -> int:
+    """
+    v4.5: OSM の医療機関を医療機関台帳と照合し、1日平均外来患者数の記載がある施設に
+    実数（daily_outpatients / mhlw_annual_outpatients）を付与する。付与件数を返す。
+    実数を持つ施設は apply_clinic_congestion_factor の補正対象（外来数未確認）から外れる。
+    診療科が「不明/その他」の施設は台帳の診療科で補う。ユーザー手動入力施設は対象外。
+    """
+    targets = [f for f in facilities if not f.is_manual and f.source == "osm"]
+    if not targets:
+        return 0
+    registry = registry or get_medical_registry()
+    pad_lat = REGISTRY_MATCH_RADIUS_M / 111_000
+    pad_lon = pad_lat / max(0.1, math.cos(math.radians(targets[0].lat)))
+    records = registry.within(
+        min(f.lat for f in targets) - pad_lat, max(f.lat for f in targets) + pad_lat,
+        min(f.lon for f in targets) - pad_lon, max(f.lon for f in targets) + pad_lon,
+    )
+    if not records:
+        return 0
+    matched = match_registry_facilities(targets, records)
+    filled = 0
+    for i, j in sorted(matched.items()):
+        fac, (cand, info, _, _) = targets[i], records[j]
+        if fac.specialty == "不明/その他" and info["specialty"] != "不明/その他":
+            fac.specialty = info["specialty"]
+        if info["daily_outpatients"]:
+            fac.daily_outpatients = info["daily_outpatients"]
+            fac.mhlw_annual_outpatients = info["daily_outpatients"] * NATIONAL_STATS["working_days"]
+            log.append(f"  [医療機関台帳] {fac.name} → {cand.name}: {fac.daily_outpatients}人/日")
+            filled += 1
+    log.append(f"[医療機関台帳] 照合 {len(matched)}/{len(targets)}件（外来患者数の実数 {filled}件）")
+    return filled
+
+
+def _supplement_from_registry(
+    registry: MedicalRegistry,
+    pharmacy_lat: float,
+    pharmacy_lon: float,
+    existing_osm: List[NearbyFacility],
+    search_radius_m: int,
+    dedup_threshold_m: float,
+) -> Tuple[List[NearbyFacility], List[str]]:
+    """
+    v4.5: クロール完了済みの都道府県の MHLW 補填（通信なし）。
+    半径内の台帳施設から、OSM施設と dedup_threshold_m 以内または名称で照合できたものを除いて返す。
+    外来患者数の記載がある施設は実数（mhlw_annual_outpatients も設定）、無ければ従来のデフォルト値。
+    """
+    log: List[str] = []
+    records = registry.within_radius(pharmacy_lat, pharmacy_lon, search_radius_m)
+    log.append(f"[MHLW補填] 医療機関台帳: 半径{search_radius_m}m内 {len(records)}件")
+    matched = set(match_registry_facilities(existing_osm, records).values()) if existing_osm else set()
+    osm_index = GridIndex.of(existing_osm, cell_m=dedup_threshold_m)
+    new_facilities: List[NearbyFacility] = []
+    dup_count = 0
+    for j, (cand, info, lat, lon) in enumerate(records):
+        dist = haversine_distance(pharmacy_lat, pharmacy_lon, lat, lon)
+        if j in matched or osm_index.within(lat, lon, dedup_threshold_m):
+            dup_count += 1
+            continue
+        daily = info["daily_outpatients"]
+        fac_type = info["facility_type"]
+        new_facilities.append(NearbyFacility(
+            name=cand.name,
+            facility_type=fac_type,
+            lat=lat,
+            lon=lon,
+            distance_m=int(dist),
+            specialty=info["specialty"],
+            daily_outpatients=daily or _default_supplement_outpatients(fac_type, info["specialty"]),
+            has_inhouse_pharmacy=(fac_type == "hospital"),
+            mhlw_annual_outpatients=daily * NATIONAL_STATS["working_days"] if daily else None,
+            is_manual=True,
+            source="mhlw",
+        ))
+    log.append(f"[MHLW補填] OSM重複: {dup_count}件 / 新規追加: {len(new_facilities)}件")
+    for fac in new_facilities:
+        basis = "実数" if fac.mhlw_annual_outpatients else "推計"
+        log.append(
+            f"  ＋ {fac.name}（診療科: {fac.specialty}、"
+            f"{fac.distance_m}m、{basis}{fac.daily_outpatients}人/日）"
+        )
+    return new_facilities, log
 
 
 # ---------------------------------------------------------------------------
@@ -2110,8 +6165,19 @@ def apply_clinic_congestion_factor(
 # 5. 方法① 近隣医療機関アプローチ
 # ---------------------------------------------------------------------------
 
+# v4.5: 方法①の NumPy エンジンで一度に作る距離行列の上限要素数（超える分は施設を分割して計算）
+M1_NUMPY_BLOCK_CELLS: int = 1_000_000
+
+
 class Method1Predictor:
     OUTPATIENT_RX_RATE = NATIONAL_STATS["outpatient_rx_rate"]
+    # v4.5: シェア計算エンジン（"numpy": 施設×競合薬局の距離行列から一括計算 / "python": 施設ごとのループ）
+    ENGINE = "numpy" if np is not None else "python"
+
+    def __init__(self, engine: Optional[str] = None):
+        self.engine = engine or self.ENGINE
+        if self.engine == "numpy" and np is None:
+            self.engine = "python"
 
     def predict(
         self,
@@ -2120,8 +6186,47 @@ class Method1Predictor:
         medical_facilities: List[NearbyFacility],
         competing_pharmacies: List[NearbyFacility],
         mode_label: str = "方法①: 近隣医療機関アプローチ",
+        geometry: Optional[AreaGeometry] = None,   # v4.5: 分析の幾何コンテキスト（距離・索引の使い回し）
+    ) -> PredictionResult:
+        targets = [fac for fac in medical_facilities if fac.daily_outpatients != 0]
+        # v3.2: has_gate_pharmacy フラグによる固定×0.4 廃止。
+        # 既存門前薬局の有無は _calc_share() 内で競合薬局の実際の立地から動的に判定。
+        shares = self.calc_shares(targets, pharmacy_lat, pharmacy_lon, competing_pharmacies, geometry)
+        rows = [self.facility_flow(fac, share, share_reason) for fac, (share, share_reason) in zip(targets, shares)]
+        total_daily = 0.0
+        for _, _, flow in rows:
+            total_daily += flow
+        return self.build_result(mode_label, len(medical_facilities), rows, total_daily)
+
+    def facility_flow(self, fac: NearbyFacility, share: float, share_reason: str) -> Tuple[Dict, str, float]:
+        """v4.5: 1施設の寄与 → (内訳行, 説明行, 当薬局流入/日)"""
+        rx_rate, _ = SPECIALTY_RX_RATES.get(fac.specialty, SPECIALTY_RX_RATES["不明/その他"])
+        daily_rx = fac.daily_outpatients * rx_rate * self.OUTPATIENT_RX_RATE
+        if fac.has_inhouse_pharmacy:
+            daily_rx *= 0.6
+        flow = daily_rx * share
+        row = {
+            "施設名": fac.name,
+            "タイプ": "病院" if fac.facility_type == "hospital" else "クリニック",
+            "距離": f"{fac.distance_m:.0f}m",
+            "診療科": fac.specialty,
+            "外来患者/日": fac.daily_outpatients,
+            "処方箋発行率": f"{rx_rate:.0%}",
+            "院外処方箋/日": round(daily_rx),
+            "当薬局シェア": f"{share:.1%}",
+            "シェア根拠": share_reason,
+            "当薬局流入/日": round(flow),
+        }
+        line = (
+            f"**{fac.name}** ({fac.distance_m:.0f}m): "
+            f"{fac.daily_outpatients}人/日 × {rx_rate:.0%} × 79.0% × {share:.0%} = {flow:.1f}枚/日"
+        )
+        return row, line, flow
+
+    def build_result(
+        self, mode_label: str, n_facilities: int, rows: List[Tuple[Dict, str, float]], total_daily: float,
     ) -> PredictionResult:
-        breakdown, total_daily = [], 0.0
+        """v4.5: 施設ごとの寄与（facility_flow）と合計流入/日から PredictionResult を組み立てる"""
         methodology = [
             f"### {mode_label} ロジック",
             "",
@@ -2132,39 +6237,11 @@ class Method1Predictor:
             f"残り{1-GATE_PHARMACY_CAPTURE_RATE:.0%}を当薬局と非門前競合でHuff按分（二重割引なし）。",
             "既存門前薬局なし時は距離帯別ベース（≤50m:75%/≤150m:50%/≤300m:30%/300m超:15%）×Huff按分。",
             "",
-            f"**対象医療施設**: {len(medical_facilities)}件",
+            f"**対象医療施設**: {n_facilities}件",
             "",
-        ]
-        for fac in medical_facilities:
-            if fac.daily_outpatients == 0:
-                continue
-            rx_rate, _ = SPECIALTY_RX_RATES.get(fac.specialty, SPECIALTY_RX_RATES["不明/その他"])
-            daily_rx = fac.daily_outpatients * rx_rate * self.OUTPATIENT_RX_RATE
-            if fac.has_inhouse_pharmacy:
-                daily_rx *= 0.6
-            # v3.2: has_gate_pharmacy フラグによる固定×0.4 廃止。
-            # 既存門前薬局の有無は _calc_share() 内で競合薬局の実際の立地から動的に判定。
-            share, share_reason = self._calc_share(fac, pharmacy_lat, pharmacy_lon, competing_pharmacies)
-            flow = daily_rx * share
-            breakdown.append({
-                "施設名": fac.name,
-                "タイプ": "病院" if fac.facility_type == "hospital" else "クリニック",
-                "距離": f"{fac.distance_m:.0f}m",
-                "診療科": fac.specialty,
-                "外来患者/日": fac.daily_outpatients,
-                "処方箋発行率": f"{rx_rate:.0%}",
-                "院外処方箋/日": round(daily_rx),
-                "当薬局シェア": f"{share:.1%}",
-                "シェア根拠": share_reason,
-                "当薬局流入/日": round(flow),
-            })
-            total_daily += flow
-            methodology.append(
-                f"**{fac.name}** ({fac.distance_m:.0f}m): "
-                f"{fac.daily_outpatients}人/日 × {rx_rate:.0%} × 79.0% × {share:.0%} = {flow:.1f}枚/日"
-            )
+        ] + [line for _, line, _ in rows]
         annual = int(total_daily * NATIONAL_STATS["working_days"])
-        if not medical_facilities:
+        if not n_facilities:
             methodology.append("⚠ 近隣に医療施設なし → 全国中央値を使用")
             annual = NATIONAL_STATS["median_estimate"]
         methodology += [
@@ -2175,9 +6252,9 @@ class Method1Predictor:
             annual_rx=annual,
             min_val=int(annual * 0.6),
             max_val=int(annual * 1.8),
-            confidence="medium" if medical_facilities else "low",
+            confidence="medium" if n_facilities else "low",
             daily_rx=int(total_daily),
-            breakdown=breakdown,
+            breakdown=[row for row, _, _ in rows],
             methodology=methodology,
             references=[
                 {"name": "厚生労働省「受療行動調査」2020年",
@@ -2192,7 +6269,10 @@ class Method1Predictor:
             ],
         )
 
-    def _calc_share(self, fac, ph_lat, ph_lon, competitors) -> Tuple[float, str]:
+    def _calc_share(
+        self, fac, ph_lat, ph_lon, competitors, index: Optional[GridIndex] = None,
+        geometry: Optional[AreaGeometry] = None,
+    ) -> Tuple[float, str]:
         """
         医療機関ごとの当薬局集客シェアを推計する（v3.2: 残余シェアモデルに変更）
 
@@ -2217,14 +6297,20 @@ class Method1Predictor:
             当薬局Huff比: (1/150) / (1/150 + 1/200) = 57%
             当薬局シェア: 30% × 57% ≒ 17%  → 18Rx/日 × 305日 ≒ 5,500枚/年
           ← 当薬局14,305枚/年全国平均のうち一施設分として妥当な水準
+
+        ■ v4.5: 競合薬局との距離は空間索引 index（GridIndex、省略時はここで作成）で
+          300m 以内の分だけ求める（calc_shares は全施設で1つの索引を共有）。
+          geometry（同じ地点の AreaGeometry）があれば地点距離もそこから引く。
         """
-        dist = OverpassSearcher._haversine(fac.lat, fac.lon, ph_lat, ph_lon)
+        if geometry is not None and (geometry.site_lat, geometry.site_lon) == (ph_lat, ph_lon):
+            dist = geometry.site_distance(fac.lat, fac.lon)
+        else:
+            dist = OverpassSearcher._haversine(fac.lat, fac.lon, ph_lat, ph_lon)
+        index = index or GridIndex.of(competitors, cell_m=300.0)
+        near = [(competitors[j], d) for j, d in index.within(fac.lat, fac.lon, 300)]
 
         # ── [A] 既存門前薬局チェック: 医療機関から50m以内に競合薬局があるか ──
-        gate_comps = [
-            p for p in competitors
-            if OverpassSearcher._haversine(fac.lat, fac.lon, p.lat, p.lon) <= 50
-        ]
+        gate_comps = [p for p, d in near if d <= 50]
 
         if gate_comps:
             # ── [B] 既存門前薬局あり: 残余シェアモデル ────────────────────
@@ -2236,17 +6322,10 @@ class Method1Predictor:
             available = 1.0 - gate_capture   # 残余シェア（当薬局+非門前競合で分配）
 
             # 非門前競合薬局のみを対象にHuff按分（300m以内）
-            non_gate_ids = {id(p) for p in gate_comps}
-            non_gate_comps = [
-                p for p in competitors
-                if id(p) not in non_gate_ids
-                and OverpassSearcher._haversine(fac.lat, fac.lon, p.lat, p.lon) <= 300
-            ]
+            non_gate = [(p, d) for p, d in near if d > 50]
+            non_gate_comps = [p for p, _ in non_gate]
             tw = 1.0 / max(dist, 10)
-            cws = [
-                1.0 / max(OverpassSearcher._haversine(fac.lat, fac.lon, p.lat, p.lon), 10)
-                for p in non_gate_comps
-            ]
+            cws = [1.0 / max(d, 10) for _, d in non_gate]
             # Huff比: 競合がいなければ残余の100%を取得
             huff_ratio = tw / (tw + sum(cws)) if cws else 1.0
             adj = available * huff_ratio
@@ -2268,16 +6347,10 @@ class Method1Predictor:
             else:
                 base, reason = 0.15, "300m超（自転車圏）"
 
-            near_comps = [
-                p for p in competitors
-                if OverpassSearcher._haversine(fac.lat, fac.lon, p.lat, p.lon) < 300
-            ]
+            near_comps = [(p, d) for p, d in near if d < 300]
             if near_comps:
                 tw = 1.0 / max(dist, 10)
-                cws = [
-                    1.0 / max(OverpassSearcher._haversine(fac.lat, fac.lon, p.lat, p.lon), 10)
-                    for p in near_comps
-                ]
+                cws = [1.0 / max(d, 10) for _, d in near_comps]
                 adj = base * (tw / (tw + sum(cws)))
                 reason += f"（競合{len(near_comps)}件で按分）"
             else:
@@ -2286,6 +6359,131 @@ class Method1Predictor:
 
         return min(adj, 0.90), reason
 
+    def calc_shares(
+        self, facilities: List[NearbyFacility], ph_lat: float, ph_lon: float,
+        competitors: List[NearbyFacility], geometry: Optional[AreaGeometry] = None,
+    ) -> List[Tuple[float, str]]:
+        """
+        v4.5: 各医療機関の (当薬局シェア, 根拠) を engine に応じて計算（結果は _calc_share と同じ）。
+        空間索引・距離行列は geometry（地点が異なれば新規）に置き、再計算時に使い回す。
+        """
+        geometry = AreaGeometry.for_site(geometry, ph_lat, ph_lon)
+        if self.engine != "numpy" or not facilities:
+            index = geometry.index(competitors, 300.0)
+            return [self._calc_share(fac, ph_lat, ph_lon, competitors, index, geometry) for fac in facilities]
+        step = max(1, M1_NUMPY_BLOCK_CELLS // max(1, len(competitors)))
+        shares: List[Tuple[float, str]] = []
+        for i in range(0, len(facilities), step):
+            shares += self._calc_shares_numpy(facilities[i:i + step], ph_lat, ph_lon, competitors, geometry)
+        return shares
+
+    @staticmethod
+    def _calc_shares_numpy(
+        facilities: List[NearbyFacility], ph_lat: float, ph_lon: float,
+        competitors: List[NearbyFacility], geometry: AreaGeometry,
+    ) -> List[Tuple[float, str]]:
+        """
+        v4.5: _calc_share の NumPy 版。施設×競合薬局の距離行列を一度だけ作り（geometry が保持）、
+        門前判定（≤50m）・Huff 按分（≤300m / <300m）・距離帯別ベース・上限0.90 を配列演算で行う。
+        根拠の文字列だけは施設ごとに組み立てる。
+        """
+        f_lat = np.array([f.lat for f in facilities], dtype=float)
+        f_lon = np.array([f.lon for f in facilities], dtype=float)
+        dist = _haversine_array(f_lat, f_lon, ph_lat, ph_lon)                          # (F,)
+        comp_d = geometry.distance_matrix(facilities, competitors)                    # (F, P)
+        comp_w = 1.0 / np.maximum(comp_d, 10)
+        tw = 1.0 / np.maximum(dist, 10)
+
+        # [A] 既存門前薬局（医療機関から50m以内の競合薬局）
+        gate = comp_d <= 50
+        n_gate = gate.sum(axis=1)
+        # [B] 既存門前薬局あり: 残余シェアを非門前競合（300m以内）と Huff 按分
+        gate_capture = np.minimum(GATE_PHARMACY_CAPTURE_RATE + (n_gate - 1) * 0.05, 0.85)
+        available = 1.0 - gate_capture
+        non_gate = ~gate & (comp_d <= 300)
+        n_non_gate = non_gate.sum(axis=1)
+        huff_b = np.where(n_non_gate > 0, tw / (tw + np.where(non_gate, comp_w, 0.0).sum(axis=1)), 1.0)
+        # [C] 既存門前薬局なし: 距離帯別ベース × Huff 按分（300m未満の競合）
+        base = np.select([dist <= 50, dist <= 150, dist <= 300], [0.75, 0.50, 0.30], 0.15)
+        near = comp_d < 300
+        n_near = near.sum(axis=1)
+        adj_c = np.where(n_near > 0, base * (tw / (tw + np.where(near, comp_w, 0.0).sum(axis=1))), base)
+        share = np.minimum(np.where(n_gate > 0, available * huff_b, adj_c), 0.90)
+
+        band_reasons = {0.75: "50m以内（実質門前）", 0.50: "150m以内（近接立地）",
+                        0.30: "300m以内（徒歩圏）", 0.15: "300m超（自転車圏）"}
+        out: List[Tuple[float, str]] = []
+        for i in range(len(facilities)):
+            if n_gate[i]:
+                gate_idx = np.flatnonzero(gate[i])
+                gate_names = "・".join(competitors[j].name[:10] for j in gate_idx[:2])
+                comp_note = (f"（非門前競合{int(n_non_gate[i])}件でHuff按分）" if n_non_gate[i]
+                             else "（非門前競合なし）")
+                reason = (
+                    f"既存門前薬局あり（{gate_names} 等{int(n_gate[i])}件: 推定{float(gate_capture[i]):.0%}捕捉）"
+                    f" → 残{float(available[i]):.0%}を{comp_note}"
+                )
+            else:
+                reason = band_reasons[float(base[i])]
+                reason += f"（競合{int(n_near[i])}件で按分）" if n_near[i] else "（近隣競合なし）"
+            out.append((float(share[i]), reason))
+        return out
+
+
+def _synthetic_m1_scenario(
+    n_facilities: int, n_pharmacies: int, seed: int = 0, radius_m: float = 1_500.0,
+) -> Tuple[float, float, List[NearbyFacility], List[NearbyFacility]]:
+    """v4.5: ベンチマーク用の合成データ（中心から radius_m 以内に施設・競合薬局を一様に配置）"""
+    rng = random.Random(seed)
+    lat0, lon0 = 35.6812, 139.7671
+    specialties = list(SPECIALTY_RX_RATES)
+
+    def place(i: int, kind: str) -> NearbyFacility:
+        r, t = radius_m * math.sqrt(rng.random()), rng.uniform(0, 2 * math.pi)
+        lat = lat0 + r * math.sin(t) / 111_000
+        lon = lon0 + r * math.cos(t) / (111_000 * math.cos(math.radians(lat0)))
+        return NearbyFacility(
+            name=f"{kind}{i}", facility_type="clinic" if kind == "医療機関" else "pharmacy",
+            lat=lat, lon=lon, distance_m=haversine_distance(lat0, lon0, lat, lon),
+            specialty=rng.choice(specialties), daily_outpatients=rng.randint(10, 150),
+            has_inhouse_pharmacy=rng.random() < 0.05,
+        )
+
+    medical = [place(i, "医療機関") for i in range(n_facilities)]
+    pharmacies = [place(i, "薬局") for i in range(n_pharmacies)]
+    return lat0, lon0, medical, pharmacies
+
+
+def benchmark_m1_engines(sizes: Iterable[int] = (50, 500, 5_000), repeat: int = 3) -> List[Dict]:
+    """
+    v4.5: 方法①の python / numpy エンジンを合成データで計測し、結果の一致を確かめる。
+    競合薬局は施設数の 1/5（最低5件）。各規模について両エンジンの1回あたり時間、
+    annual_rx の差、シェア・根拠が一致しない施設数（シェアは相対誤差 1e-9 まで許容）を返す。
+    """
+    results: List[Dict] = []
+    for n in sizes:
+        lat, lon, medical, pharmacies = _synthetic_m1_scenario(n, max(5, n // 5), seed=n)
+        row: Dict = {"facilities": n, "pharmacies": len(pharmacies)}
+        outputs = {}
+        for engine in ("python", "numpy"):
+            if engine == "numpy" and np is None:
+                continue
+            predictor = Method1Predictor(engine=engine)
+            t0 = time.perf_counter()
+            for _ in range(max(1, repeat)):
+                res = predictor.predict(lat, lon, medical, pharmacies)
+            row[f"{engine}_ms"] = (time.perf_counter() - t0) * 1000 / max(1, repeat)
+            outputs[engine] = (res, predictor.calc_shares(medical, lat, lon, pharmacies))
+        if "numpy" in outputs:
+            (res_py, sh_py), (res_np, sh_np) = outputs["python"], outputs["numpy"]
+            row["annual_diff"] = abs(res_py.annual_rx - res_np.annual_rx)
+            row["mismatches"] = sum(
+                1 for (a, ra), (b, rb) in zip(sh_py, sh_np)
+                if ra != rb or abs(a - b) > 1e-9 * max(abs(a), 1e-12)
+            )
+        results.append(row)
+    return results
+
 
 # ---------------------------------------------------------------------------
 # 6. 方法② 商圏人口動態アプローチ
@@ -2303,6 +6501,8 @@ class Method2Predictor:
         radius_reason: str = "",
         nearby_medical: Optional[List[NearbyFacility]] = None,  # v3.2: 門前的競合判定用
         pharmacy_type: str = PHARMACY_TYPE_NORMAL,  # v4.4: SM業態補正用
+        geometry: Optional[AreaGeometry] = None,    # v4.5: 分析の幾何コンテキスト（索引の使い回し）
+        gate_comp_names: Optional[set] = None,      # v4.5: 門前的競合の集合（ContributionLedger で差分更新済み）
     ) -> PredictionResult:
         area_km2 = math.pi * (radius_m / 1000) ** 2
         total_pop = int(area_km2 * area_density)
@@ -2332,7 +6532,7 @@ class Method2Predictor:
         # v4.4: pharmacy_type を渡してSM業態の市場シェア上限を調整
         share, share_reason = self._market_share(
             pharmacy_lat, pharmacy_lon, competing_pharmacies, nearby_medical,
-            pharmacy_type=pharmacy_type,
+            pharmacy_type=pharmacy_type, geometry=geometry, gate_comp_names=gate_comp_names,
         )
         # v4.4: pharmacy_type を渡してSM業態の流入係数を調整
         inflow_coeff, inflow_reason = self._inflow_coefficient(
@@ -2419,6 +6619,8 @@ class Method2Predictor:
         competitors: List[NearbyFacility],
         nearby_medical: Optional[List[NearbyFacility]] = None,
         pharmacy_type: str = PHARMACY_TYPE_NORMAL,  # v4.4追加
+        geometry: Optional[AreaGeometry] = None,    # v4.5追加
+        gate_comp_names: Optional[set] = None,      # v4.5追加: 指定時は門前的競合の判定を省略
     ) -> Tuple[float, str]:
         """
         距離帯別「実効競合数モデル」による市場シェア推計 (v3.2改善)
@@ -2451,12 +6653,9 @@ class Method2Predictor:
             return share_cap, no_comp_reason
 
         # 門前的競合の特定: 医療機関から100m以内にいる競合薬局
-        gate_comp_names: set = set()
-        if nearby_medical:
-            for med in nearby_medical:
-                for p in competitors:
-                    if OverpassSearcher._haversine(med.lat, med.lon, p.lat, p.lon) <= 100:
-                        gate_comp_names.add(p.name)
+        # v4.5: 医療機関×競合薬局の総当たり → 競合薬局の空間索引で100m以内だけを引く
+        if gate_comp_names is None:
+            gate_comp_names = self.gate_competitor_names(lat, lon, competitors, nearby_medical, geometry)
 
         # 実効競合数の計算（門前的競合は重みを強化）
         effective_n = 0.0
@@ -2496,6 +6695,20 @@ class Method2Predictor:
         reason = f"競合{len(competitors)}件 ({detail}) → シェア{share:.1%}{cap_note}"
         return share, reason
 
+    @staticmethod
+    def gate_competitor_names(
+        lat: float, lon: float, competitors: List[NearbyFacility],
+        nearby_medical: Optional[List[NearbyFacility]], geometry: Optional[AreaGeometry] = None,
+    ) -> set:
+        """v3.2: 門前的競合（いずれかの医療機関から GATE_COMPETITOR_RADIUS_M 以内の競合薬局）の名称集合"""
+        names: set = set()
+        if nearby_medical and competitors:
+            index = AreaGeometry.for_site(geometry, lat, lon).index(competitors, GATE_COMPETITOR_RADIUS_M)
+            for med in nearby_medical:
+                names.update(competitors[j].name
+                             for j, _ in index.within(med.lat, med.lon, GATE_COMPETITOR_RADIUS_M))
+        return names
+
     @staticmethod
     def _inflow_coefficient(
         density: int,
@@ -2551,6 +6764,150 @@ class Method2Predictor:
         return base, note
 
 
+# ---------------------------------------------------------------------------
+# 6-b. v4.5: 施設別寄与の台帳（手動追加・MHLW補填の差分再計算）
+# ---------------------------------------------------------------------------
+
+class ContributionLedger:
+    """
+    v4.5: 既存薬局分析の施設別寄与の台帳（医療機関の増減を差分で方法①②に反映する）
+
+      方法①: 施設ごとの (内訳行, 説明行, 当薬局流入/日) と合計流入/日。
+              追加した施設のシェアだけを計算し、合計は追加・削除のたびに O(1) で増減
+      方法②: 門前的競合（医療機関から GATE_COMPETITOR_RADIUS_M 以内の競合薬局）の名称 → 参照している医療機関数。
+              追加・削除した施設の近傍の競合薬局だけ参照数を増減
+    施設は内容（座標・診療科・外来患者数など）をキーに持つので、値を変えた施設は
+    「旧内容の削除 + 新内容の追加」になる。地点が変わったら作り直す（matches()）。
+    競合薬局の開閉（what-if）は set_competitors() で、増減した薬局の近傍の施設だけ計算し直す。
+    """
+
+    def __init__(
+        self,
+        lat: float,
+        lon: float,
+        competitors: List[NearbyFacility],
+        geometry: Optional[AreaGeometry] = None,
+        predictor: Optional[Method1Predictor] = None,
+    ):
+        self.lat, self.lon = lat, lon
+        self.competitors = list(competitors)
+        self.geometry = AreaGeometry.for_site(geometry, lat, lon)
+        self.predictor = predictor or Method1Predictor()
+        self._competitor_key = self._competitors_key(self.competitors)
+        self._entries: Dict[Tuple, Tuple[NearbyFacility, Optional[Tuple[Dict, str, float]], frozenset]] = {}
+        self._order: List[Tuple] = []
+        self._gate_refs: Dict[str, int] = {}
+        self.total_daily = 0.0
+        self.n_computed = 0   # シェアを計算した施設数（累計）
+
+    @staticmethod
+    def _competitors_key(competitors: List[NearbyFacility]) -> Tuple:
+        return tuple((p.name, p.lat, p.lon, p.distance_m) for p in competitors)
+
+    @staticmethod
+    def facility_key(fac: NearbyFacility) -> Tuple:
+        """方法①②の結果に効く項目の組（同じ組なら同じ寄与）"""
+        return (fac.source, fac.is_manual, fac.name, fac.facility_type, fac.lat, fac.lon,
+                fac.distance_m, fac.specialty, fac.daily_outpatients, fac.has_inhouse_pharmacy)
+
+    def copy(self) -> "ContributionLedger":
+        """
+        台帳の複製（what-if で元の分析結果の台帳を書き換えないため）。
+        内訳行・施設は変更しないので共有し、幾何コンテキスト・predictor も共有する（距離計算なし）。
+        """
+        dup = copy.copy(self)
+        dup.competitors = list(self.competitors)
+        dup._entries = dict(self._entries)
+        dup._order = list(self._order)
+        dup._gate_refs = dict(self._gate_refs)
+        return dup
+
+    def matches(self, lat: float, lon: float, competitors: List[NearbyFacility]) -> bool:
+        return (self.lat, self.lon) == (lat, lon) and self._competitor_key == self._competitors_key(competitors)
+
+    def sync(self, facilities: List[NearbyFacility]) -> Tuple[int, int]:
+        """
+        台帳を facilities（方法①②に渡す医療機関リスト）に合わせる。
+        無くなった施設を削除し、新しい施設だけ寄与を計算する。(計算した施設数, 削除した施設数) を返す
+        """
+        keys: List[Tuple] = []
+        seen: Dict[Tuple, int] = {}
+        for fac in facilities:
+            base = self.facility_key(fac)
+            keys.append((base, seen.get(base, 0)))   # 同内容の施設が複数あれば出現順で区別
+            seen[base] = seen.get(base, 0) + 1
+        wanted = set(keys)
+        removed = [key for key in self._entries if key not in wanted]
+        for key in removed:
+            self._remove(key)
+        added = [(key, fac) for key, fac in zip(keys, facilities) if key not in self._entries]
+        self._add(added)
+        self._order = keys
+        return len(added), len(removed)
+
+    def _add(self, items: List[Tuple[Tuple, NearbyFacility]]) -> None:
+        targets = [fac for _, fac in items if fac.daily_outpatients != 0]
+        shares = iter(self.predictor.calc_shares(targets, self.lat, self.lon, self.competitors, self.geometry))
+        self.n_computed += len(targets)
+        index = self.geometry.index(self.competitors, GATE_COMPETITOR_RADIUS_M)
+        for key, fac in items:
+            flow_row = None
+            if fac.daily_outpatients != 0:
+                share, reason = next(shares)
+                flow_row = self.predictor.facility_flow(fac, share, reason)
+                self.total_daily += flow_row[2]
+            names = frozenset(self.competitors[j].name
+                              for j, _ in index.within(fac.lat, fac.lon, GATE_COMPETITOR_RADIUS_M))
+            for name in names:
+                self._gate_refs[name] = self._gate_refs.get(name, 0) + 1
+            self._entries[key] = (fac, flow_row, names)
+
+    def _remove(self, key: Tuple) -> None:
+        _, flow_row, names = self._entries.pop(key)
+        if flow_row is not None:
+            self.total_daily -= flow_row[2]
+        for name in names:
+            self._gate_refs[name] -= 1
+            if not self._gate_refs[name]:
+                del self._gate_refs[name]
+        if not self._entries:
+            self.total_daily = 0.0   # 浮動小数の端数を残さない
+
+    def set_competitors(self, competitors: List[NearbyFacility]) -> int:
+        """
+        競合薬局の集合を差し替える（what-if: 閉局・仮想出店）。増減した薬局から
+        方法①の按分半径（300m）・門前的競合の判定半径以内の施設だけ寄与を計算し直し、その施設数を返す。
+        """
+        old_count = Counter(self._competitor_key)
+        new_key = self._competitors_key(competitors)
+        new_count = Counter(new_key)
+        changed = list(((old_count - new_count) + (new_count - old_count)).elements())
+        self.competitors = list(competitors)
+        self._competitor_key = new_key
+        if not changed or not self._order:
+            return 0
+        radius = max(300.0, GATE_COMPETITOR_RADIUS_M) + 1.0   # 距離の端数で境界の施設を取りこぼさない余裕
+        facs = [self._entries[key][0] for key in self._order]
+        index = self.geometry.index(facs, radius)
+        hit = sorted({i for _, lat, lon, _ in changed for i, _ in index.within(lat, lon, radius)})
+        items = [(self._order[i], facs[i]) for i in hit]
+        for key, _ in items:
+            self._remove(key)
+        self._add(items)
+        return len(items)
+
+    def gate_names(self) -> set:
+        """方法②の門前的競合の名称集合（Method2Predictor.predict の gate_comp_names に渡す）"""
+        return set(self._gate_refs)
+
+    def result(self, mode_label: str = "方法①: 近隣医療機関アプローチ") -> PredictionResult:
+        """方法①の結果（sync() した施設の順）"""
+        rows = [self._entries[key][1] for key in self._order]
+        return self.predictor.build_result(
+            mode_label, len(self._order), [row for row in rows if row is not None], self.total_daily,
+        )
+
+
 # ---------------------------------------------------------------------------
 # 7. マップ生成
 # ---------------------------------------------------------------------------
@@ -2625,14 +6982,16 @@ def build_competitor_map(
         rx_text = (f"<b style='color:#c00'>処方箋: {ph.mhlw_annual_outpatients:,}枚/年</b>"
                    if ph.mhlw_annual_outpatients else "MHLW: データなし")
         popup_html = (
-            f"<b>💊 {ph.name}</b>{'（大手チェーン）' if is_chain else ''}<br>"
+            f"<b>💊 {ph.name}</b>{'（大手チェーン）' if is_chain else ''}"
+            f"{'（仮想出店）' if ph.is_manual else ''}<br>"
             f"距離: {ph.distance_m:.0f}m<br>{rx_text}"
         )
         folium.Marker(
             location=[ph.lat, ph.lon],
             popup=folium.Popup(popup_html, max_width=220),
             tooltip=f"💊 {ph.name} ({ph.distance_m:.0f}m)",
-            icon=folium.Icon(color="green", icon="shopping-cart", prefix="glyphicon"),
+            # v4.5: what-if の仮想出店は薄緑
+            icon=folium.Icon(color="lightgreen" if ph.is_manual else "green", icon="shopping-cart", prefix="glyphicon"),
         ).add_to(m)
     return m
 
@@ -2768,6 +7127,61 @@ def calc_implied_missing_facility(actual_rx: int, predicted_rx: int) -> Optional
     }
 
 
+# v4.5: 町丁目による事前除外の余裕幅（町丁目の広がりに加える、代表点・ジオコード結果の誤差分）
+TOWN_PREFILTER_MARGIN_M: float = 800.0
+
+
+def _base_town(town: str) -> str:
+    """町丁目名から丁目を除いた町名（"成増一丁目" → "成増"）"""
+    return re.sub(r"\d+丁目$", "", _normalize_address_key(town))
+
+
+def _prefilter_candidates_by_town(
+    gc: "GeocoderService",
+    cands: List["PharmacyCandidate"],
+    site_lat: float,
+    site_lon: float,
+    site_address: str,
+    limit_m: float,
+) -> Tuple[List["PharmacyCandidate"], str]:
+    """
+    v4.5: 町丁目のどの地点も limit_m より遠い候補（代表点までの距離 > limit_m + 町丁目の広がり）を
+    ジオコーディング前に除外し、残りを元の順（MHLW の検索順）で返す。
+
+    - 薬局と同じ町（丁目違いを含む）の候補は距離に関係なく残す
+      （薬局の町名は必要になった時点で逆ジオコーダーから1回だけ取得）
+    - 代表点・広がりが不明な町の候補は残す（従来どおりジオコーディングで判定）
+    """
+    site_base: Optional[str] = None
+
+    def in_site_town(cand_town: str) -> bool:
+        nonlocal site_base
+        if site_base is None:
+            site_town = gc.reverse_town(site_lat, site_lon) or parse_address(site_address).town
+            site_base = _base_town(site_town) if site_town else ""
+        return bool(site_base) and _base_town(cand_town) == site_base
+
+    kept: List["PharmacyCandidate"] = []
+    n_far = n_unknown = 0
+    for cand in cands:
+        area = gc.town_area(cand.address)
+        if area is None:
+            n_unknown += 1
+            kept.append(cand)
+            continue
+        c_lat, c_lon, extent = area
+        d = haversine_distance(site_lat, site_lon, c_lat, c_lon)
+        if d > limit_m + extent and not in_site_town(parse_address(cand.address).town):
+            n_far += 1
+            continue
+        kept.append(cand)
+    msg = (
+        f"町丁目プリフィルタ: {n_far}件を除外（町丁目全体が{limit_m:.0f}m超）"
+        f" / 町丁目不明 {n_unknown}件 / ジオコーディング対象 {len(kept)}件"
+    )
+    return kept, msg
+
+
 def fetch_mhlw_medical_supplement(
     pharmacy_lat: float,
     pharmacy_lon: float,
@@ -2784,10 +7198,13 @@ def fetch_mhlw_medical_supplement(
 
     処理フロー:
       1. MHLWScraper.search_medical_by_area() でエリア内の医療機関を一括取得
-      2. 各施設の住所をGSIジオコーダーで座標変換
+      1.5 v4.5: 町丁目重心が明らかに遠い候補を除外（_prefilter_candidates_by_town）
+      2. 各施設の住所をGSIジオコーダーで座標変換（v4.5: geocode_many で一括・並列）
       3. 薬局からの距離が search_radius_m 以内のもののみ保持
       4. OSM施設との重複チェック（dedup_threshold_m 以内 = 同一施設とみなしスキップ）
       5. 新規施設を NearbyFacility (source="mhlw") として返す
+    v4.5: 医療機関台帳（MedicalRegistry）のクロールが完了した都道府県では、1〜4 の代わりに
+    台帳の範囲検索で補填する（通信なし・外来患者数の記載があれば実数を使う）。
 
     Args:
         progress_bar: st.progress() オブジェクト（任意）
@@ -2797,6 +7214,15 @@ def fetch_mhlw_medical_supplement(
     Returns:
         (new_facilities, log_messages)
     """
+    registry = get_medical_registry()
+    if pref_code and registry.is_complete(pref_code):
+        new_facilities, log = _supplement_from_registry(
+            registry, pharmacy_lat, pharmacy_lon, existing_osm, search_radius_m, dedup_threshold_m,
+        )
+        if progress_bar:
+            progress_bar.progress(100, text="MHLW補填完了！")
+        return new_facilities, log
+
     log: List[str] = []
     gc = GeocoderService()
     scraper = MHLWScraper()
@@ -2813,24 +7239,33 @@ def fetch_mhlw_medical_supplement(
     cands = cands[:max_candidates]
     log.append(f"[MHLW補填] 処理対象: {len(cands)}件")
 
+    # ── Step 1.5 (v4.5): 町丁目プリフィルタ ──────────────────────────────
+    cands = [c for c in cands if c.address]
+    cands, pre_msg = _prefilter_candidates_by_town(
+        gc, cands, pharmacy_lat, pharmacy_lon, pharmacy_address,
+        search_radius_m + TOWN_PREFILTER_MARGIN_M,
+    )
+    log.append(f"[MHLW補填] {pre_msg}")
+
     # ── Step 2: ジオコーディング + 半径フィルタ ───────────────────────────
-    geocoded: List[Tuple["PharmacyCandidate", float, float, float]] = []
-    for i, cand in enumerate(cands):
+    in_radius: List[Tuple[int, float, float, float]] = []
+    results = gc.geocode_many([c.address for c in cands])
+    for done, (i, (lat, lon, _, _)) in enumerate(results, start=1):
         if progress_bar:
-            pct = 10 + int(i * 70 / len(cands))
+            pct = 10 + int(done * 70 / len(cands))
             progress_bar.progress(
                 pct,
-                text=f"ジオコーディング [{i+1}/{len(cands)}]: {cand.name[:22]}…",
+                text=f"ジオコーディング [{done}/{len(cands)}]: {cands[i].name[:22]}…",
             )
-        if not cand.address:
-            continue
-        lat, lon, _, _ = gc.geocode(cand.address)
         if lat is None or lon is None:
             continue
         dist = haversine_distance(pharmacy_lat, pharmacy_lon, lat, lon)
         if dist <= search_radius_m:
-            geocoded.append((cand, lat, lon, dist))
-        time.sleep(0.12)   # GSI APIのレート制限への配慮
+            in_radius.append((i, lat, lon, dist))
+    # 完了順 → MHLW の検索順に戻す
+    geocoded: List[Tuple["PharmacyCandidate", float, float, float]] = [
+        (cands[i], lat, lon, dist) for i, lat, lon, dist in sorted(in_radius)
+    ]
 
     log.append(
         f"[MHLW補填] ジオコーディング完了: 半径{search_radius_m}m内 {len(geocoded)}件"
@@ -2842,29 +7277,19 @@ def fetch_mhlw_medical_supplement(
 
     new_facilities: List["NearbyFacility"] = []
     dup_count = 0
+    osm_index = GridIndex.of(existing_osm, cell_m=dedup_threshold_m)   # v4.5: 総当たり → 空間索引
     for cand, lat, lon, dist in geocoded:
-        is_dup = any(
-            haversine_distance(lat, lon, osm.lat, osm.lon) <= dedup_threshold_m
-            for osm in existing_osm
-        )
+        is_dup = bool(osm_index.within(lat, lon, dedup_threshold_m))
         if is_dup:
             dup_count += 1
             log.append(f"  [重複スキップ] {cand.name} ({dist:.0f}m) ← OSM施設と{dedup_threshold_m:.0f}m以内")
             continue
 
         # 施設タイプ・診療科・外来患者数のデフォルト推定
-        is_hospital = any(kw in cand.name for kw in ["病院", "医療センター", "医療機構", "医院"])
-        fac_type    = "hospital" if is_hospital else "clinic"
+        fac_type    = _guess_facility_type(cand.name)
         specialty   = detect_specialty_from_name(cand.name)
         # v4.2: 診療科別外来患者数テーブルを使用（MHLW補填施設にも適用）
-        # MHLWでリストされているが外来患者数の詳細が取れない施設は、OSM収録施設と同様に
-        # 診療科別基礎値×0.85 で推定。病院は固定120人/日。
-        if fac_type == "hospital":
-            default_op = 120
-        else:
-            sp_key = specialty if specialty in SPECIALTY_OUTPATIENT_TABLE else "不明/その他"
-            sp_d = SPECIALTY_OUTPATIENT_TABLE[sp_key]
-            default_op = max(5, int(sp_d["base"] * 0.85))
+        default_op  = _default_supplement_outpatients(fac_type, specialty)
 
         new_facilities.append(NearbyFacility(
             name=cand.name,
@@ -2928,6 +7353,8 @@ def recalculate_with_manual_facilities(analysis: "FullAnalysis") -> None:
     """
     手動追加施設 + MHLW自動補填施設を含めて方法①②を再計算し、session_state を更新する。
     MHLW・OSM の再検索は行わない（既存のデータを再利用）。
+    v4.5: analysis.ledger（ContributionLedger）で差分だけ再計算する。
+          追加・変更された施設のシェアと、その近傍の門前的競合だけを計算し直す。
 
     データソース優先順位:
       1. analysis.nearby_medical — 初回OSM検索結果（不変）
@@ -2961,11 +7388,17 @@ def recalculate_with_manual_facilities(analysis: "FullAnalysis") -> None:
         label_parts.append(f"手動追加 {len(manual_facs)}件")
     label = "方法①: 近隣医療機関（" + "＋".join(label_parts) + "）"
 
-    m1 = Method1Predictor().predict(
-        analysis.pharmacy_lat, analysis.pharmacy_lon,
-        merged_medical, analysis.nearby_pharmacies,
-        mode_label=label,
-    ) if analysis.pharmacy_lat else None
+    ledger = analysis.ledger
+    m1 = None
+    if analysis.pharmacy_lat:
+        if ledger is None or not ledger.matches(
+            analysis.pharmacy_lat, analysis.pharmacy_lon, analysis.nearby_pharmacies,
+        ):
+            ledger = ContributionLedger(
+                analysis.pharmacy_lat, analysis.pharmacy_lon, analysis.nearby_pharmacies, analysis.geometry,
+            )
+        ledger.sync(merged_medical)
+        m1 = ledger.result(label)
 
     m2 = Method2Predictor().predict(
         analysis.pharmacy_lat, analysis.pharmacy_lon,
@@ -2974,13 +7407,83 @@ def recalculate_with_manual_facilities(analysis: "FullAnalysis") -> None:
         density_source=analysis.area_density_source,
         radius_reason=analysis.commercial_radius_reason,
         nearby_medical=merged_medical,  # v3.2: 門前的競合判定用
+        geometry=analysis.geometry,
+        gate_comp_names=ledger.gate_names() if ledger else None,
     )
 
-    updated = dataclasses.replace(analysis, method1=m1, method2=m2)
+    updated = dataclasses.replace(analysis, method1=m1, method2=m2, ledger=ledger)
     st.session_state["analysis"] = updated
     st.rerun()
 
 
+def _apply_competitor_whatif(
+    analysis: FullAnalysis, competitors: List[NearbyFacility], closed: List[NearbyFacility],
+) -> FullAnalysis:
+    """
+    v4.5: 競合薬局を competitors（営業中）に差し替えて方法①②を再計算した FullAnalysis を返す。
+    外部データは再取得せず、方法①は analysis.ledger で増減した薬局の近傍施設だけ、
+    方法②は門前的競合を台帳から引いて有効競合数だけを計算し直す。
+    台帳は複製してから更新するので、analysis（session_state 上の結果）はそのまま使える。
+    """
+    competitors = sorted(competitors, key=lambda p: p.distance_m)   # 取得時と同じ距離順（閉局を戻すと元の並びになる）
+    ledger = analysis.ledger.copy() if analysis.ledger is not None else None
+    m1 = analysis.method1
+    if ledger is not None:
+        ledger.set_competitors(competitors)
+        m1 = ledger.result(m1.method_name if m1 else "方法①: 近隣医療機関アプローチ")
+    m2 = Method2Predictor().predict(
+        analysis.pharmacy_lat, analysis.pharmacy_lon,
+        competitors,
+        analysis.area_density, analysis.commercial_radius,
+        density_source=analysis.area_density_source,
+        radius_reason=analysis.commercial_radius_reason,
+        nearby_medical=analysis.nearby_medical,  # 台帳がない（座標なし）場合の門前的競合判定用
+        geometry=analysis.geometry,
+        gate_comp_names=ledger.gate_names() if ledger else None,
+    )
+    return dataclasses.replace(
+        analysis, method1=m1, method2=m2, nearby_pharmacies=competitors, closed_pharmacies=closed, ledger=ledger,
+    )
+
+
+def toggle_competitor(analysis: FullAnalysis, pharmacy: NearbyFacility) -> FullAnalysis:
+    """
+    v4.5: 競合薬局の閉局 / 再開を切り替えた FullAnalysis を返す（what-if。session_state は変更しない）。
+    営業中の薬局は閉局扱いに、閉局扱いの薬局は営業中に戻す。仮想出店の薬局（is_manual）は閉局で取り除く。
+    """
+    competitors = list(analysis.nearby_pharmacies)
+    closed = list(analysis.closed_pharmacies)
+    if any(p is pharmacy for p in competitors):
+        competitors = [p for p in competitors if p is not pharmacy]
+        if not pharmacy.is_manual:
+            closed.append(pharmacy)
+    elif any(p is pharmacy for p in closed):
+        closed = [p for p in closed if p is not pharmacy]
+        competitors.append(pharmacy)
+    else:
+        raise ValueError(f"競合薬局ではありません: {pharmacy.name}")
+    return _apply_competitor_whatif(analysis, competitors, closed)
+
+
+def add_hypothetical_competitor(
+    analysis: FullAnalysis, lat: float, lon: float, name: str = "",
+) -> FullAnalysis:
+    """v4.5: (lat, lon) に仮想の競合薬局を出店させた FullAnalysis を返す（what-if。session_state は変更しない）"""
+    n = sum(1 for p in analysis.nearby_pharmacies if p.is_manual)
+    pharmacy = NearbyFacility(
+        name=name or f"仮想競合薬局 #{n + 1}",
+        facility_type="pharmacy",
+        lat=lat,
+        lon=lon,
+        distance_m=haversine_distance(analysis.pharmacy_lat, analysis.pharmacy_lon, lat, lon),
+        is_manual=True,
+        source="manual",
+    )
+    return _apply_competitor_whatif(
+        analysis, list(analysis.nearby_pharmacies) + [pharmacy], list(analysis.closed_pharmacies),
+    )
+
+
 # ---------------------------------------------------------------------------
 # 9. UI レンダリング関数
 # ---------------------------------------------------------------------------
@@ -3190,11 +7693,7 @@ def render_gap_and_manual_input(analysis: "FullAnalysis") -> None:
         # 再実行ボタン（必要な場合のみ）
         if analysis.pharmacy_lat:
             search_r = analysis.commercial_radius + 200
-            pref_code = ""
-            for pref_name, pc in PREFECTURE_CODES.items():
-                if pref_name in analysis.pharmacy_address:
-                    pref_code = pc
-                    break
+            pref_code = pref_code_from_address(analysis.pharmacy_address)
             st.caption(
                 f"補填条件: エリアキーワード **{extract_area_keyword(analysis.pharmacy_address)}** / "
                 f"半径 {search_r}m"
@@ -3368,6 +7867,65 @@ def render_gap_and_manual_input(analysis: "FullAnalysis") -> None:
             st.caption("施設を追加すると「再計算」ボタンが表示されます。")
 
 
+def render_competitor_whatif(analysis: "FullAnalysis", clicked: Optional[Dict] = None) -> None:
+    """
+    v4.5: 競合薬局の閉局・仮想出店の what-if。
+    外部データは再取得せず、変化した薬局の近傍だけ方法①②を再計算して結果を差し替える。
+    clicked: st_folium の last_clicked（{"lat", "lng"}）。あればその地点に仮想競合を出店できる。
+    """
+    n_closed = len(analysis.closed_pharmacies)
+    n_virtual = sum(1 for p in analysis.nearby_pharmacies if p.is_manual)
+    with st.expander(
+        "🟢 競合薬局の開閉シミュレーション（what-if）"
+        + (f"（閉局 {n_closed}件・仮想出店 {n_virtual}件を反映中）" if n_closed or n_virtual else ""),
+        expanded=bool(n_closed or n_virtual),
+    ):
+        def _apply(updated: FullAnalysis) -> None:
+            st.session_state["analysis"] = updated
+            st.rerun()
+
+        last = st.session_state.get("whatif_last")
+        if last:
+            st.caption(last)
+
+        def _timed(label: str, fn, *args) -> FullAnalysis:
+            t0 = time.perf_counter()
+            updated = fn(analysis, *args)
+            elapsed = (time.perf_counter() - t0) * 1000
+            # 再計算は複製した台帳に入るため、元と複製の累計の差が今回の施設数
+            n = (updated.ledger.n_computed - analysis.ledger.n_computed
+                 if updated.ledger and analysis.ledger else 0)
+            st.session_state["whatif_last"] = (
+                f"⏱ {label}: {elapsed:.1f}ms で再計算（方法①のシェア再計算 {n}施設）"
+            )
+            return updated
+
+        st.markdown("**▶ 競合薬局**（「閉局」で商圏から除外・「再開」で復帰、仮想出店は「削除」で取り消し）")
+        rows = [(p, True) for p in analysis.nearby_pharmacies] + [(p, False) for p in analysis.closed_pharmacies]
+        for i, (ph, is_open) in enumerate(rows):
+            c1, c2 = st.columns([5, 1])
+            c1.markdown(
+                f"{'🟢' if is_open else '⚪'} **{ph.name}** / {ph.distance_m:.0f}m"
+                + ("（仮想出店）" if ph.is_manual else "")
+            )
+            label = ("削除" if ph.is_manual else "閉局") if is_open else "再開"
+            if c2.button(label, key=f"whatif_toggle_{i}", use_container_width=True):
+                _apply(_timed(f"{ph.name} を{label}", toggle_competitor, ph))
+
+        st.markdown("---")
+        if clicked and clicked.get("lat") is not None:
+            lat, lon = float(clicked["lat"]), float(clicked["lng"])
+            d = haversine_distance(analysis.pharmacy_lat, analysis.pharmacy_lon, lat, lon)
+            st.markdown(f"📍 クリック地点: {lat:.5f}, {lon:.5f}（当薬局から {d:.0f}m）")
+            whatif_name = st.text_input(
+                "仮想競合薬局名（任意）", placeholder=f"仮想競合薬局 #{n_virtual + 1}", key="whatif_name",
+            )
+            if st.button("➕ クリック地点に仮想競合薬局を出店", key="whatif_add_btn", type="primary"):
+                _apply(_timed("仮想競合薬局を出店", add_hypothetical_competitor, lat, lon, whatif_name.strip()))
+        else:
+            st.caption("地図をクリックすると、その地点に仮想の競合薬局を出店させて再計算できます。")
+
+
 def render_new_pharmacy_comparison(result: NewPharmacyResult) -> None:
     """新規開局モードの予測比較バナー（v2.5/v2.6: 3シナリオ対応）"""
     sc = result.config.scenario
@@ -3672,6 +8230,26 @@ def render_competitor_table(medical, pharmacies, show_rx: bool = False) -> None:
             st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
         else:
             st.info("検索範囲内に競合薬局が見つかりませんでした")
+    render_osm_tag_lookup(list(medical) + list(pharmacies))
+
+
+def render_osm_tag_lookup(facilities: List[NearbyFacility]) -> None:
+    """v4.5: 選んだ施設の全 OSM タグを表示（分析時は保持せず、表示時に osm_ref から引く）"""
+    osm_facs = [f for f in facilities if f.osm_ref]
+    if not osm_facs:
+        return
+    with st.expander("🏷 OSM の全タグを見る"):
+        i = st.selectbox(
+            "施設", range(len(osm_facs)), key="osm_tag_facility",
+            format_func=lambda k: f"{osm_facs[k].name}（{osm_facs[k].osm_ref}）",
+        )
+        if st.button("全タグを取得", key="osm_tag_btn"):
+            tags, source = OverpassSearcher().full_tags(osm_facs[i])
+            if tags is None:
+                st.warning(f"取得できませんでした: {source}")
+            else:
+                st.caption(f"取得元: {source}")
+                st.json(tags)
 
 
 # ---------------------------------------------------------------------------
@@ -3743,11 +8321,7 @@ def _render_local_calibration_section(new_result: "NewPharmacyResult") -> None:
                 st.rerun()
 
         if lc_run:
-            pref_code = ""
-            for pn, pc in PREFECTURE_CODES.items():
-                if pn in new_result.config.address:
-                    pref_code = pc
-                    break
+            pref_code = pref_code_from_address(new_result.config.address)
 
             engine = LocalCalibrationEngine()
             progress = st.progress(0, text="ローカル校正を開始…")
@@ -3937,6 +8511,28 @@ def _render_calibration_tab() -> None:
         help="MHLWで検索するキーワード。地名を入れると特定エリアに絞れます（例: 新宿 薬局）",
     )
 
+    # v4.5: 薬局レジストリ（県内全件をバックグラウンドでクロールし、校正セットを台帳から抽出）
+    with st.expander("📚 薬局レジストリ（都道府県内の全薬局をローカルに取得）"):
+        reg_pref = PREFECTURE_CODES.get(cal_pref, "")
+        job = get_registry_crawl_job()
+        st.caption(f"{cal_pref}: {get_pharmacy_registry().summary(reg_pref)}")
+        st.caption(f"{cal_pref}（医療機関）: {get_medical_registry().summary(reg_pref)}")
+        st.caption("クロール完了後は、校正セットを MHLW に問い合わせずにレジストリから抽出します。"
+                   "医療機関台帳が完了した都道府県では、MHLW補填と外来患者数の付与を台帳から行います。"
+                   "中断しても次回は続きから再開します（CLI: python app_v4_4.py crawl-registry --pref 13 [--medical]）。")
+        reg_target = st.radio("対象", ["薬局", "医療機関"], horizontal=True, key="reg_target",
+                              disabled=job.running)
+        col_start, col_stop = st.columns(2)
+        with col_start:
+            if st.button("▶ クロール開始", key="reg_start", disabled=job.running, use_container_width=True):
+                job.start([reg_pref], medical=(reg_target == "医療機関"))
+                st.rerun()
+        with col_stop:
+            if st.button("⏹ 停止", key="reg_stop", disabled=not job.running, use_container_width=True):
+                job.stop()
+        if job.running or job.last_message:
+            st.caption(f"{'🔄 実行中' if job.running else '⏸ 停止中'}: {job.last_message}")
+
     est_time = int(cal_n * 7 / 60)
     st.info(
         f"⏱ 推定実行時間: 約 {est_time} 分（{cal_n}件 × 約7秒/件）"
@@ -4253,6 +8849,14 @@ def _render_existing_mode() -> None:
             analysis.commercial_radius, analysis.commercial_radius_reason,
             analysis.is_gate_pharmacy, analysis.gate_pharmacy_reason,
         )
+        if analysis.osm_error:
+            st.warning(
+                f"⚠ 近隣施設（OSM）を取得できませんでした: {analysis.osm_error}\n\n"
+                "方法①は近隣医療機関なしとして計算されています。時間をおいて再分析してください。"
+            )
+        if analysis.service_errors:
+            st.warning("⚠ 一部の外部データを取得できませんでした（取得できた範囲で計算）:\n\n"
+                       + "\n".join(f"- {e}" for e in analysis.service_errors))
         st.markdown("---")
         render_comparison_banner(analysis)
         # v2.4: 乖離警告 + 手動施設追加 + 再計算セクション
@@ -4287,7 +8891,9 @@ def _render_existing_mode() -> None:
                     analysis.nearby_pharmacies,
                     analysis.commercial_radius, analysis.geocoder_source,
                 )
-                st_folium(m, width=None, height=520, use_container_width=True)
+                map_state = st_folium(m, width=None, height=520, use_container_width=True)
+                # v4.5: 競合薬局の開閉 what-if（地図のクリック地点に仮想出店）
+                render_competitor_whatif(analysis, (map_state or {}).get("last_clicked"))
             else:
                 st.warning("座標取得失敗のためマップを表示できません")
             # v2.6: 補填後の全施設をテーブルに表示
@@ -4487,6 +9093,14 @@ def _render_new_pharmacy_mode() -> None:
             new_result.commercial_radius, new_result.commercial_radius_reason,
             new_result.is_gate, new_result.gate_reason,
         )
+        if new_result.osm_error:
+            st.warning(
+                f"⚠ 近隣施設（OSM）を取得できませんでした: {new_result.osm_error}\n\n"
+                "既存近隣施設・競合薬局なしとして計算されています。時間をおいて再分析してください。"
+            )
+        if new_result.service_errors:
+            st.warning("⚠ 一部の外部データを取得できませんでした（取得できた範囲で計算）:\n\n"
+                       + "\n".join(f"- {e}" for e in new_result.service_errors))
         st.markdown("---")
         render_new_pharmacy_comparison(new_result)
         st.markdown("---")
@@ -4539,13 +9153,16 @@ def run_analysis(candidate: PharmacyCandidate, try_mhlw_medical: bool = False) -
     # セッション状態を初期化（前回分をクリア）
     st.session_state["mhlw_supplement"] = []
     st.session_state["mhlw_supplement_log"] = []
+    st.session_state.pop("whatif_last", None)   # v4.5: 競合 what-if の再計算表示
 
     # A: MHLW
     progress.progress(10, text="[1/6] MHLW: 薬局詳細を取得中…")
     scraper = MHLWScraper()
     scraper.initialize_session()
-    detail, dmsg = scraper.get_pharmacy_detail(candidate)
-    log.append(f"[MHLW詳細] {dmsg}")
+    detail, dstatus = scraper.fetch_pharmacy_detail(candidate)
+    scraper.close()   # v4.5: セッションをプールに返し、後段の競合薬局・補填の検索で再利用
+    log.append(f"[MHLW詳細] {'OK' if detail is not None else dstatus.error}")
+    service_errors = failed_calls(dstatus)
     mhlw_rx = None
     pharmacy_address = candidate.address
     mhlw_url = candidate.href
@@ -4570,64 +9187,68 @@ def run_analysis(candidate: PharmacyCandidate, try_mhlw_medical: bool = False) -
     gc = GeocoderService()
     lat, lon, geo_msg, geo_src = gc.geocode(pharmacy_address)
     log.append(f"[Geocoding({geo_src})] {geo_msg}")
+    if not lat:
+        service_errors += failed_calls(gc.last_status)
 
     # D: Overpass（OSM）
     nearby_medical, nearby_pharmacies = [], []
+    osm_error = ""
     if lat and lon:
         progress.progress(40, text=f"[4/7] 近隣施設を検索中（半径{search_r}m）…")
-        time.sleep(0.5)
         ov = OverpassSearcher()
         nearby_medical, nearby_pharmacies, ov_msg = ov.search_nearby(lat, lon, search_r)
+        osm_error = ov.last_error
         log.append(f"[OSM] 半径{search_r}m → {ov_msg}")
+        # v4.5: MHLW が遮断中なら MHLW への後続処理（個別検索・補填・外来照会）は行わない
+        mhlw_up = service_available(MHLWScraper.DOMAIN)
+        if not mhlw_up:
+            log.append("[MHLW] 遮断中のため競合薬局の個別検索・医療機関補填をスキップ")
 
-        # D.4: 競合薬局の処方箋枚数を自動取得（v3.2: 常時実行、上位10件）
+        # D.4: 競合薬局の処方箋枚数を自動取得（v3.2: 常時実行 / v4.5: 台帳照合・未照合のみ個別検索）
         if nearby_pharmacies:
-            progress.progress(47, text=f"[4.3/7] 競合薬局（{len(nearby_pharmacies[:10])}件）の処方箋枚数をMHLWから取得中…")
-            rx_scraper = MHLWScraper()
-            rx_scraper.initialize_session()
-            rx_data = rx_scraper.get_rx_for_nearby_pharmacies(
-                [p.name for p in nearby_pharmacies], limit=10
+            progress.progress(47, text=f"[4.3/7] 競合薬局（{len(nearby_pharmacies)}件）の処方箋枚数を取得中…")
+            enrich_competitor_rx(nearby_pharmacies, log,
+                                 live_limit=COMPETITOR_LIVE_LOOKUP_LIMIT if mhlw_up else 0)
+
+        # D.45 (v4.5): 医療機関台帳から OSM 施設に外来患者数の実数を付与（通信なし）
+        if nearby_medical:
+            enrich_medical_outpatients(nearby_medical, log)
+
+        # D.5: MHLW自動補填（v3.1: 常に実行 / v4.5: 台帳クロール済みの都道府県は遮断中でも台帳で補填）
+        mhlw_new_facs: List[NearbyFacility] = []
+        pref_code_auto = pref_code_from_address(pharmacy_address)
+        if mhlw_up or get_medical_registry().is_complete(pref_code_auto):
+            progress.progress(52, text="[4.5/7] MHLWから未収録医療機関を自動補填中…")
+            mhlw_new_facs, mhlw_sup_log = fetch_mhlw_medical_supplement(
+                pharmacy_lat=lat,
+                pharmacy_lon=lon,
+                pharmacy_address=pharmacy_address,
+                pref_code=pref_code_auto,
+                existing_osm=nearby_medical,
+                search_radius_m=search_r,
             )
-            fetched_rx = 0
-            for ph in nearby_pharmacies:
-                if ph.name in rx_data and rx_data[ph.name]:
-                    ph.mhlw_annual_outpatients = rx_data[ph.name]
-                    log.append(f"  [競合薬局MHLW] {ph.name}: {rx_data[ph.name]:,}枚/年")
-                    fetched_rx += 1
-            log.append(f"[競合薬局MHLW] {fetched_rx}/{len(nearby_pharmacies[:10])}件で処方箋枚数取得")
-
-        # D.5: MHLW自動補填（v3.1: 常に実行）
-        progress.progress(52, text="[4.5/7] MHLWから未収録医療機関を自動補填中…")
-        pref_code_auto = ""
-        for pref_name, pc in PREFECTURE_CODES.items():
-            if pref_name in pharmacy_address:
-                pref_code_auto = pc
-                break
-        mhlw_new_facs, mhlw_sup_log = fetch_mhlw_medical_supplement(
-            pharmacy_lat=lat,
-            pharmacy_lon=lon,
-            pharmacy_address=pharmacy_address,
-            pref_code=pref_code_auto,
-            existing_osm=nearby_medical,
-            search_radius_m=search_r,
-        )
-        log.extend(mhlw_sup_log)
+            log.extend(mhlw_sup_log)
         if mhlw_new_facs:
             st.session_state["mhlw_supplement"] = mhlw_new_facs
             st.session_state["mhlw_supplement_log"] = mhlw_sup_log
             log.append(f"[MHLW補填] {len(mhlw_new_facs)}件を自動補填（OSM未収録）")
-        else:
+        elif mhlw_up:
             log.append("[MHLW補填] 新規施設なし（OSMと重複 or 該当なし）")
+        if gc.cache is not None:
+            log.append(f"[Geocodeキャッシュ] {gc.cache.summary()}")
+        if gc.address_index is not None:
+            log.append(f"[位置参照情報] {gc.address_index.summary()}")
 
         # D.6: MHLW外来患者数データ照会（オプション: try_mhlw_medical=True 時）
-        if try_mhlw_medical and nearby_medical:
+        if try_mhlw_medical and nearby_medical and mhlw_up:
             progress.progress(60, text="[4.6/7] 医療施設のMHLWデータ照会中…")
             for fac in nearby_medical[:5]:
                 aop = scraper.get_medical_outpatient_data(fac.name)
                 if aop:
                     fac.mhlw_annual_outpatients = aop
                     fac.daily_outpatients = aop // NATIONAL_STATS["working_days"]
-                time.sleep(0.5)
+        if not service_available(MHLWScraper.DOMAIN):
+            service_errors.append("mhlw: 遮断中（連続失敗のため一時停止）")
 
     # E: 門前判定・商圏半径確定
     # v4.3: pharmacy_type を渡して SM 業態では広域商圏を使う
@@ -4672,14 +9293,22 @@ def run_analysis(candidate: PharmacyCandidate, try_mhlw_medical: bool = False) -
     if mhlw_facs_for_pred: extra_label.append(f"MHLW補填{len(mhlw_facs_for_pred)}件含む")
     if manual_facs:        extra_label.append(f"手動追加{len(manual_facs)}件含む")
     m1_label = "方法①: 近隣医療機関アプローチ" + (f"（{', '.join(extra_label)}）" if extra_label else "")
-    m1 = Method1Predictor().predict(
-        lat or 0.0, lon or 0.0, merged_medical, nearby_pharmacies,
-        mode_label=m1_label,
-    ) if lat else None
+    # v4.5: 分析の幾何コンテキスト（OSM 解析時の地点距離を取り込み、再計算でも使い回す）
+    geometry = AreaGeometry(lat or 0.0, lon or 0.0)
+    geometry.seed_site_distances(nearby_medical)
+    # v4.5: 施設別寄与を台帳に残し、以後の手動追加・削除は差分だけ再計算する
+    ledger: Optional[ContributionLedger] = None
+    m1 = None
+    if lat:
+        ledger = ContributionLedger(lat, lon or 0.0, nearby_pharmacies, geometry)
+        ledger.sync(merged_medical)
+        m1 = ledger.result(m1_label)
     m2 = Method2Predictor().predict(
         lat or 0.0, lon or 0.0, nearby_pharmacies, area_density, commercial_r,
         density_source=density_source, radius_reason=r_reason,
         nearby_medical=merged_medical,  # v3.2: 門前的競合判定用
+        geometry=geometry,
+        gate_comp_names=ledger.gate_names() if ledger else None,
     )
     progress.progress(100, text="完了！")
     progress.empty()
@@ -4703,6 +9332,10 @@ def run_analysis(candidate: PharmacyCandidate, try_mhlw_medical: bool = False) -
         is_gate_pharmacy=is_gate,
         gate_pharmacy_reason=gate_reason,
         search_log=log,
+        osm_error=osm_error,
+        service_errors=service_errors,
+        geometry=geometry,
+        ledger=ledger,
     )
     st.rerun()
 
@@ -4732,41 +9365,37 @@ def run_new_pharmacy_analysis(config: NewPharmacyConfig) -> None:
     gc = GeocoderService()
     lat, lon, geo_msg, geo_src = gc.geocode(config.address)
     log.append(f"[Geocoding({geo_src})] {geo_msg}")
+    service_errors = failed_calls(gc.last_status) if not lat else []
 
     # C: Overpass — 近隣施設検索
     nearby_medical: List[NearbyFacility] = []
     nearby_pharmacies: List[NearbyFacility] = []
+    osm_error = ""
     if lat and lon:
         progress.progress(40, text=f"[3/5] 近隣施設を検索中（半径{search_r}m）…")
-        time.sleep(0.5)
         ov = OverpassSearcher()
         nearby_medical, nearby_pharmacies, ov_msg = ov.search_nearby(lat, lon, search_r)
+        osm_error = ov.last_error
         log.append(f"[OSM] 半径{search_r}m → {ov_msg}")
+        # v4.5: MHLW が遮断中なら個別検索・補填は行わない
+        mhlw_up = service_available(MHLWScraper.DOMAIN)
+        if not mhlw_up:
+            log.append("[MHLW] 遮断中のため競合薬局の個別検索・医療機関補填をスキップ")
 
-        # 競合薬局の処方箋枚数を自動取得（v3.2: 常時実行、上位10件）
+        # 競合薬局の処方箋枚数を自動取得（v3.2: 常時実行 / v4.5: 台帳照合・未照合のみ個別検索）
         if nearby_pharmacies:
-            progress.progress(55, text=f"[3.5/5] 競合薬局（{len(nearby_pharmacies[:10])}件）の処方箋枚数をMHLWから取得中…")
-            rx_scraper2 = MHLWScraper()
-            rx_scraper2.initialize_session()
-            rx_data = rx_scraper2.get_rx_for_nearby_pharmacies(
-                [p.name for p in nearby_pharmacies], limit=10
-            )
-            fetched_rx2 = 0
-            for ph in nearby_pharmacies:
-                if ph.name in rx_data and rx_data[ph.name]:
-                    ph.mhlw_annual_outpatients = rx_data[ph.name]
-                    log.append(f"  [競合薬局MHLW] {ph.name}: {rx_data[ph.name]:,}枚/年")
-                    fetched_rx2 += 1
-            log.append(f"[競合薬局MHLW] {fetched_rx2}/{len(nearby_pharmacies[:10])}件で処方箋枚数取得")
-
-        # v3.1: MHLW医療機関エリア自動補填（常時実行）
-        if lat:
+            progress.progress(55, text=f"[3.5/5] 競合薬局（{len(nearby_pharmacies)}件）の処方箋枚数を取得中…")
+            enrich_competitor_rx(nearby_pharmacies, log,
+                                 live_limit=COMPETITOR_LIVE_LOOKUP_LIMIT if mhlw_up else 0)
+
+        # v4.5: 医療機関台帳から OSM 施設に外来患者数の実数を付与（通信なし）
+        if nearby_medical:
+            enrich_medical_outpatients(nearby_medical, log)
+
+        # v3.1: MHLW医療機関エリア自動補填（常時実行 / v4.5: 台帳クロール済みの都道府県は遮断中でも実行）
+        pref_code = pref_code_from_address(config.address)
+        if lat and (mhlw_up or get_medical_registry().is_complete(pref_code)):
             progress.progress(58, text="[3.7/5] MHLWから未収録医療機関を自動補填中…")
-            pref_code = ""
-            for pref_name, pc in PREFECTURE_CODES.items():
-                if pref_name in config.address:
-                    pref_code = pc
-                    break
             new_facs, sup_log = fetch_mhlw_medical_supplement(
                 pharmacy_lat=lat,
                 pharmacy_lon=lon,
@@ -4779,9 +9408,15 @@ def run_new_pharmacy_analysis(config: NewPharmacyConfig) -> None:
             if new_facs:
                 nearby_medical = nearby_medical + new_facs
                 log.append(f"[MHLW補填] {len(new_facs)}件を近隣医療機関に追加")
+            if gc.cache is not None:
+                log.append(f"[Geocodeキャッシュ] {gc.cache.summary()}")
+            if gc.address_index is not None:
+                log.append(f"[位置参照情報] {gc.address_index.summary()}")
 
         # 医療機関密集補正: デフォルト外来患者数を持つ施設が多い場合、患者分散を反映
         nearby_medical = apply_clinic_congestion_factor(nearby_medical, log)
+        if not service_available(MHLWScraper.DOMAIN):
+            service_errors.append("mhlw: 遮断中（連続失敗のため一時停止）")
 
     # D: 商圏半径確定
     progress.progress(65, text="[4/5] 門前判定・商圏半径を確定中…")
@@ -4802,6 +9437,9 @@ def run_new_pharmacy_analysis(config: NewPharmacyConfig) -> None:
     method1_gate: Optional[PredictionResult] = None
     method1_area: Optional[PredictionResult] = None
     method2:      Optional[PredictionResult] = None
+    # v4.5: 分析の幾何コンテキスト（シナリオ間・再計算で距離・空間索引を使い回す）
+    geometry = AreaGeometry(lat or 0.0, lon or 0.0)
+    geometry.seed_site_distances(nearby_medical)
 
     if lat:
         # -----------------------------------------------------------
@@ -4811,7 +9449,7 @@ def run_new_pharmacy_analysis(config: NewPharmacyConfig) -> None:
         if need_area:
             method1_area = Method1Predictor().predict(
                 lat, lon, nearby_medical, nearby_pharmacies,
-                mode_label="シナリオB: 面での集客（既存近隣施設）"
+                mode_label="シナリオB: 面での集客（既存近隣施設）", geometry=geometry,
             )
             log.append(f"[方法①(面のみ)] 推計: {method1_area.annual_rx:,}枚/年")
 
@@ -4833,7 +9471,7 @@ def run_new_pharmacy_analysis(config: NewPharmacyConfig) -> None:
             all_medical_with_gate = [virtual_clinic] + nearby_medical
             method1_gate = Method1Predictor().predict(
                 lat, lon, all_medical_with_gate, nearby_pharmacies,
-                mode_label="シナリオC/A: 門前クリニック誘致込み"
+                mode_label="シナリオC/A: 門前クリニック誘致込み", geometry=geometry,
             )
             log.append(f"[方法①(門前込み)] 推計: {method1_gate.annual_rx:,}枚/年")
             if method1_area:
@@ -4850,6 +9488,7 @@ def run_new_pharmacy_analysis(config: NewPharmacyConfig) -> None:
             density_source=density_source, radius_reason=r_reason,
             nearby_medical=nearby_medical,  # v3.2: 門前的競合判定用
             pharmacy_type=config.pharmacy_type,  # v4.4: SM業態補正を適用
+            geometry=geometry,
         )
         log.append(f"[方法②(商圏人口)] 推計: {method2.annual_rx:,}枚/年"
                    + (f" ※SM業態補正適用" if config.pharmacy_type == PHARMACY_TYPE_SUPERMARKET else ""))
@@ -4874,9 +9513,334 @@ def run_new_pharmacy_analysis(config: NewPharmacyConfig) -> None:
         method1_area=method1_area,
         method2=method2,
         search_log=log,
+        osm_error=osm_error,
+        service_errors=service_errors,
+        geometry=geometry,
     )
     st.rerun()
 
 
+# ---------------------------------------------------------------------------
+# 12. v4.5: 保守用コマンドライン
+# ---------------------------------------------------------------------------
+# `streamlit run app_v4_4.py` では従来どおり UI を起動し、
+# `python app_v4_4.py <コマンド> ...` でローカルDBの保守処理を実行する。
+
+class _CannedHTTP:
+    """self-check 用: URL の末尾（"status" / "interpreter"）ごとに決まった応答を返す（通信しない）"""
+
+    def __init__(self, responses: Dict[str, Tuple[int, str]]):
+        self.responses = responses
+        self.calls: List[str] = []
+
+    def _respond(self, url: str) -> requests.Response:
+        path = url.rsplit("/", 1)[-1]
+        self.calls.append(path)
+        status_code, text = self.responses[path]
+        r = requests.Response()
+        r.status_code, r.url, r.encoding = status_code, url, "utf-8"
+        r._content, r._content_consumed = text.encode("utf-8"), True
+        return r
+
+    def get(self, url: str, **_kw) -> requests.Response:
+        return self._respond(url)
+
+    def post(self, url: str, **_kw) -> requests.Response:
+        return self._respond(url)
+
+
+def _check_overpass_breaker() -> List[Tuple[str, bool, str]]:
+    """/api/status が 200・/api/interpreter が 504 のミラーで、interpreter のブレーカーが開くか"""
+    url = f"https://overpass-self-check-{os.getpid()}-{time.time_ns()}.invalid/api/interpreter"
+    http = _CannedHTTP({"status": (200, "Rate limit: 2\n2 slots available now.\n"),
+                        "interpreter": (504, "Gateway Timeout")})
+    scheduler = OverpassScheduler([url], max_queue_wait_s=5.0, session=http)
+    breaker = get_circuit_breaker(OverpassScheduler._host(url))
+    kinds = []
+    for _ in range(6):
+        _, status = scheduler.run("[out:json];node(0,0,0,0);out;")
+        kinds.append(status.kind)
+    n_posts = http.calls.count("interpreter")
+    return [
+        ("overpass: interpreter の 5xx 連続でブレーカーが開く", breaker.state == CircuitBreaker.OPEN,
+         f"state={breaker.state} / 結果={kinds}"),
+        ("overpass: 遮断後は interpreter に問い合わせない", n_posts == CIRCUIT_FAILURE_THRESHOLD,
+         f"POST {n_posts}回（閾値 {CIRCUIT_FAILURE_THRESHOLD}）"),
+    ]
+
+
+# 住所 → (郡, 市区町村)
+_ADDRESS_CHECK_CASES: List[Tuple[str, str, str]] = [
+    ("愛知県蒲郡市港町1-1", "", "蒲郡市"),
+    ("奈良県大和郡山市北郡山町1-1", "", "大和郡山市"),
+    ("福島県郡山市朝日1-1-1", "", "郡山市"),
+    ("北海道虻田郡倶知安町北1条東1-1", "虻田郡", "倶知安町"),
+    ("埼玉県入間郡三芳町藤久保1100-1", "入間郡", "三芳町"),
+    ("三重県四日市市諏訪町1-5", "", "四日市市"),
+    ("東京都東村山市本町1-2-3", "", "東村山市"),
+    ("北海道余市郡余市町黒川町1-1", "余市郡", "余市町"),
+    ("奈良県高市郡明日香村岡1", "高市郡", "明日香村"),
+    ("山形県東村山郡山辺町山辺1-1", "東村山郡", "山辺町"),
+]
+
+
+def _check_address_parser() -> List[Tuple[str, bool, str]]:
+    """parse_address の郡・市区町村の分解"""
+    results = []
+    for address, county, city in _ADDRESS_CHECK_CASES:
+        parsed = parse_address(address)
+        results.append((f"住所: {address}", (parsed.county, parsed.city) == (county, city),
+                        f"郡={parsed.county!r} 市区町村={parsed.city!r}（期待: {county!r} {city!r}）"))
+    return results
+
+
+def _boundary_offsets(distance: Callable[[float], float], target_m: float) -> Tuple[float, float]:
+    """
+    distance(x) が単調増加のとき、distance(x) <= target_m となる最大の x とその次の浮動小数点数
+    （境界のちょうど内側・外側）を二分法で求める
+    """
+    lo, hi = 0.0, 0.01
+    while lo < hi and math.nextafter(lo, hi) < hi:
+        mid = (lo + hi) / 2
+        if distance(mid) <= target_m:
+            lo = mid
+        else:
+            hi = mid
+    return lo, hi
+
+
+def _m1_edge_scenarios() -> List[Tuple[str, float, float, List[NearbyFacility], List[NearbyFacility]]]:
+    """方法①のエンジン比較用の境界ケース → [(名前, 薬局緯度, 薬局経度, 医療機関, 競合薬局)]"""
+    lat0, lon0 = 35.6812, 139.7671
+
+    def fac(name: str, lat: float, lon: float, outpatients: int = 60) -> NearbyFacility:
+        return NearbyFacility(name=name, facility_type="clinic", lat=lat, lon=lon,
+                              distance_m=haversine_distance(lat0, lon0, lat, lon), daily_outpatients=outpatients)
+
+    def comp(name: str, lat: float, lon: float) -> NearbyFacility:
+        return NearbyFacility(name=name, facility_type="pharmacy", lat=lat, lon=lon,
+                              distance_m=haversine_distance(lat0, lon0, lat, lon))
+
+    scenarios = []
+    # 競合薬局が医療機関からちょうど50m・300mの内側／外側（門前判定 ≤50m・Huff ≤300m / <300m）
+    f_lat = lat0 + 200 / 111_000
+    medical = [fac("境界医療機関", f_lat, lon0)]
+    pharmacies = []
+    for d in (50.0, 300.0):
+        for sign, label in ((1, "北"), (-1, "南")):
+            inside, outside = _boundary_offsets(
+                lambda x: haversine_distance(f_lat, lon0, f_lat + sign * x, lon0), d)
+            pharmacies += [comp(f"{label}{d:.0f}m内", f_lat + sign * inside, lon0),
+                           comp(f"{label}{d:.0f}m外", f_lat + sign * outside, lon0)]
+    scenarios.append(("門前50m・Huff300mの境界", lat0, lon0, medical, pharmacies))
+    scenarios.append(("Huff300mの境界のみ", lat0, lon0, medical, [p for p in pharmacies if "300" in p.name]))
+    # 医療機関が当薬局からちょうど50m・150m・300mの内側／外側（距離帯別ベース）
+    banded = []
+    for d in (50.0, 150.0, 300.0):
+        inside, outside = _boundary_offsets(lambda x: haversine_distance(lat0, lon0 + x, lat0, lon0), d)
+        banded += [fac(f"帯{d:.0f}m内", lat0, lon0 + inside), fac(f"帯{d:.0f}m外", lat0, lon0 + outside)]
+    scenarios.append(("距離帯の境界", lat0, lon0, banded, []))
+    # 競合薬局なし・同一地点（医療機関＝当薬局＝競合）・外来0の施設
+    _, _, synthetic, _ = _synthetic_m1_scenario(30, 0, seed=21)
+    scenarios.append(("競合薬局なし", lat0, lon0, synthetic, []))
+    scenarios.append(("同一地点", lat0, lon0, [fac("同一地点医療機関", lat0, lon0)],
+                      [comp("同一地点薬局", lat0, lon0), comp("同一地点薬局2", lat0, lon0)]))
+    zero = [dataclasses.replace(f, daily_outpatients=0 if i % 3 == 0 else f.daily_outpatients)
+            for i, f in enumerate(synthetic)]
+    scenarios.append(("外来0の施設を含む", lat0, lon0, zero + [fac("外来0", lat0, lon0, 0)], pharmacies))
+    return scenarios
+
+
+def _check_m1_engines() -> List[Tuple[str, bool, str]]:
+    """方法①の python / numpy エンジンが境界ケースでも同じシェア・根拠・年間枚数を返すか"""
+    if np is None:
+        return [("方法①: numpy エンジン", True, "numpy 未導入のため比較なし（python エンジンのみ）")]
+    results = []
+    for name, lat, lon, medical, pharmacies in _m1_edge_scenarios():
+        outputs = {}
+        for engine in ("python", "numpy"):
+            predictor = Method1Predictor(engine=engine)
+            targets = [f for f in medical if f.daily_outpatients != 0]
+            outputs[engine] = (predictor.calc_shares(targets, lat, lon, pharmacies),
+                               predictor.predict(lat, lon, medical, pharmacies))
+        (sh_py, res_py), (sh_np, res_np) = outputs["python"], outputs["numpy"]
+        mismatches = [
+            f"{fac.name}: {ra} / {rb}"
+            for fac, (a, ra), (b, rb) in zip([f for f in medical if f.daily_outpatients != 0], sh_py, sh_np)
+            if ra != rb or abs(a - b) > 1e-9 * max(abs(a), 1e-12)
+        ]
+        ok = not mismatches and len(sh_py) == len(sh_np) and res_py.annual_rx == res_np.annual_rx
+        detail = (f"{len(sh_py)}施設・年間 {res_py.annual_rx:,} / {res_np.annual_rx:,}枚"
+                  + (f"・不一致 {mismatches[0]}" if mismatches else ""))
+        results.append((f"方法①エンジン一致: {name}", ok, detail))
+    return results
+
+
+def run_self_checks() -> List[Tuple[str, bool, str]]:
+    """v4.5: 通信なしで実行できる回帰チェック → [(項目, 合否, 詳細)]"""
+    return _check_address_parser() + _check_overpass_breaker() + _check_m1_engines()
+
+
+CLI_COMMANDS: Tuple[str, ...] = (
+    "ingest-address-points", "purge-cache", "import-osm", "bench-parsers", "reparse-snapshots",
+    "crawl-registry", "bench-m1", "self-check",
+)
+
+
+def _cli(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(
+        prog="app_v4_4.py", description="薬局処方箋予測ツール 保守用コマンド（v4.5）",
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser(
+        "ingest-address-points",
+        help="国土交通省 位置参照情報（街区 / 大字・町丁目）CSV を取り込む",
+    )
+    p.add_argument("paths", nargs="+", help="CSV または CSV を含む ZIP")
+    p.add_argument("--encoding", default="cp932", help="CSV の文字コード（既定: cp932）")
+    p.add_argument("--db", default=None, help="取り込み先 SQLite（既定: CACHE_DIR 配下）")
+
+    p = sub.add_parser("purge-cache", help="期限切れのジオコード・Overpass キャッシュを削除する")
+    p.add_argument("--all", action="store_true", help="Overpass キャッシュを期限に関係なく全削除")
+
+    p = sub.add_parser(
+        "import-osm", help="地域の OSM 抽出（.osm/.osm.bz2/.osm.gz）または Overpass JSON を取り込む",
+    )
+    p.add_argument("paths", nargs="+", help="OSM XML または Overpass JSON")
+    p.add_argument("--replace", action="store_true", help="既存の取り込みを破棄してから取り込む")
+    p.add_argument("--db", default=None, help="取り込み先 SQLite（既定: CACHE_DIR 配下）")
+
+    p = sub.add_parser("bench-parsers", help="保存済み MHLW ページで lxml / bs4 解析器の速度と結果一致を比較する")
+    p.add_argument("paths", nargs="*", help="HTML ファイルまたはディレクトリ")
+    p.add_argument("--repeat", type=int, default=3, help="繰り返し回数（既定: 3）")
+    p.add_argument("--snapshots", action="store_true", help="MHLW スナップショットの最新ページも対象にする")
+
+    p = sub.add_parser("reparse-snapshots", help="保存済み MHLW ページを現在の解析器で通信なしに再解析する")
+    p.add_argument("--db", default=None, help="スナップショット SQLite（既定: CACHE_DIR 配下）")
+    p.add_argument("--url-like", default="%", help="対象 URL の LIKE パターン（既定: 全件）")
+    p.add_argument("--show", type=int, default=0, help="詳細ページの解析結果を先頭から N 件表示")
+
+    p = sub.add_parser("crawl-registry", help="都道府県内の全薬局を MHLW から取得して薬局レジストリに保存する")
+    p.add_argument("--pref", action="append", default=[], help="都道府県コード（例: 13。複数指定可）")
+    p.add_argument("--all", action="store_true", help="47都道府県すべて")
+    p.add_argument("--restart", action="store_true", help="途中経過を破棄して一覧の1ページ目からやり直す")
+    p.add_argument("--refresh-days", type=float, default=REGISTRY_REFRESH_S / 86_400,
+                   help="これより古い詳細を取り直す日数（既定: 180）")
+    p.add_argument("--medical", action="store_true",
+                   help="薬局の代わりに医療機関（外来患者数つき）を医療機関レジストリに保存する")
+
+    p = sub.add_parser("bench-m1", help="方法①の python / numpy エンジンを合成データで比較する（速度・結果一致）")
+    p.add_argument("--sizes", type=int, nargs="+", default=[50, 500, 5_000], help="医療機関数（既定: 50 500 5000）")
+    p.add_argument("--repeat", type=int, default=3, help="各エンジンの計測回数（平均を表示）")
+
+    sub.add_parser("self-check", help="通信なしの回帰チェック（住所の分解・Overpass の遮断判定）を実行する")
+
+    args = parser.parse_args(argv)
+    if args.command == "self-check":
+        results = run_self_checks()
+        for name, ok, detail in results:
+            print(f"  {'OK ' if ok else 'NG '} {name} — {detail}")
+        return 0 if all(ok for _, ok, _ in results) else 1
+    if args.command == "crawl-registry":
+        codes = list(PREFECTURE_CODES.values()) if args.all else args.pref
+        if not codes:
+            print("--pref または --all を指定してください")
+            return 2
+        crawler = (MedicalRegistryCrawler(registry=MedicalRegistry()) if args.medical
+                   else RegistryCrawler(registry=PharmacyRegistry()))
+        ok = True
+        for code in codes:
+            try:
+                ok &= crawler.crawl(code, progress_cb=print, restart=args.restart,
+                                    refresh_s=args.refresh_days * 86_400)
+            except KeyboardInterrupt:
+                print("中断しました（次回は続きから再開します）")
+                return 130
+            print(crawler.registry.summary(code))
+        return 0 if ok else 1
+    elif args.command == "bench-m1":
+        if np is None:
+            print("numpy が未導入のため python エンジンのみ計測します")
+        ok = True
+        for row in benchmark_m1_engines(args.sizes, repeat=args.repeat):
+            line = (f"  医療機関 {row['facilities']:>6,}件 × 競合 {row['pharmacies']:>5,}件:"
+                    f" python {row['python_ms']:9.1f}ms")
+            if "numpy_ms" in row:
+                line += (f" / numpy {row['numpy_ms']:8.1f}ms"
+                         f"（×{row['python_ms'] / max(row['numpy_ms'], 1e-9):.1f}）"
+                         f" annual_rx差 {row['annual_diff']} / シェア不一致 {row['mismatches']}件")
+                ok &= row["annual_diff"] <= 1 and row["mismatches"] == 0
+            print(line)
+        return 0 if ok else 1
+    elif args.command == "bench-parsers":
+        pages = []
+        for path in _iter_html_files(args.paths):
+            with open(path, encoding="utf-8", errors="replace") as f:
+                pages.append((path, f.read()))
+        if args.snapshots:
+            pages.extend((url, html) for url, _, html in MHLWSnapshotStore().iter_latest())
+        if not pages:
+            print("HTML ファイルがありません")
+            return 1
+        results = benchmark_mhlw_parsers(pages, repeat=args.repeat)
+        base_s = results["bs4"]["total_s"]
+        print(f"{len(pages):,}ページ × {args.repeat}回")
+        for backend, res in results.items():
+            print(
+                f"  {backend:5s}: {res['total_s']:.3f}秒 / {res['ms_per_page']:.2f}ms/ページ"
+                f"（bs4比 ×{base_s / max(res['total_s'], 1e-9):.1f}）"
+                f" 結果不一致 {len(res['mismatches'])}件"
+            )
+            for name in res["mismatches"][:5]:
+                print(f"      {name}")
+    elif args.command == "reparse-snapshots":
+        store = MHLWSnapshotStore(args.db)
+        scraper = MHLWScraper(snapshots=store)
+        t0 = time.time()
+        n_list = n_detail = n_cands = n_rx = 0
+        for url, fetched, html in store.iter_latest(args.url_like):
+            if "/S2400/" in url:
+                cands, _ = scraper._parse_candidate_list(html)
+                n_list += 1
+                n_cands += len(cands)
+                continue
+            data = scraper._parse_detail(html)
+            n_detail += 1
+            if data.get("prescriptions_annual"):
+                n_rx += 1
+            if n_detail <= args.show:
+                fetched_s = datetime.fromtimestamp(fetched).strftime("%Y-%m-%d")
+                print(f"  [{fetched_s}] {url}\n      処方箋: {data.get('prescriptions_annual')}"
+                      f" / 所在地: {data.get('address', '')}")
+        print(
+            f"一覧 {n_list:,}ページ（候補 {n_cands:,}件） / 詳細 {n_detail:,}ページ"
+            f"（処方箋数あり {n_rx:,}件） — {time.time() - t0:.1f}秒（解析器: {scraper.parser.name}）"
+        )
+        print(store.summary())
+    elif args.command == "import-osm":
+        store = LocalOSMStore(args.db)
+        for i, path in enumerate(args.paths):
+            t0 = time.time()
+            n = store.import_file(path, replace=args.replace and i == 0)
+            print(f"{path}: {n:,}件 ({time.time() - t0:.1f}秒)")
+        print(store.summary())
+    elif args.command == "purge-cache":
+        n_geo = GeocodeCache().purge_expired()
+        ov = OverpassCache()
+        n_ov = ov.clear() if args.all else ov.purge_expired()
+        print(f"ジオコード: {n_geo:,}件 / Overpass: {n_ov:,}件 を削除")
+    elif args.command == "ingest-address-points":
+        index = AddressPointIndex(args.db)
+        for path in args.paths:
+            t0 = time.time()
+            n = index.ingest(path, encoding=args.encoding)
+            print(f"{path}: {n:,}行 ({time.time() - t0:.1f}秒)")
+        print(index.summary())
+    return 0
+
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] in CLI_COMMANDS:
+        sys.exit(_cli(sys.argv[1:]))
     main()